@@ -26,6 +26,7 @@ class InputForm extends React.Component {
       cc_last4: "",
       device_ad_id: "",
       twitter_handle: "",
+      gov_photo_id: "",
       usrchoice: "top_choice"
     };
 
@@ -44,7 +45,7 @@ class InputForm extends React.Component {
     event.preventDefault()
     const r = window.confirm("You're about to initiate email conversations with 90-500+ data brokers. Are you sure you want to proceed?")
     if (r === true){
-    axios.post('http://localhost:5000/privacyAPI/v1/', this.state)
+    axios.post('/privacyAPI/v1/', this.state)
     .then(function (response) {
       console.log(response);
     })
@@ -55,6 +56,18 @@ class InputForm extends React.Component {
   }
 }
 
+  handlePhotoChange = (event) => {
+    // Sent as a data URL; the backend downscales it and attaches it only for brokers that require it
+    const file = event.target.files[0];
+    if (!file) {
+      this.setState({ gov_photo_id: "" });
+      return;
+    }
+    const reader = new FileReader();
+    reader.onload = () => this.setState({ gov_photo_id: reader.result });
+    reader.readAsDataURL(file);
+  }
+
   handleInputChange = (event) => {
     event.preventDefault()
     this.setState({
@@ -282,6 +295,22 @@ class InputForm extends React.Component {
                               <input name="device_ad_id" value={device_ad_id} onChange={this.handleInputChange} id="device ad id" type="device ad id" className="form-input w-full text-gray-300" placeholder="6GF-443-E21" />
                             </div>
                         </div>
+                      {/* gov_photo_id */}
+                      <div className="flex max-w-sm flex-wrap -mx-3 mb-4">
+                          <div className="w-full px-3">
+                            <ul className="flex flex-grow flex-wrap items-end">
+                              <li>
+                                <label className="block text-gray-300 text-sm font-medium mb-1" htmlFor="Government Photo ID">Government Photo ID </label>
+                              </li>
+                              <li>
+                                <Dropdown title="&#9432;" style="display: none;">
+                                  <p className="block text-gray-300 text-sm font-medium py-2 px-4 leading-tight">5% of companies on our list need a photo of a government ID to verify your identity. It is only attached to the requests sent to those companies.</p>
+                                </Dropdown>
+                              </li>
+                            </ul>
+                            <input name="gov_photo_id" onChange={this.handlePhotoChange} id="government photo id" type="file" accept="image/jpeg,image/png,image/gif" className="form-input w-full text-gray-300" />
+                          </div>
+                      </div>
                       {/* twitter_handle */}
                       <div className="flex max-w-sm flex-wrap -mx-3 mb-4 pb-8">
                             <div className="w-full px-3">
@@ -6,9 +6,10 @@ from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.auth.transport.requests import Request
 
 
-def Create_Service(client_secret_file, api_name, api_version, *scopes):
+def Create_Service(client_secret_file, api_name, api_version, *scopes, pickle_file=None):
     '''
     This function initiates the OAuth 
+    pickle_file overrides the default token file, so several accounts can keep their own tokens.
     '''
     print(client_secret_file, api_name, api_version, scopes, sep='-')
     CLIENT_SECRET_FILE = client_secret_file
@@ -18,7 +19,8 @@ def Create_Service(client_secret_file, api_name, api_version, *scopes):
 
     cred = None
 
-    pickle_file = f'token_{API_SERVICE_NAME}_{API_VERSION}.pickle'
+    if pickle_file is None:
+        pickle_file = f'token_{API_SERVICE_NAME}_{API_VERSION}.pickle'
 
     if os.path.exists(pickle_file):
         with open(pickle_file, 'rb') as token:
@@ -0,0 +1,21 @@
+"""
+Admin token for the server's diagnostic features.
+
+One token, set with PRIVACYBOT_ADMIN_TOKEN, unlocks them all: the
+/admin/memory endpoint (X-PrivacyBot-Admin header, see memory_watchdog.py)
+and profiling a single request (X-PrivacyBot-Profile header, see
+profiling.py). Without the variable nothing is unlocked.
+"""
+
+import hmac
+import os
+
+ADMIN_HEADER = 'X-PrivacyBot-Admin'
+
+_ADMIN_TOKEN = os.environ.get('PRIVACYBOT_ADMIN_TOKEN', '')
+
+
+def admin_authorized(header_value):
+    """Return whether a request header value is the admin token (compared in constant time)."""
+    return bool(header_value and _ADMIN_TOKEN
+                and hmac.compare_digest(header_value.encode(), _ADMIN_TOKEN.encode()))
@@ -6,11 +6,36 @@ Email logic in corefunctions.py
 from flask import Flask, request, Response, jsonify
 from flask_cors import CORS
 import json
-from corefunctions import csv_to_map, sendEmail, privacyAPI
+from corefunctions import csv_to_map, sendEmail, privacyAPI, getSenderPool, previewCampaign
+from campaign_scheduler import get_scheduler
+from registry_snapshot import services_for_choice, DEFAULT_REGISTRY_CSV
+from registry_versions import get_registry_versions
 from auto_updater import setup_auto_updater 
+from profiling import request_profiler, PROFILE_HEADER
+from logging_setup import setup_logging
+from tracing import campaign_trace, span
+from handoff import HandoffServer, LISTEN_FD_ENV
+from static_assets import StaticAssets
+from attachments import AttachmentError, MAX_UPLOAD_BYTES
+from preview import DEFAULT_PAGE_SIZE
+from memory_watchdog import get_memory_watchdog
+from admin import admin_authorized, ADMIN_HEADER
+from config import ConfigError, get_config
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-cors = CORS(app, resources={r"/privacyAPI/*": {"origins": "http://localhost:3000"}})
+# Request bodies carry at most a base64-encoded photo ID upload
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+# The built React UI (PB_UI/build) is served from the same origin as the API
+ui_assets = StaticAssets(app.wsgi_app)
+app.wsgi_app = ui_assets
+# The committed build still posts to http://localhost:5000/privacyAPI/v1/, so the API stays reachable
+# from the React dev server and from the UI opened at 127.0.0.1 until that build is replaced
+cors = CORS(app, resources={r"/privacyAPI/*": {"origins": ["http://localhost:3000", "http://127.0.0.1:5000"]}})
 
 # privacyAPI - initiates CCPA data delete requests
 @app.route('/privacyAPI/v1/', methods=["POST"])
@@ -19,23 +44,124 @@ def executePrivacyAPI():
     This function runs the privacyAPI for live data brokers
     Cookie check: The cookie "live-test: true" is required to run this function
     '''
-    usrjson = request.get_json()
-    services = {}
-    all_services, top_choice, people_search = csv_to_map("services_list_06May2021.csv")
-    print("usrjson['usrchoice'] = ", usrjson['usrchoice'])
-    if usrjson['usrchoice'] == 'all_services':
-        services = all_services
-    elif usrjson['usrchoice'] == 'top_choice':
-        services = top_choice
-    else:
-        services = people_search
+    # Profiled only with PRIVACYBOT_PROFILE=1 or the admin profiling header (see profiling.py),
+    # traced only with PRIVACYBOT_TRACE=1 (see tracing.py)
+    with request_profiler(request.headers.get(PROFILE_HEADER)), campaign_trace():
+        usrjson = request.get_json()
+        logger.info(f"usrchoice = {usrjson['usrchoice']}")
+        with span('registry.load'):
+            services = services_for_choice(usrjson['usrchoice'])
+            registry_version = get_registry_versions().record_version(DEFAULT_REGISTRY_CSV)
+        try:
+            result = privacyAPI(usrjson, services, registry_version)
+        except AttachmentError as e:
+            logger.warning(f"Rejected photo ID upload: {e}")
+            return json.dumps({"error": str(e)}), 400
     return json.dumps({
-        "return": privacyAPI(usrjson, services)
+        "return": result
     }), 200
 
+# Preview - the requests /privacyAPI/v1/ would send for the same payload, one page at a time
+@app.route('/privacyAPI/v1/preview', methods=["POST"])
+def previewPrivacyAPI():
+    '''
+    Returns a page of the rendered requests without sending anything.
+    Query parameters: page, per_page, and the filters category, search and field.
+    Identical bodies are sent once in "bodies" and referenced by each request's body_id.
+    '''
+    usrjson = request.get_json()
+    services = services_for_choice(usrjson['usrchoice'])
+    try:
+        result = previewCampaign(usrjson, services).page(
+            request.args.get('page', 1), request.args.get('per_page', DEFAULT_PAGE_SIZE),
+            category=request.args.get('category'), search=request.args.get('search'),
+            field=request.args.get('field'))
+    except ValueError as e:
+        return json.dumps({"error": str(e)}), 400
+    return json.dumps(result), 200
+
+# Memory watchdog stats - only with PRIVACYBOT_MEMWATCH=1 and the admin token (see memory_watchdog.py)
+@app.route('/admin/memory', methods=["GET"])
+def memoryStats():
+    '''
+    Returns current RSS and heap figures with the recent tracemalloc diffs.
+    ?check=1 takes a snapshot now instead of waiting for the next interval.
+    '''
+    watchdog = get_memory_watchdog()
+    if watchdog is None:
+        return json.dumps({"error": "Memory watchdog is off"}), 404
+    if not admin_authorized(request.headers.get(ADMIN_HEADER)):
+        return json.dumps({"error": "Forbidden"}), 403
+    if request.args.get('check'):
+        watchdog.check()
+    return json.dumps(watchdog.stats()), 200
+
+def warm_up():
+    '''
+    Loads what the first request would otherwise pay for: the registry snapshot and version,
+    compressed UI assets, the email config, and one open transport per sender account.
+    The memory watchdog (if enabled) takes its baseline once all of that is loaded.
+    '''
+    for usrchoice in ('all_services', 'top_choice', 'people_search'):
+        services_for_choice(usrchoice)
+    get_registry_versions().record_version(DEFAULT_REGISTRY_CSV)
+    ui_assets.precompress()
+    pool = getSenderPool()
+    if pool is not None:
+        logger.info(f"Warmed up {pool.warm_up()} sender connections")
+    watchdog = get_memory_watchdog()
+    if watchdog is not None:
+        watchdog.start()
+
 # Run Server
 if __name__ == '__main__':
-    # Setup auto-updater: git pull on startup and every 24 hours
-    auto_updater = setup_auto_updater(check_interval_hours=24, pull_on_startup=True)
-    
-    app.run(debug=True)
\ No newline at end of file
+    # JSON logs through a background queue; see logging_setup.py for the settings
+    setup_logging()
+
+    # An invalid email config stops the server here rather than failing every campaign
+    try:
+        get_config()
+    except ConfigError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if os.environ.get('PRIVACYBOT_DEBUG', '').lower() in ('1', 'true', 'yes'):
+        # Flask debugger and reloader; updates restart the process the old way
+        auto_updater = setup_auto_updater(check_interval_hours=24, pull_on_startup=True)
+        get_scheduler().start(getSenderPool)
+        if get_memory_watchdog() is not None:
+            get_memory_watchdog().start()
+        app.run(debug=True)
+    else:
+        # A process started by a handoff was just updated; it does not pull again
+        handed_off = LISTEN_FD_ENV in os.environ
+        server = HandoffServer(app, '127.0.0.1', 5000)
+        scheduler = get_scheduler()
+
+        def restart():
+            # Only one process sends deferred messages at a time
+            scheduler.drain()
+            took_over = False
+            try:
+                took_over = server.handoff()
+            finally:
+                # This process keeps serving when the handoff fails
+                if not took_over:
+                    scheduler.start(getSenderPool)
+            return took_over
+
+        # Setup auto-updater: git pull on startup and every 24 hours, handing the socket to the updated process
+        auto_updater = setup_auto_updater(check_interval_hours=24, pull_on_startup=not handed_off,
+                                          restart_handler=restart)
+
+        # Send campaign messages that were deferred because of sender quotas
+        scheduler.start(getSenderPool)
+
+        server.serve_forever(warm_up=warm_up)
+
+        # The updated process is accepting now; finish the campaigns this one accepted, then exit
+        server.drain()
+        scheduler.drain()
+        pool = getSenderPool()
+        if pool is not None:
+            pool.close()
\ No newline at end of file
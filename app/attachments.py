@@ -0,0 +1,256 @@
+"""
+Attachments for broker requests, such as the government photo ID some brokers require.
+
+The uploaded image is processed once per campaign: decoded, normalized and
+downscaled (with the optional Pillow package: rotated upright and converted
+to JPEG), stripped of EXIF metadata such as GPS position, then base64-encoded
+once. Every request that needs it reuses the same encoded MIME part, so the
+per-message cost is a copy of the finished bytes, whichever transport and
+however many brokers.
+"""
+
+import base64
+import binascii
+import io
+import logging
+import re
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Uploads larger than this are rejected before decoding
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# Longest side of a normalized image, enough to read an ID card
+MAX_DIMENSION = 1600
+
+JPEG_QUALITY = 85
+
+# Without Pillow images are sent as uploaded, up to this size
+MAX_UNPROCESSED_BYTES = 2 * 1024 * 1024
+
+_DATA_URL = re.compile(r'^data:([\w/+.-]+)?(?:;[\w-]+=[^;,]*)*;base64,', re.IGNORECASE)
+
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
+
+# JPEG segments that carry metadata rather than image data: APP1 (EXIF, XMP),
+# APP13 (IPTC) and comments
+_JPEG_METADATA_MARKERS = frozenset((0xE1, 0xED, 0xFE))
+_JPEG_START_OF_SCAN = 0xDA
+
+
+class AttachmentError(ValueError):
+    """Raised when an uploaded attachment cannot be used."""
+
+
+def decode_upload(value):
+    """
+    Decode an uploaded file sent as a data URL or plain base64 string.
+
+    Args:
+        value: 'data:image/jpeg;base64,...' (as FileReader.readAsDataURL
+            produces) or bare base64
+
+    Returns:
+        bytes: The file contents
+    """
+    match = _DATA_URL.match(value)
+    encoded = value[match.end():] if match else value
+    # base64 is 4/3 of the data
+    if len(encoded) > MAX_UPLOAD_BYTES * 4 // 3 + 4:
+        raise AttachmentError(f"Upload is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    try:
+        return base64.b64decode(''.join(encoded.split()), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise AttachmentError(f"Upload is not valid base64: {e}") from None
+
+
+def sniff_image_type(data):
+    """Return the content type of JPEG, PNG or GIF data, or None."""
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    return None
+
+
+def strip_jpeg_metadata(data):
+    """
+    Remove the EXIF, XMP, IPTC and comment segments from a JPEG.
+
+    The segments before the image data are copied except the metadata ones;
+    the compressed image itself is left as it is.
+
+    Args:
+        data: JPEG file contents
+
+    Returns:
+        bytes: The JPEG without metadata
+    """
+    output = [data[:2]]
+    position = 2
+    while True:
+        if position + 4 > len(data) or data[position] != 0xFF:
+            raise AttachmentError("Upload is not a usable JPEG image")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        length, = struct.unpack_from('>H', data, position + 2)
+        end = position + 2 + length
+        if length < 2 or end > len(data):
+            raise AttachmentError("Upload is not a usable JPEG image")
+        if marker == _JPEG_START_OF_SCAN:
+            output.append(data[position:])
+            return b''.join(output)
+        if marker not in _JPEG_METADATA_MARKERS:
+            output.append(data[position:end])
+        position = end
+
+
+def _pillow():
+    """Return (Image, ImageOps) from Pillow, or None if the optional package is not installed."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+
+def normalize_image(data, max_dimension=MAX_DIMENSION, quality=JPEG_QUALITY):
+    """
+    Turn an uploaded image into what is attached to requests.
+
+    With Pillow the image is rotated upright, downscaled to fit max_dimension
+    and re-encoded as a JPEG without metadata. JPEGs are decoded at reduced
+    scale, so a large photo never needs its full-size bitmap in memory.
+    Without Pillow, JPEG, PNG and GIF files up to MAX_UNPROCESSED_BYTES are
+    used as uploaded, except that a JPEG's metadata segments are removed.
+
+    Args:
+        data: Image file contents
+        max_dimension: Longest side of the result in pixels
+        quality: JPEG quality of the result
+
+    Returns:
+        tuple: (bytes, content_type)
+    """
+    pillow = _pillow()
+    if pillow is None:
+        content_type = sniff_image_type(data)
+        if content_type is None:
+            raise AttachmentError("Upload is not a JPEG, PNG or GIF image")
+        if len(data) > MAX_UNPROCESSED_BYTES:
+            raise AttachmentError(f"Image is larger than {MAX_UNPROCESSED_BYTES // (1024 * 1024)} MB "
+                                  f"(install Pillow to have large images downscaled)")
+        if content_type == 'image/jpeg':
+            data = strip_jpeg_metadata(data)
+        return data, content_type
+
+    Image, ImageOps = pillow
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                flattened = Image.new('RGB', image.size, (255, 255, 255))
+                flattened.paste(image, mask=image.getchannel('A'))
+                image = flattened
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise AttachmentError(f"Upload is not a usable image: {e}") from None
+    return output.getvalue(), 'image/jpeg'
+
+
+class Attachment:
+    """A file attached to requests, base64-encoded once and shared by every message."""
+
+    def __init__(self, data, content_type, filename):
+        """
+        Args:
+            data: File contents
+            content_type: MIME type, e.g. 'image/jpeg'
+            filename: Name shown to the recipient
+        """
+        self.data = data
+        self.content_type = content_type
+        self.filename = filename
+        # 76 character lines, as email.encoders.encode_base64 writes them
+        self._encoded = base64.encodebytes(data).decode('ascii')
+        self._parts = {}
+
+    def part(self, linesep='\n'):
+        """
+        Return the serialized MIME part (headers and body) for a line separator.
+
+        The result is built on first use and cached, so each transport type
+        pays for it once per campaign.
+        """
+        part = self._parts.get(linesep)
+        if part is None:
+            text = ('Content-Type: %s\n'
+                    'MIME-Version: 1.0\n'
+                    'Content-Transfer-Encoding: base64\n'
+                    'Content-Disposition: attachment; filename="%s"\n'
+                    '\n' % (self.content_type, self.filename.replace('"', ''))) + self._encoded
+            part = self._parts[linesep] = text.replace('\n', linesep).encode('ascii')
+        return part
+
+    def __len__(self):
+        return len(self.data)
+
+
+def photo_id_attachment(usrjson):
+    """
+    Prepare the user's government photo ID for a campaign.
+
+    Args:
+        usrjson: Request data; 'gov_photo_id' holds the uploaded image
+
+    Returns:
+        Attachment or None: None if no photo ID was uploaded
+    """
+    value = usrjson.get('gov_photo_id')
+    if not value:
+        return None
+    uploaded = decode_upload(value)
+    data, content_type = normalize_image(uploaded)
+    logger.info(f"Prepared photo ID attachment: {len(uploaded)} bytes uploaded, {len(data)} bytes attached")
+    return Attachment(data, content_type, 'photo_id.' + _EXTENSIONS.get(content_type, 'jpg'))
+
+
+def prepare_attachments(usrjson):
+    """
+    Prepare every attachment a campaign may send, once.
+
+    Returns:
+        dict: {attribute: Attachment} for the attachments the user uploaded
+    """
+    photo_id = photo_id_attachment(usrjson)
+    return {'gov_photo_id': photo_id} if photo_id is not None else {}
+
+
+def attachments_for(submap, attachments):
+    """
+    Return the attachments a broker requires.
+
+    Args:
+        submap: The broker's row from the services map
+        attachments: {attribute: Attachment} prepared for the campaign
+
+    Returns:
+        list: Attachments to send with the broker's request
+    """
+    return [attachment for attribute, attachment in attachments.items() if submap.get(attribute) is True]
@@ -10,20 +10,25 @@ import time
 import threading
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class AutoUpdater:
     """Handles automatic git pull and program restart."""
     
-    def __init__(self, check_interval_hours=24):
+    def __init__(self, check_interval_hours=24, restart_handler=None):
         """
         Initialize the auto-updater.
         
         Args:
             check_interval_hours: Hours between update checks (default: 24)
+            restart_handler: Optional callable that restarts without downtime
+                (e.g. HandoffServer.handoff); returns True if it took over.
+                When it returns False or raises, the failure is logged and the
+                current process keeps serving; without one the process is
+                re-executed.
         """
         self.check_interval_seconds = check_interval_hours * 3600
+        self.restart_handler = restart_handler
         self.running = False
         self.update_thread = None
         
@@ -92,6 +97,14 @@ class AutoUpdater:
     
     def restart_program(self):
         """Restart the current program."""
+        if self.restart_handler is not None:
+            try:
+                if not self.restart_handler():
+                    logger.error("Zero-downtime restart failed, still running the previous version")
+            except Exception as e:
+                logger.error(f"Zero-downtime restart failed, still running the previous version: {e}")
+            # Re-executing now would drop the connections and sends the handler kept alive
+            return
         logger.info("Restarting program...")
         try:
             # Use os.execv to replace the current process
@@ -131,18 +144,19 @@ class AutoUpdater:
             self.update_thread.join(timeout=5)
             logger.info("Scheduled updates stopped")
 
-def setup_auto_updater(check_interval_hours=24, pull_on_startup=True):
+def setup_auto_updater(check_interval_hours=24, pull_on_startup=True, restart_handler=None):
     """
     Set up auto-updater with git pull on startup and scheduled updates.
     
     Args:
         check_interval_hours: Hours between update checks (default: 24)
         pull_on_startup: Whether to pull on initial startup (default: True)
+        restart_handler: Optional zero-downtime restart callable (see AutoUpdater)
     
     Returns:
         AutoUpdater: The configured auto-updater instance
     """
-    updater = AutoUpdater(check_interval_hours)
+    updater = AutoUpdater(check_interval_hours, restart_handler)
     
     if pull_on_startup:
         logger.info("Performing initial git pull...")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark comparing MessageBuilder with the email.mime path.
+Builds one CCPA request per broker in the registry, both the way the Gmail API
+path serializes (as_bytes + base64url) and the way smtplib serializes (CRLF).
+"""
+
+import base64
+import io
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(__file__))
+
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from email_templates import REQUEST_TEMPLATE, render_userdata, request_fragments
+from message_builder import MessageBuilder
+from registry import csv_to_map
+
+USRJSON = {
+    "firstname": "Jane", "lastname": "Doe", "email": "jane.doe@example.com",
+    "full_address": "1 Main St", "city": "Oakland", "state": "CA", "zip": "94601",
+    "country": "USA", "phone_num": "555-0100",
+}
+
+def mime_gmail(jobs):
+    for service, broker_email, ordered_list in jobs:
+        mimeMessage = MIMEMultipart()
+        mimeMessage['to'] = broker_email
+        mimeMessage['subject'] = 'CCPA Data Deletion Request - ' + service
+        mimeMessage.add_header('reply-to', USRJSON['email'])
+        mimeMessage.attach(MIMEText(REQUEST_TEMPLATE.format(code=ordered_list, brands=''), 'html'))
+        base64.urlsafe_b64encode(mimeMessage.as_bytes()).decode()
+
+def mime_smtp(jobs):
+    for service, broker_email, ordered_list in jobs:
+        mimeMessage = MIMEMultipart()
+        mimeMessage['from'] = USRJSON['email']
+        mimeMessage['to'] = broker_email
+        mimeMessage['subject'] = 'CCPA Data Deletion Request - ' + service
+        mimeMessage.add_header('reply-to', USRJSON['email'])
+        mimeMessage.attach(MIMEText(REQUEST_TEMPLATE.format(code=ordered_list, brands=''), 'html'))
+        fp = io.BytesIO()
+        BytesGenerator(fp).flatten(mimeMessage, linesep='\r\n')
+
+def builder_gmail(jobs):
+    builder = MessageBuilder()
+    prefix, suffix = [builder.fragment(f) for f in request_fragments()]
+    for service, broker_email, ordered_list in jobs:
+        builder.build_raw([
+            ('to', broker_email),
+            ('subject', 'CCPA Data Deletion Request - ' + service),
+            ('reply-to', USRJSON['email'])], [prefix, ordered_list, suffix])
+
+def builder_smtp(jobs):
+    builder = MessageBuilder('\r\n', mangle_from=True)
+    prefix, suffix = [builder.fragment(f) for f in request_fragments()]
+    for service, broker_email, ordered_list in jobs:
+        builder.build([
+            ('from', USRJSON['email']),
+            ('to', broker_email),
+            ('subject', 'CCPA Data Deletion Request - ' + service),
+            ('reply-to', USRJSON['email'])], [prefix, ordered_list, suffix])
+
+def main():
+    all_services, _, _ = csv_to_map('services_list_06May2021.csv')
+    jobs = [(service, submap['privacy_dept_contact_email'], render_userdata(USRJSON, submap))
+            for service, submap in all_services.items()]
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"Building {len(jobs)} messages per run, best of {repeat} runs")
+    for label, baseline, fast in [('gmail (as_bytes + base64url)', mime_gmail, builder_gmail),
+                                  ('smtp (CRLF send_message)', mime_smtp, builder_smtp)]:
+        slow_t = min(timeit.repeat(lambda: baseline(jobs), number=1, repeat=repeat))
+        fast_t = min(timeit.repeat(lambda: fast(jobs), number=1, repeat=repeat))
+        print(f"  {label}:")
+        print(f"    email.mime:     {slow_t / len(jobs) * 1e6:8.1f} us/message")
+        print(f"    MessageBuilder: {fast_t / len(jobs) * 1e6:8.1f} us/message  ({slow_t / fast_t:.1f}x)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Delivery status notification (RFC 3464) processing.
+
+Bounces for broker requests arrive in the reply mailbox as multipart/report
+messages with a machine-readable message/delivery-status part. The bounce
+processor runs as a handler of the reply ingestion workers: it parses each
+new DSN, finds the request it reports on (through the original Message-ID in
+the returned headers when the DSN does not reference it), marks the request
+bounced and lowers the contact address's health score in the reply index.
+Ordinary replies from a broker restore its address's score.
+
+Usage:
+    python bounces.py    # print the addresses that have bounced
+"""
+
+import email
+import email.policy
+import logging
+import sys
+from email.parser import BytesHeaderParser
+
+from reply_index import get_reply_index, parse_message_ids
+
+logger = logging.getLogger(__name__)
+
+
+def _address(value):
+    """Return the address from a DSN recipient field ('rfc822; user@host')."""
+    if not value:
+        return None
+    address_type, _, address = str(value).partition(';')
+    return (address if address else address_type).strip().strip('<>') or None
+
+
+def _original_headers(report):
+    for part in report.iter_parts():
+        content_type = part.get_content_type()
+        if content_type in ('message/rfc822', 'message/global'):
+            payload = part.get_payload()
+            return payload[0] if isinstance(payload, list) and payload else None
+        if content_type in ('text/rfc822-headers', 'message/global-headers'):
+            return BytesHeaderParser(policy=email.policy.default).parsebytes(part.get_payload(decode=True) or b'')
+    return None
+
+
+def parse_dsn(raw):
+    """
+    Parse a delivery status notification.
+
+    Args:
+        raw: Message bytes
+
+    Returns:
+        dict or None: None if the message is not an RFC 3464 DSN, else
+        original_message_id, reporting_mta and recipients (list of dicts with
+        recipient, original_recipient, action, status, diagnostic and hard)
+    """
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    if message.get_content_type() != 'multipart/report':
+        return None
+    if message.get_param('report-type', '').lower() not in ('delivery-status', 'global-delivery-status'):
+        return None
+
+    status_part = next((part for part in message.iter_parts()
+                        if part.get_content_type() in ('message/delivery-status', 'message/global-delivery-status')),
+                       None)
+    if status_part is None:
+        return None
+    blocks = status_part.get_payload()
+    if not isinstance(blocks, list) or not blocks:
+        return None
+
+    # The first block holds the per-message fields, the rest one recipient each
+    recipients = []
+    for block in blocks[1:]:
+        action = str(block.get('Action', '')).strip().lower()
+        status = str(block.get('Status', '')).strip().split(' ')[0]
+        recipients.append({
+            'recipient': _address(block.get('Final-Recipient')),
+            'original_recipient': _address(block.get('Original-Recipient')),
+            'action': action,
+            'status': status,
+            'diagnostic': ' '.join(str(block.get('Diagnostic-Code', '')).split()) or None,
+            'hard': action == 'failed' and status.startswith('5'),
+        })
+
+    original = _original_headers(message)
+    original_ids = parse_message_ids(original.get('Message-ID')) if original is not None else []
+    return {
+        'original_message_id': original_ids[0] if original_ids else None,
+        'reporting_mta': _address(blocks[0].get('Reporting-MTA')),
+        'recipients': recipients,
+    }
+
+
+class BounceProcessor:
+    """Reply ingestion handler that turns DSNs into request statuses and address health."""
+
+    def __init__(self, index):
+        """
+        Args:
+            index: ReplyIndex the ingestion worker stores messages in
+        """
+        self.index = index
+
+    def __call__(self, reply, request, raw):
+        """
+        Handle one newly stored message.
+
+        Args:
+            reply: Parsed message from parse_reply
+            request: Sent request matched through In-Reply-To/References, or None
+            raw: Message bytes
+
+        Returns:
+            dict or None: The parsed DSN, if the message was one
+        """
+        dsn = parse_dsn(raw)
+        if dsn is None:
+            if request is not None:
+                self.index.record_delivery(request['recipient'])
+            return None
+        if request is None and dsn['original_message_id']:
+            request = self.index.find_request([dsn['original_message_id']])
+        if reply.get('message_id'):
+            self.index.mark_bounce(reply['message_id'], request)
+
+        hard = False
+        for recipient in dsn['recipients']:
+            if recipient['action'] not in ('failed', 'delayed'):
+                continue
+            # Score the address we sent to, even if the failure names a forwarding target
+            address = (request['recipient'] if request is not None
+                       else recipient['original_recipient'] or recipient['recipient'])
+            if not address:
+                continue
+            score = self.index.record_bounce(address, recipient['hard'], recipient['status'],
+                                             recipient['diagnostic'])
+            hard = hard or recipient['hard']
+            logger.info(f"{'Hard' if recipient['hard'] else 'Soft'} bounce ({recipient['status']}) "
+                        f"for {request['service'] if request else address}, address health {score:.2f}",
+                        extra={'broker': request['service'] if request else None})
+        if hard and request is not None:
+            self.index.set_request_status(request['message_id'], 'bounced')
+        return dsn
+
+
+def main():
+    """Print the health of addresses that have bounced."""
+    for row in get_reply_index().address_report():
+        print(f"{row['score']:.2f}  {row['address']}  {row['hard_bounces']} hard / {row['soft_bounces']} soft "
+              f"bounces in {row['sends']} sends  {row['last_status'] or ''} {row['last_diagnostic'] or ''}".rstrip())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Grouping of brokers that share a privacy contact address.
+
+Several brands in the registry list the same privacy inbox (whole families of
+people search sites, for example). A campaign sends one request per contact
+address that names every brand in the group and includes the union of the
+details they require, instead of one near-identical email per brand.
+
+Groups whose address has no usable contact, or whose health score in the
+reply index (see bounces.py) fell below SKIP_BELOW, are left out of
+campaigns; those below DEPRIORITIZE_BELOW are sent after every other tier.
+"""
+
+from campaign_scheduler import DEFAULT_PRIORITY_ORDER, priority_tier
+from email_templates import ATTACHMENT_ATTRIBUTES, PII_ATTRIBUTES
+
+# Address health thresholds: two hard bounces in a row skip an address, one
+# (or a few soft bounces) moves it to the back of the campaign
+SKIP_BELOW = 0.3
+DEPRIORITIZE_BELOW = 0.75
+
+
+class BrokerGroup:
+    """Brokers sharing one privacy contact address."""
+
+    __slots__ = ('contact', 'services', 'submaps')
+
+    def __init__(self, contact):
+        """
+        Args:
+            contact: The privacy contact address, as listed for the first broker
+        """
+        self.contact = contact
+        self.services = []
+        self.submaps = []
+
+    @property
+    def label(self):
+        """Name used for the group in logs, subjects and tracking."""
+        return ' / '.join(self.services)
+
+    def merged_submap(self):
+        """
+        Return a services-map row for the whole group.
+
+        Each PII attribute (and attachment) is required if any brand requires it; other fields
+        come from the first brand (top_choice is YES if any brand is).
+        """
+        if len(self.submaps) == 1:
+            return self.submaps[0]
+        merged = dict(self.submaps[0])
+        for attribute in list(PII_ATTRIBUTES) + list(ATTACHMENT_ATTRIBUTES):
+            merged[attribute] = any(submap.get(attribute) is True for submap in self.submaps)
+        if any(submap.get('top_choice') == 'YES' for submap in self.submaps):
+            merged['top_choice'] = 'YES'
+        return merged
+
+
+def contact_key(address):
+    """Normalize a contact address for grouping."""
+    return address.strip().lower()
+
+
+def group_by_contact(services_map):
+    """
+    Group brokers by privacy contact address.
+
+    Returns:
+        list: BrokerGroup, in order of each address's first broker in the map
+    """
+    groups = {}
+    for service, submap in services_map.items():
+        key = contact_key(submap['privacy_dept_contact_email'])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = BrokerGroup(submap['privacy_dept_contact_email'].strip())
+        group.services.append(service)
+        group.submaps.append(submap)
+    return list(groups.values())
+
+
+def deliverable_groups(services_map, health=None, skip_below=SKIP_BELOW):
+    """
+    Group brokers by contact, leaving out addresses not worth sending to.
+
+    Args:
+        services_map: Services map
+        health: Optional {address: score} from ReplyIndex.address_health
+        skip_below: Groups whose address scores below this are skipped
+
+    Returns:
+        tuple: (groups to send to, skipped groups), each a list of BrokerGroup
+    """
+    health = health or {}
+    groups, skipped = [], []
+    for group in group_by_contact(services_map):
+        key = contact_key(group.contact)
+        if '@' not in key or health.get(key, 1.0) < skip_below:
+            skipped.append(group)
+        else:
+            groups.append(group)
+    return groups, skipped
+
+
+def rank_groups(groups, priority_order=DEFAULT_PRIORITY_ORDER, health=None,
+                deprioritize_below=DEPRIORITIZE_BELOW):
+    """
+    Order groups by their best priority tier.
+
+    Groups whose address health is below deprioritize_below get the tier
+    after the last one in priority_order.
+
+    Returns:
+        list: (tier, BrokerGroup) pairs, original order within a tier
+    """
+    health = health or {}
+    ranked = []
+    for i, group in enumerate(groups):
+        if health.get(contact_key(group.contact), 1.0) < deprioritize_below:
+            tier = len(priority_order)
+        else:
+            tier = min(priority_tier(submap, priority_order) for submap in group.submaps)
+        ranked.append((tier, i, group))
+    ranked.sort(key=lambda item: item[:2])
+    return [(tier, group) for tier, _, group in ranked]
+
+
+def prioritize_groups(services_map, priority_order=DEFAULT_PRIORITY_ORDER):
+    """
+    Group brokers by contact and order the groups by their best priority tier.
+
+    Returns:
+        list: (tier, BrokerGroup) pairs, registry order within a tier
+    """
+    return rank_groups(group_by_contact(services_map), priority_order)
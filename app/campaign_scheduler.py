@@ -0,0 +1,564 @@
+"""
+Quota-aware, persistent campaign scheduler.
+
+Campaigns are queued in a local SQLite database in priority order (top choice
+brokers first, then people search sites, then everything else by default).
+Each run sends as many due messages as the sender accounts' rolling 24 hour
+quotas allow and pushes the rest to the time quota next frees up, so a
+campaign larger than the remaining quota is spread over several days instead
+of failing partway through.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from email.utils import make_msgid
+
+from attachments import Attachment
+from dispatcher import OutgoingMessage, dispatch_results
+from tracing import instant
+
+logger = logging.getLogger(__name__)
+
+QUOTA_WINDOW_SECONDS = 24 * 3600
+
+# Default broker priority tiers, highest first
+DEFAULT_PRIORITY_ORDER = ['top_choice', 'people search', 'other']
+
+DEFAULT_SCHEDULE_DB = 'campaign_schedule.db'
+
+# Messages claimed for sending by a process that died are retried after this long
+SENDING_TIMEOUT_SECONDS = 3600
+
+# A reservation still in flight after this long belongs to a process that died;
+# it keeps counting against the quota but no longer against concurrency
+IN_FLIGHT_TIMEOUT_SECONDS = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sender_sends (
+    account TEXT NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sender_sends_account ON sender_sends (account, sent_at);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    default_from TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    service TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    reply_to TEXT,
+    message_id TEXT,
+    body TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_messages_due ON scheduled_messages (status, due_at);
+CREATE TABLE IF NOT EXISTS campaign_attachments (
+    campaign_id TEXT NOT NULL,
+    attachment_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (campaign_id, attachment_id)
+);
+"""
+
+# Columns added after the first release, created on older databases when opened
+_ADDED_COLUMNS = {
+    # JSON list of the brands a request to a shared contact covers, and of
+    # the campaign_attachments sent with it
+    'scheduled_messages': [('brands', 'TEXT'), ('attachments', 'TEXT')],
+    # Set while a reserved send is in flight
+    'sender_sends': [('in_flight_until', 'REAL')],
+}
+
+
+def priority_tier(submap, priority_order=DEFAULT_PRIORITY_ORDER):
+    """
+    Return the priority tier of a broker (lower is sent first).
+
+    Args:
+        submap: The broker's row from the services map
+        priority_order: Tier names, highest priority first. 'top_choice' matches
+            brokers flagged top_choice=YES, 'other' matches everything not
+            matched earlier, any other name matches the broker's category.
+    """
+    for tier, name in enumerate(priority_order):
+        if name == 'top_choice':
+            if submap.get('top_choice') == 'YES':
+                return tier
+        elif name == 'other':
+            return tier
+        elif submap.get('category') == name:
+            return tier
+    return len(priority_order)
+
+
+def prioritize(services_map, priority_order=DEFAULT_PRIORITY_ORDER):
+    """
+    Order broker names by priority tier, keeping registry order within a tier.
+
+    Returns:
+        list: (tier, service) pairs
+    """
+    ranked = [(priority_tier(services_map[service], priority_order), i, service)
+              for i, service in enumerate(services_map)]
+    ranked.sort()
+    return [(tier, service) for tier, _, service in ranked]
+
+
+def _brands(row):
+    """Return the broker names covered by a scheduled_messages row from run_due's query."""
+    return json.loads(row[9]) if row[9] else [row[1]]
+
+
+class QuotaLedger:
+    """
+    Record of sends per account for rolling 24 hour quotas, shared by every
+    process using the same database.
+
+    A send reserves its place in the window before it starts: reserve()
+    checks the account's quota and in-flight count across all processes and
+    inserts the reservation in one write transaction, so N worker processes
+    never go over an account's quota or concurrency limit together. Reads
+    (used, in_flight, next_release) come from an in-memory copy of the window
+    that is reloaded only after another connection has committed (PRAGMA
+    data_version), so checking an account costs microseconds.
+    """
+
+    def __init__(self, db, lock, window=QUOTA_WINDOW_SECONDS, clock=time.time):
+        """
+        Load the sends still inside the window.
+
+        Args:
+            db: sqlite3 connection (shared with the scheduler)
+            lock: Lock guarding the connection
+            window: Rolling quota window in seconds
+            clock: Time source, for tests
+        """
+        self._db = db
+        self._lock = lock
+        self.window = window
+        self.clock = clock
+        self._sends = collections.defaultdict(collections.deque)
+        # Reservations still sending, in any process: rowid -> (account, reserved_at, in_flight_until)
+        self._in_flight = {}
+        self._version = None
+        with lock:
+            db.execute("DELETE FROM sender_sends WHERE sent_at <= ?", (clock() - window,))
+            db.commit()
+            self._reload()
+
+    def _reload(self):
+        """Re-read the window from the database (caller holds the lock)."""
+        self._version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        rows = self._db.execute("SELECT rowid, account, sent_at, in_flight_until FROM sender_sends "
+                                "WHERE sent_at > ? ORDER BY sent_at", (self.clock() - self.window,)).fetchall()
+        self._sends.clear()
+        self._in_flight.clear()
+        for rowid, account, sent_at, in_flight_until in rows:
+            self._sends[account].append(sent_at)
+            if in_flight_until is not None:
+                self._in_flight[rowid] = (account, sent_at, in_flight_until)
+
+    def _refresh(self):
+        """Reload if another connection (another process) committed since the last read."""
+        if self._db.execute("PRAGMA data_version").fetchone()[0] != self._version:
+            self._reload()
+
+    def _expire(self, account, now):
+        sends = self._sends[account]
+        cutoff = now - self.window
+        while sends and sends[0] <= cutoff:
+            sends.popleft()
+        return sends
+
+    def reserve(self, account, quota, max_in_flight=None):
+        """
+        Reserve one send for an account if it has quota and a free slot in every process.
+
+        Args:
+            account: Account name
+            quota: Sends allowed per window
+            max_in_flight: Sends the account may have in flight at once across processes
+
+        Returns:
+            int or None: Reservation to pass to release(), or None if the
+            account's quota or concurrency is used up
+        """
+        with self._lock:
+            now = self.clock()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                used, in_flight = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(in_flight_until > ?), 0) FROM sender_sends "
+                    "WHERE account = ? AND sent_at > ?", (now, account, now - self.window)).fetchone()
+                if used >= quota or (max_in_flight is not None and in_flight >= max_in_flight):
+                    self._db.rollback()
+                    # Another process used what our copy still showed as free
+                    self._reload()
+                    return None
+                until = now + IN_FLIGHT_TIMEOUT_SECONDS
+                reservation = self._db.execute("INSERT INTO sender_sends (account, sent_at, in_flight_until) "
+                                               "VALUES (?, ?, ?)", (account, now, until)).lastrowid
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._sends[account].append(now)
+            self._in_flight[reservation] = (account, now, until)
+            return reservation
+
+    def release(self, reservation, sent):
+        """
+        Finish a reserved send.
+
+        Args:
+            reservation: Value returned by reserve()
+            sent: True if the message was delivered (it keeps counting against
+                the quota), False if it failed (the reservation is dropped)
+        """
+        with self._lock:
+            entry = self._in_flight.pop(reservation, None)
+            if sent:
+                self._db.execute("UPDATE sender_sends SET in_flight_until = NULL WHERE rowid = ?", (reservation,))
+            else:
+                self._db.execute("DELETE FROM sender_sends WHERE rowid = ?", (reservation,))
+                if entry is not None:
+                    try:
+                        self._sends[entry[0]].remove(entry[1])
+                    except ValueError:
+                        pass
+            self._db.commit()
+
+    def record(self, account):
+        """Record one successful send for an account that was not reserved."""
+        now = self.clock()
+        with self._lock:
+            self._sends[account].append(now)
+            self._db.execute("INSERT INTO sender_sends (account, sent_at) VALUES (?, ?)", (account, now))
+            self._db.commit()
+
+    def used(self, account):
+        """Return the number of sends and reservations in the last window for an account, across processes."""
+        with self._lock:
+            self._refresh()
+            return len(self._expire(account, self.clock()))
+
+    def in_flight(self, account):
+        """Return the number of an account's sends in flight across processes."""
+        with self._lock:
+            self._refresh()
+            now = self.clock()
+            return sum(1 for name, _, until in self._in_flight.values() if name == account and until > now)
+
+    def next_release(self, account):
+        """Return the epoch time at which the oldest send leaves the window."""
+        with self._lock:
+            self._refresh()
+            sends = self._expire(account, self.clock())
+            if not sends:
+                return self.clock()
+            return sends[0] + self.window
+
+
+class CampaignScheduler:
+    """Queues campaign messages persistently and sends them within quota."""
+
+    def __init__(self, db_path=DEFAULT_SCHEDULE_DB, clock=time.time):
+        """
+        Open (or create) the schedule database.
+
+        Args:
+            db_path: SQLite database file
+            clock: Time source, for tests
+        """
+        self.db_path = db_path
+        self.clock = clock
+        self._lock = threading.RLock()
+        # Runs in progress; they no longer exclude each other, so concurrent
+        # campaigns share the pool through its FairQueue
+        self._runs = 0
+        self._runs_cond = threading.Condition()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # Every worker process shares the database: WAL lets them read while one writes,
+        # and quota reservations commit without an fsync each
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns:
+                if column not in existing:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        # Bodies carry the user's details and are only kept until the message is sent or has failed
+        self._db.execute("UPDATE scheduled_messages SET body = '' WHERE status IN ('sent', 'failed') AND body != ''")
+        self._db.commit()
+        self.ledger = QuotaLedger(self._db, self._lock, clock=clock)
+        # Attachments of campaigns with messages left, by campaign and attachment ID
+        self._attachments = {}
+        self.running = False
+        self.worker_thread = None
+
+    def submit(self, services, default_from):
+        """
+        Queue a campaign.
+
+        Messages without a Message-ID get one here, so replies can be matched
+        to the request whenever it is eventually sent. Each attachment is stored
+        once per campaign, however many messages share it, and deleted once
+        the campaign has no messages left to send.
+
+        Args:
+            services: List of (tier, OutgoingMessage), in send order
+            default_from: From address for SMTP accounts without a from_email
+
+        Returns:
+            str: The new campaign ID
+        """
+        campaign_id = uuid.uuid4().hex
+        now = self.clock()
+        domain = default_from.rpartition('@')[2] or 'privacybot.local'
+        attachment_ids = {}
+        for _, m in services:
+            for attachment in m.attachments:
+                attachment_ids.setdefault(id(attachment), (len(attachment_ids), attachment))
+        with self._lock:
+            self._db.execute("INSERT INTO campaigns (campaign_id, created_at, default_from) VALUES (?, ?, ?)",
+                             (campaign_id, now, default_from))
+            self._db.executemany(
+                "INSERT INTO campaign_attachments (campaign_id, attachment_id, filename, content_type, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(campaign_id, attachment_id, a.filename, a.content_type, a.data)
+                 for attachment_id, a in attachment_ids.values()])
+            self._db.executemany(
+                "INSERT INTO scheduled_messages (campaign_id, seq, priority, service, recipient, subject, "
+                "reply_to, message_id, body, due_at, updated_at, brands, attachments) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(campaign_id, seq, tier, m.service, m.to, m.subject, m.reply_to,
+                  m.message_id or make_msgid(domain=domain),
+                  m.body if isinstance(m.body, str) else ''.join(m.body), now, now,
+                  json.dumps(m.brands) if m.brands != [m.service] else None,
+                  json.dumps([attachment_ids[id(a)][0] for a in m.attachments]) if m.attachments else None)
+                 for seq, (tier, m) in enumerate(services)])
+            self._db.commit()
+            if attachment_ids:
+                # The objects passed in keep their encoded parts for this campaign's sends
+                self._attachments[campaign_id] = dict(attachment_ids.values())
+        return campaign_id
+
+    def _campaign_attachments(self, campaign_id):
+        """Return {attachment_id: Attachment} for a campaign, loading it once after a restart."""
+        with self._lock:
+            attachments = self._attachments.get(campaign_id)
+            if attachments is None:
+                attachments = self._attachments[campaign_id] = {
+                    attachment_id: Attachment(bytes(data), content_type, filename)
+                    for attachment_id, filename, content_type, data in self._db.execute(
+                        "SELECT attachment_id, filename, content_type, data FROM campaign_attachments "
+                        "WHERE campaign_id = ?", (campaign_id,))}
+            return attachments
+
+    def _release_attachments(self, campaign_ids):
+        """Delete the attachments of campaigns that have no messages left to send."""
+        with self._lock:
+            for campaign_id in campaign_ids:
+                left = self._db.execute("SELECT COUNT(*) FROM scheduled_messages WHERE campaign_id = ? "
+                                        "AND status IN ('pending', 'sending')", (campaign_id,)).fetchone()[0]
+                if not left:
+                    self._db.execute("DELETE FROM campaign_attachments WHERE campaign_id = ?", (campaign_id,))
+                    self._attachments.pop(campaign_id, None)
+            self._db.commit()
+
+    def run_due(self, pool, campaign_id=None, reserve=0):
+        """
+        Send due messages within the pool's remaining quota.
+
+        Messages are taken highest priority first (then oldest campaign first).
+        Whatever does not fit is rescheduled for when quota next frees up.
+        The messages to send are claimed in one write transaction, so runs in
+        this process and in another process sharing the database (e.g. during
+        a restart handoff) never send the same message, and runs for
+        different campaigns can send at the same time.
+
+        Args:
+            pool: SenderPool to send through
+            campaign_id: Only run this campaign's messages (default: all)
+            reserve: Quota to leave unused (e.g. for a confirmation email)
+
+        Returns:
+            dict: Broker names by outcome: 'sent', 'failed' and 'deferred' (every
+            brand of a request to a shared contact is listed)
+        """
+        with self._tracked_run():
+            now = self.clock()
+            query = ("SELECT m.id, m.service, m.recipient, m.subject, m.reply_to, m.body, c.default_from, "
+                     "m.campaign_id, m.message_id, m.brands, m.attachments "
+                     "FROM scheduled_messages m JOIN campaigns c ON c.campaign_id = m.campaign_id "
+                     "WHERE (m.status = 'pending' OR (m.status = 'sending' AND m.updated_at < ?)) AND m.due_at <= ?")
+            params = [now - SENDING_TIMEOUT_SECONDS, now]
+            if campaign_id is not None:
+                query += " AND m.campaign_id = ?"
+                params.append(campaign_id)
+            query += " ORDER BY m.priority, c.created_at, m.seq"
+            # Read before taking the connection lock, which the pool takes after its own. The
+            # budget only avoids claiming what cannot be sent now; ledger reservations enforce quotas.
+            budget = max(0, pool.remaining_quota() - reserve)
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self._db.execute(query, params).fetchall()
+                    batch, deferred = rows[:budget], rows[budget:]
+                    self._db.executemany("UPDATE scheduled_messages SET status = 'sending', updated_at = ? WHERE id = ?",
+                                         [(now, row[0]) for row in batch])
+                    self._db.commit()
+                except BaseException:
+                    self._db.rollback()
+                    raise
+            messages = []
+            for (_, service, recipient, subject, reply_to, body, default_from, message_campaign_id, message_id,
+                 brands, attachment_ids) in batch:
+                attachments = ()
+                if attachment_ids:
+                    campaign_attachments = self._campaign_attachments(message_campaign_id)
+                    attachments = [campaign_attachments[i] for i in json.loads(attachment_ids)]
+                messages.append((OutgoingMessage(service, recipient, subject, reply_to, body, message_campaign_id,
+                                                 message_id, json.loads(brands) if brands else None, attachments),
+                                 default_from))
+            results = dispatch_results(pool, messages)
+
+            outcome = {'sent': [], 'failed': [], 'deferred': []}
+            updates = []
+            for row, result in zip(batch, results):
+                if result is None:
+                    deferred.append(row)
+                else:
+                    status = 'sent' if result else 'failed'
+                    outcome[status].extend(_brands(row))
+                    updates.append((status, None, self.clock(), row[0]))
+            if deferred:
+                due_at = max(pool.next_quota_time(), now + 1)
+                for row in deferred:
+                    outcome['deferred'].extend(_brands(row))
+                    updates.append(('pending', due_at, self.clock(), row[0]))
+                logger.info(f"Deferred {len(deferred)} messages until {time.ctime(due_at)}")
+                instant('scheduler.defer', messages=len(deferred), due_at=time.ctime(due_at))
+            with self._lock:
+                # A sent or failed message's body (the user's details) is not needed any more
+                self._db.executemany(
+                    "UPDATE scheduled_messages SET status = ?1, body = CASE WHEN ?1 = 'pending' THEN body ELSE '' END, "
+                    "due_at = COALESCE(?2, due_at), updated_at = ?3 "
+                    "WHERE id = ?4 AND status IN ('pending', 'sending')", updates)
+                self._db.commit()
+            self._release_attachments({row[7] for row in batch if row[10]})
+            return outcome
+
+    def pending_count(self, campaign_id=None):
+        """Return the number of messages still waiting to be sent."""
+        query = "SELECT COUNT(*) FROM scheduled_messages WHERE status = 'pending'"
+        params = []
+        if campaign_id is not None:
+            query += " AND campaign_id = ?"
+            params.append(campaign_id)
+        with self._lock:
+            return self._db.execute(query, params).fetchone()[0]
+
+    def next_due_time(self):
+        """Return the earliest due time of a pending message, or None."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT MIN(due_at) FROM scheduled_messages WHERE status = 'pending'").fetchone()[0]
+
+    def worker_loop(self, pool_getter, interval_seconds):
+        """Background thread that sends deferred messages when they come due."""
+        # A thread left sleeping by stop() exits instead of running alongside a restarted one
+        while self.running and self.worker_thread is threading.current_thread():
+            time.sleep(interval_seconds)
+            if not self.running or self.worker_thread is not threading.current_thread():
+                break
+            due = self.next_due_time()
+            if due is None or due > self.clock():
+                continue
+            pool = pool_getter()
+            if pool is None:
+                continue
+            try:
+                outcome = self.run_due(pool)
+                logger.info(f"Scheduled send: {len(outcome['sent'])} sent, {len(outcome['failed'])} failed, "
+                            f"{len(outcome['deferred'])} deferred")
+            except Exception as e:
+                logger.error(f"Error running scheduled campaign messages: {e}")
+
+    def start(self, pool_getter, interval_seconds=300):
+        """
+        Start the background thread for deferred messages.
+
+        Args:
+            pool_getter: Callable returning the current SenderPool (or None)
+            interval_seconds: Seconds between checks for due messages
+        """
+        if not self.running:
+            self.running = True
+            self.worker_thread = threading.Thread(target=self.worker_loop,
+                                                  args=(pool_getter, interval_seconds), daemon=True)
+            self.worker_thread.start()
+            logger.info(f"Campaign scheduler started (checking every {interval_seconds} seconds)")
+
+    def stop(self):
+        """Stop the background thread."""
+        self.running = False
+        if self.worker_thread:
+            self.worker_thread.join(timeout=5)
+            logger.info("Campaign scheduler stopped")
+
+    def drain(self, timeout=None):
+        """
+        Stop the background thread and wait for runs in progress to finish.
+
+        Args:
+            timeout: Seconds to wait for the run (default: wait forever)
+
+        Returns:
+            bool: True if no run is in progress any more
+        """
+        self.stop()
+        with self._runs_cond:
+            return self._runs_cond.wait_for(lambda: not self._runs, timeout)
+
+    @contextlib.contextmanager
+    def _tracked_run(self):
+        with self._runs_cond:
+            self._runs += 1
+        try:
+            yield
+        finally:
+            with self._runs_cond:
+                self._runs -= 1
+                self._runs_cond.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(db_path=None):
+    """Return the process-wide scheduler (db path from PRIVACYBOT_SCHEDULE_DB or the default)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CampaignScheduler(db_path or os.environ.get('PRIVACYBOT_SCHEDULE_DB', DEFAULT_SCHEDULE_DB))
+        return _scheduler
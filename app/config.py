@@ -5,16 +5,166 @@ Supports both Gmail API (OAuth) and SMTP (for Proton Mail Bridge and others).
 
 import os
 import json
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """Raised when the email configuration does not match CONFIG_SCHEMA."""
+
+
+# Schema notation: a type or tuple of types, a frozenset of allowed values,
+# a dict of nested keys, or a one-item list for a list of such values.
+SMTP_SCHEMA = {
+    'smtp_server': str,
+    'smtp_port': int,
+    'smtp_use_tls': bool,
+    'smtp_username': str,
+    'smtp_password': str,
+    'from_email': str,
+}
+
+IMAP_SCHEMA = {
+    'imap_server': str,
+    'imap_port': int,
+    'imap_use_tls': bool,
+    'imap_use_ssl': bool,
+    'imap_username': str,
+    'imap_password': str,
+    'mailbox': str,
+}
+
+SENDER_ACCOUNT_SCHEMA = {
+    'name': str,
+    'provider': frozenset(['smtp', 'gmail_api', 'null', 'latency']),
+    'daily_quota': int,
+    'max_concurrency': int,
+    'smtp_settings': SMTP_SCHEMA,
+    'client_secret_file': str,
+    'token_file': str,
+    'latency_ms': (int, float),
+    'jitter_ms': (int, float),
+    'error_rate': (int, float),
+}
+
+FAIR_SCHEDULING_SCHEMA = {
+    'quantum': int,
+    'weight': (int, float),
+    'max_in_flight': int,
+    'tenants': [{
+        'tenant': str,
+        'weight': (int, float),
+        'max_in_flight': int,
+    }],
+}
+
+CONFIG_SCHEMA = {
+    'email_provider': frozenset(['gmail_api', 'smtp']),
+    'smtp_settings': SMTP_SCHEMA,
+    'sender_accounts': [SENDER_ACCOUNT_SCHEMA],
+    'campaign_priority': [str],
+    'imap_settings': IMAP_SCHEMA,
+    'daily_quota': int,
+    'fair_scheduling': FAIR_SCHEDULING_SCHEMA,
+}
+
+
+def deep_merge(base, override):
+    """
+    Merge override into base, recursing into nested dicts (lists and other values are replaced).
+
+    Returns:
+        dict: base, updated in place
+    """
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            deep_merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def validate_config(value, schema=CONFIG_SCHEMA, path='config'):
+    """
+    Check a config value against a schema.
+
+    Returns:
+        list: Problems found, as readable strings (empty if valid)
+    """
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            return [f"{path} must be an object"]
+        problems = []
+        for key, item in value.items():
+            if key not in schema:
+                problems.append(f"{path}.{key} is not a known setting")
+            else:
+                problems.extend(validate_config(item, schema[key], f"{path}.{key}"))
+        return problems
+    if isinstance(schema, list):
+        if not isinstance(value, list):
+            return [f"{path} must be a list"]
+        problems = []
+        for i, item in enumerate(value):
+            problems.extend(validate_config(item, schema[0], f"{path}[{i}]"))
+        return problems
+    if isinstance(schema, frozenset):
+        if value not in schema:
+            return [f"{path} must be one of {', '.join(sorted(schema))}"]
+        return []
+    types = schema if isinstance(schema, tuple) else (schema,)
+    # bool is an int subclass, but true/false is never a valid port or quota
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        return [f"{path} must be of type {' or '.join(t.__name__ for t in types)}"]
+    return []
+
 
 class EmailConfig:
     """Email configuration class supporting multiple providers."""
     
-    def __init__(self, config_file='email_config.json'):
-        self.config_file = config_file
+    def __init__(self, config_file=None):
+        # PRIVACYBOT_EMAIL_CONFIG points at another config file (e.g. for load tests)
+        self.config_file = config_file or os.environ.get('PRIVACYBOT_EMAIL_CONFIG', 'email_config.json')
+        self._stamp = self._file_stamp()
         self.config = self._load_config()
     
+    def _file_stamp(self):
+        """Return (mtime, size) of the config file, or None if it does not exist."""
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    def reload_if_changed(self):
+        """
+        Reload the configuration if the file was created, changed or removed since it was read.
+        An invalid new file is reported and the current configuration is kept.
+
+        Returns:
+            bool: True if the configuration was reloaded
+        """
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            self.config = self._load_config()
+        except ConfigError as e:
+            logger.warning(f"Ignoring changed config file {self.config_file}: {e}")
+            return False
+        return True
+    
     def _load_config(self):
-        """Load configuration from file or use defaults."""
+        """
+        Load configuration: defaults, then environment variables, then the config file (deep merged).
+
+        Raises:
+            ConfigError: If the config file cannot be read, is not valid JSON or
+                does not match CONFIG_SCHEMA
+        """
         default_config = {
             'email_provider': 'gmail_api',  # Options: 'gmail_api' or 'smtp'
             'smtp_settings': {
@@ -24,6 +174,21 @@ class EmailConfig:
                 'smtp_username': '',
                 'smtp_password': '',
                 'from_email': ''
+            },
+            # Optional pool of sender accounts; when set, campaigns are spread across them.
+            # Each entry: {"name", "provider": "smtp"|"gmail_api", "daily_quota", "max_concurrency",
+            #              "smtp_settings": {...} or "token_file"/"client_secret_file"}
+            'sender_accounts': [],
+            # Order in which brokers are sent to when a campaign is larger than the remaining quota
+            'campaign_priority': ['top_choice', 'people search', 'other'],
+            # Mailbox read by the reply ingestion worker (Proton Bridge serves IMAP on 1143).
+            # Username and password default to the SMTP credentials.
+            'imap_settings': {
+                'imap_server': 'localhost',
+                'imap_port': 1143,
+                'imap_use_tls': False,
+                'imap_use_ssl': False,
+                'mailbox': 'INBOX'
             }
         }
         
@@ -61,10 +226,14 @@ class EmailConfig:
             try:
                 with open(self.config_file, 'r') as f:
                     file_config = json.load(f)
-                    # Merge file config with defaults
-                    default_config.update(file_config)
-            except Exception as e:
-                print(f"Warning: Could not load config file {self.config_file}: {e}")
+            except (OSError, ValueError) as e:
+                # Includes a file caught half-written by a reload
+                raise ConfigError(f"Could not load config file {self.config_file}: {e}") from e
+            problems = validate_config(file_config)
+            if problems:
+                raise ConfigError(f"Invalid config file {self.config_file}: " + "; ".join(problems))
+            # Merge file config with defaults, keeping env/default values for keys the file leaves out
+            deep_merge(default_config, file_config)
         
         return default_config
     
@@ -76,6 +245,45 @@ class EmailConfig:
         """Return SMTP settings."""
         return self.config.get('smtp_settings', {})
     
+    def get_sender_accounts(self):
+        """
+        Return the configured sender account pool (empty list if not used).
+        A top-level daily_quota turns the single configured identity into a one-account pool,
+        so its campaigns are scheduled within quota too.
+        """
+        accounts = self.config.get('sender_accounts') or []
+        if not accounts and self.config.get('daily_quota'):
+            provider = self.get_email_provider()
+            account = {'name': provider, 'provider': provider, 'daily_quota': self.config['daily_quota']}
+            if provider == 'smtp':
+                account['smtp_settings'] = self.get_smtp_settings()
+            accounts = [account]
+        return accounts
+    
+    def get_imap_settings(self):
+        """Return IMAP settings, falling back to the SMTP credentials for login."""
+        imap_settings = dict(self.config.get('imap_settings', {}))
+        smtp_settings = self.get_smtp_settings()
+        if not imap_settings.get('imap_username'):
+            imap_settings['imap_username'] = smtp_settings.get('smtp_username', '')
+        if not imap_settings.get('imap_password'):
+            imap_settings['imap_password'] = smtp_settings.get('smtp_password', '')
+        return imap_settings
+    
+    def get_campaign_priority(self):
+        """Return the broker priority tiers, highest first."""
+        return self.config.get('campaign_priority') or ['top_choice', 'people search', 'other']
+    
+    def get_fair_scheduling(self):
+        """
+        Return how concurrent campaigns share the sender pool (see fair_queue.py).
+
+        quantum: messages a weight 1 user may start per round; weight: default
+        share per user; max_in_flight: default cap on one user's messages
+        sending at once; tenants: per-user overrides, keyed by the user's email.
+        """
+        return self.config.get('fair_scheduling') or {}
+    
     def save_config(self):
         """Save current configuration to file."""
         try:
@@ -83,5 +291,30 @@ class EmailConfig:
                 json.dump(self.config, f, indent=4)
             return True
         except Exception as e:
-            print(f"Error saving config: {e}")
+            logger.error(f"Error saving config: {e}")
             return False
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """
+    Return the process-wide EmailConfig, reloaded first if its file changed.
+
+    The file is only re-read when its modification time or size changes, so
+    this is cheap enough to call for every campaign. A changed file that is
+    invalid is logged and the current configuration kept.
+
+    Raises:
+        ConfigError: If the config file is invalid when it is first loaded;
+            entry points call this at startup so they stop before serving
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = EmailConfig()
+        else:
+            _config.reload_if_changed()
+        return _config
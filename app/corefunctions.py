@@ -2,38 +2,51 @@
 Convert CSV to Dictionary, Write and Send Emails.
 """
 
-import csv, os, glob
+import os, glob
+import logging
+from email.utils import make_msgid
 from Google import Create_Service
-import base64
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import smtplib
-from config import EmailConfig
-
-def csv_to_map(csv_file):
-    """
-    converts csv of services to map, returns services map
-    Ex: services["AcmeData"]["privacy_dept_contact_email"] = "privacy@acmedata.com"...
-    """
-    all_services = {}
-    top_choice = {}
-    people_search = {}
-    with open(csv_file, 'r') as csv_file:
-        csv_reader = csv.reader(csv_file)
-        cols = next(csv_reader) 
-        # cols = ['service_name', 'service_source', 'category', 'topchoice', 'service_privacy_url', 'privacy_dept_contact_email', ...]
-        for line in csv_reader:
-            # LINE: ['databroker1', 'service_source1', 'category1', 'YES/NO', 'https://someprivacyurl.com/', 'privacy@this.does.not.exist', 'T/F', 'T/F',...]
-            line = [True if x == 'TRUE' else False if x == 'FALSE' else x for x in line]
-            # creates the map schemas we want
-            submap = dict(zip(cols[1:], line[1:]))
-            all_services[line[0]] = submap
-            if submap['top_choice'] == 'YES':
-                top_choice[line[0]] = submap
-                people_search[line[0]] = submap
-            elif submap['category'] == 'people search':
-                people_search[line[0]] = submap
-    return all_services, top_choice, people_search
+from config import get_config
+from registry import csv_to_map
+from email_templates import (SMTP_CONFIRMATION_TEMPLATE, GMAIL_CONFIRMATION_TEMPLATE, campaign_result,
+                             render_userdata, request_fragments, request_subject)
+from message_builder import MessageBuilder, envelope_addresses
+from sender_pool import get_sender_pool
+from dispatcher import OutgoingMessage, dispatch, add_sent_listener
+from fair_queue import fair_queue_for
+from reply_index import get_reply_index
+from campaign_scheduler import get_scheduler
+from broker_groups import deliverable_groups, rank_groups
+from registry_versions import get_registry_versions
+from attachments import prepare_attachments, attachments_for
+from preview import CampaignPreview
+from request_context import annotate_campaign
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+def recordSentRequest(message, result=None):
+    '''
+    Records a delivered broker request in the reply index, so replies can be matched to it.
+    '''
+    if message.message_id and message.service != 'confirmation':
+        # Gmail API sends return the thread the broker's reply will land in
+        thread_id = result.get('threadId') if isinstance(result, dict) else None
+        get_reply_index().record_sent(message.message_id, message.service, message.to,
+                                      campaign_id=message.campaign_id, thread_id=thread_id)
+
+add_sent_listener(recordSentRequest)
+
+def clearPendingBroker(message, result=None):
+    '''
+    Marks the brokers of a delivered request as no longer pending for the user (see privacyAPI),
+    including requests the campaign scheduler sends days after the campaign ran.
+    '''
+    if message.reply_to and message.service != 'confirmation':
+        get_registry_versions().clear_pending(message.reply_to, message.brands)
+
+add_sent_listener(clearPendingBroker)
 
 def createLabel(service):
     '''
@@ -49,14 +62,14 @@ def createLabel(service):
             if label["name"] == "PrivacyBot":
                 label_id = label["id"]
                 create_label = False
-                print("Label PrivacyBot with id %s already exists. Using the same label for the mails being sent..." % label_id)
+                logger.info("Label PrivacyBot with id %s already exists. Using the same label for the mails being sent..." % label_id)
                 break
         else:
             create_label = True
     if create_label:
         created_label = service.users().labels().create(userId='me', body={"name": "PrivacyBot", "labelListVisibility": "label_show", "messageListVisibility": "show"}).execute()
         label_id = created_label["id"]
-        print("Label PrivacyBot does not exist. Creating label with name PrivacyBot with id %s..." % label_id)
+        logger.info("Label PrivacyBot does not exist. Creating label with name PrivacyBot with id %s..." % label_id)
     
     return label_id
 
@@ -68,26 +81,8 @@ def sendEmailSMTP(usrjson, services_map, smtp_settings):
     '''
     
     # List of brokers used in confirmation email sent to the end user at the end of the transaction
-    sent_brokers = ""
-    notsent_brokers = ""
-
-    # Allowed PII Attributes
-    pii = {
-        "firstname":"First Name",
-        "lastname":"Last Name", 
-        "email":"Email",
-        "full_address":"Address",
-        "city":"City",
-        "state":"State",
-        "zip":"Zip",
-        "country":"Country",
-        "dob":"Date of birth",
-        "age":"Age",
-        "phone_num":"Phone Number",
-        "cc_last4":"Last 4 digits of credit card",
-        "device_ad_id":"Device Advertising ID",
-        "twitter_handle":"Twitter handle",
-        "link_to_profile":"Profile link"}
+    sent_brokers = []
+    notsent_brokers = []
 
     # Get SMTP settings
     smtp_server = smtp_settings.get('smtp_server', 'localhost')
@@ -97,166 +92,93 @@ def sendEmailSMTP(usrjson, services_map, smtp_settings):
     from_email = smtp_settings.get('from_email', usrjson.get('email', ''))
     smtp_use_tls = smtp_settings.get('smtp_use_tls', False)
 
-    # Create the chosen_services_map
-    for service in services_map:
-        submap = services_map[service] # build the service submap
-        broker_email = submap["privacy_dept_contact_email"]
+    # Messages are serialized the way smtplib.send_message would (CRLF, ">From " escaping)
+    builder = MessageBuilder('\r\n', mangle_from=True)
+    request_prefix, request_suffix = [builder.fragment(f) for f in request_fragments()]
+    # Uploaded files (the photo ID) are normalized and encoded once for every broker that needs them
+    attachments = prepare_attachments(usrjson)
+
+    # One request per privacy contact address, naming every brand that shares it
+    groups, skipped = deliverable_groups(services_map, get_reply_index().address_health())
+    for group in groups:
+        service = group.label
+        submap = group.merged_submap() # union of the PII the brands require
+        broker_email = group.contact
         
         # Build the user's data that will be sent to the data broker.
-        userdata = []
-        # go through info that a specific service wants
-        for attribute in pii:
-            if submap[attribute] == True:
-                if attribute in usrjson:
-                    userdata.append(pii[attribute] + ": " + usrjson[attribute])
-                
-        ordered_list = ""
-        for item in userdata:
-            ordered_list += "<li>" + str(item) + "</li>"
-
-        # Write the message body - using usrjson, fill only those details as required from each data broker
-        emailMsg = """\
-        <html>
-        <head>
-            <h1 align="center"> CCPA Deletion Request </h1>
-        </head>
-        <body>
-            <p>Hello! <br/>
-            I wish to exercise my rights under the California Consumer Privacy Act (CCPA). <br/>
-            I request that your business complies with the following requests which are granted to me by the CCPA: <br/>
-            <ol>
-                <li>Right to Delete</li>
-                <li>Right to not sell my information</li>
-            </ol>
-            </p>
-            
-            <p>
-            My details are:<br/>
-            <ol>
-                {code}
-            </ol>
-            </p>
-            <p>
-            Let me know if you have any questions.
-            </p>
-            <br/>
-            <p>
-            In the case that no email or user name information exists in your records, under the CCPA the above information can only be used for verification purposes and you may not collect it.
-            </p>
-        </body>
-        </html>
-        """.format(code=ordered_list)
-        
+        with span('render', broker=service):
+            ordered_list = render_userdata(usrjson, submap)
+            if len(group.services) > 1:
+                prefix = builder.fragment(request_fragments(group.services)[0])
+            else:
+                prefix = request_prefix
+
         # Fill the email fields
         # Set reply-to address. All the follow up emails from data brokers will be sent to this address.
         reply_to_addr = usrjson['email']
-        mimeMessage = MIMEMultipart()
-        mimeMessage['from'] = from_email
-        mimeMessage['to'] = broker_email
-        mimeMessage['subject'] = 'CCPA Data Deletion Request - ' + service
-        mimeMessage.add_header('reply-to', reply_to_addr)
-        mimeMessage.attach(MIMEText(emailMsg, 'html'))
+        # Our own Message-ID lets the reply ingestion worker match broker replies to this request
+        message_id = make_msgid(domain=(from_email or reply_to_addr).rpartition('@')[2] or None)
+        message = builder.build([
+            ('from', from_email),
+            ('to', broker_email),
+            ('subject', request_subject(group.services)),
+            ('reply-to', reply_to_addr),
+            ('Message-ID', message_id)], [prefix, ordered_list, request_suffix],
+            attachments=attachments_for(submap, attachments))
         
         email_notsent = False
 
         # Try sending the email via SMTP
         try:
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
+            envelope_from, envelope_to = envelope_addresses(from_email, broker_email)
+            with span('send', broker=service), smtplib.SMTP(smtp_server, smtp_port) as server:
                 if smtp_use_tls:
-                    server.starttls()
+                    with span('smtp.starttls'):
+                        server.starttls()
                 if smtp_username and smtp_password:
-                    server.login(smtp_username, smtp_password)
-                server.send_message(mimeMessage)
-            print(f"Email sent successfully to {service}")
+                    with span('smtp.auth'):
+                        server.login(smtp_username, smtp_password)
+                with span('smtp.data', size=len(message)):
+                    server.sendmail(envelope_from, envelope_to, message)
+            logger.info(f"Email sent successfully to {service}", extra={'broker': service, 'transport': 'smtp'})
+            get_reply_index().record_sent(message_id, service, broker_email)
         except Exception as e:
-            print(f"Email could not be sent to {service}: {e}")
+            logger.warning(f"Email could not be sent to {service}: {e}", extra={'broker': service, 'transport': 'smtp'})
             email_notsent = True
     
         # List of data brokers to be used for confirmation email
         if email_notsent == False:
-            if sent_brokers == "":
-                sent_brokers += service
-            else:
-                sent_brokers += ", " + service
+            sent_brokers.extend(group.services)
         else:
-            if notsent_brokers == "":
-                notsent_brokers += service
-            else:
-                notsent_brokers += ", " + service
+            notsent_brokers.extend(group.services)
 
-    if notsent_brokers == "":
-        sent_result = "Emails were sent to all chosen data brokers successfully."
-    else:
-        sent_result = "Emails could not be sent to " + notsent_brokers
-
-    cnf_email = """\
-        <html>
-        <head>
-            <h1 align="center">PrivacyBot Confirmation</h1>
-        </head>
-        <body>
-            <p>Thank you for using PrivacyBot!</p>
-
-            <p>So, what just happened?</p>
-            <ol type="1">
-            <li>You filled in the required data fields.</li>
-                <ol type="a">
-                <li>Data brokers needed to collect additional info to verify your identity and ensure they're deleting the right person's data. PrivacyBot only sent the minimum amount of information required for each data broker to delete your info, nothing more.</li>
-                </ol>
-            <li>Data deletion requests were sent from your email.</li>
-                <ol type="a">
-                <li>PrivacyBot is essentially a smart email routing tool. You just send CCPA data delete requests en masse right from your own email.</li>
-                </ol>
-            <li>Any replies/next steps will be sent to your inbox.</li>
-                <ol type="a">
-                <li>Any follow-ups from the companies themselves will go directly back to you. All further communications will be between you and the company, we just helped to kick start the process.</li>
-                </ol>
-            </ol>
-            If you selected a subset of data brokers that require some follow-up, they will be following up with you directly. Some possible responses you may be receiving include:
-            <ol type="1">
-            <li>The form fill out</li>
-                <ol type="a">
-                <li>Some companies will respond with a form they want you to fill out, regardless of how much info you included in the email. This may be because email was not one of their accepted methods of CCPA deletion requests, but they will still send you the link to the form you need to fill out, making it easier for you to submit your deletion request.</li>
-                <li>E.g "For privacy inquiries, please contact us by filling out the "Privacy Choices and Data Subject Rights" form available at [Link]"</li>
-                </ol>
-            <li>The confirmation email</li>
-                <ol type="a">
-                <li>The number of these you will get will vary depending on how many data fields you included in your requests - if you included all of them, odds are you'll be getting a lot of these. More often than not, these don't require any response from you and are merely confirming receipt of your request.</li>
-                <li>E.g "This will confirm that we have received your request to delete your information from the database." </li>
-                </ol>
-            <li>The information ask</li>
-                <ol type="a">
-                <li>Again depending on how many data fields you included in your request, you may receive a lot or only a few of these responses. These will happen when you did not input enough data into the deletion request, and merely require you to include some additional information. Whether you want to supply that information is up to you, but be assured that companies are legally not allowed to save any of that data they request from you.
-                <li>E.g "Please confirm the following additional information about yourself: Your full residential address."
-                </ol>
-            </ol>
-            Again, thank you for using PrivacyBot! Here's a link to our Privacy Policy and our <a href="https://privacybot.io/FAQ">FAQ</a> if you have any other questions! <br/>
-            </br>
-            <br/><br/>
-            Best,<br/>
-            The PrivacyBot Team<br/>
-    
-        </body>
-        </html>
-        """.format(sentresult=sent_result) 
+    sent_result = campaign_result(notsent_brokers, skipped=skippedBrands(skipped))
+
+    cnf_email = SMTP_CONFIRMATION_TEMPLATE.format(sentresult=sent_result) 
     
     # Send confirmation email via SMTP
-    cnfMessage = MIMEMultipart()
-    cnfMessage['from'] = from_email
-    cnfMessage['to'] = usrjson['email']
-    cnfMessage['subject'] = 'PrivacyBot Confirmation'
-    cnfMessage.attach(MIMEText(cnf_email, 'html'))
+    cnf_message = builder.build([
+        ('from', from_email),
+        ('to', usrjson['email']),
+        ('subject', 'PrivacyBot Confirmation')], cnf_email)
     
     try:
+        envelope_from, envelope_to = envelope_addresses(from_email, usrjson['email'])
         with smtplib.SMTP(smtp_server, smtp_port) as server:
             if smtp_use_tls:
                 server.starttls()
             if smtp_username and smtp_password:
                 server.login(smtp_username, smtp_password)
-            server.send_message(cnfMessage)
-        print("Confirmation email sent successfully")
+            server.sendmail(envelope_from, envelope_to, cnf_message)
+        logger.info("Confirmation email sent successfully", extra={'transport': 'smtp'})
     except Exception as e:
-        print(f"Confirmation email could not be sent: {e}")
+        logger.warning(f"Confirmation email could not be sent: {e}", extra={'transport': 'smtp'})
+
+def skippedBrands(skipped):
+    '''
+    Returns the brands left out of a campaign because their privacy contact address is missing or keeps bouncing.
+    '''
+    return [brand for group in skipped for brand in group.services]
 
 def sendEmail(usrjson, services_map):
     '''
@@ -264,17 +186,91 @@ def sendEmail(usrjson, services_map):
     - Checks the email provider configuration (Gmail API or SMTP)
     - Routes to the appropriate email sending function
     '''
-    config = EmailConfig()
+    config = get_config()
     email_provider = config.get_email_provider()
+    pool = getSenderPool(config)
     
-    if email_provider == 'smtp':
-        print("Using SMTP email provider")
+    if pool is not None:
+        logger.info(f"Using sender pool with {len(pool.accounts)} accounts")
+        return sendEmailPool(usrjson, services_map, pool, config.get_campaign_priority())
+    elif email_provider == 'smtp':
+        logger.info("Using SMTP email provider")
         smtp_settings = config.get_smtp_settings()
         return sendEmailSMTP(usrjson, services_map, smtp_settings)
     else:
-        print("Using Gmail API email provider")
+        logger.info("Using Gmail API email provider")
         return sendEmailGmailAPI(usrjson, services_map)
 
+def getSenderPool(config=None):
+    '''
+    Returns the process-wide sender pool for the configured accounts, or None if no pool is configured.
+    Sends are recorded in the scheduler's ledger so account quotas roll over 24 hours across restarts.
+    Concurrent campaigns share the pool by the configured fair scheduling weights and caps.
+    '''
+    config = config or get_config()
+    sender_accounts = config.get_sender_accounts()
+    if not sender_accounts:
+        return None
+    pool = get_sender_pool(sender_accounts, ledger=get_scheduler().ledger)
+    fair_queue_for(pool, config.get_fair_scheduling())
+    return pool
+
+def sendEmailPool(usrjson, services_map, pool, priority_order=None):
+    '''
+    This function sends emails through a pool of sender accounts (SMTP logins and/or Gmail tokens).
+    - Queues the CCPA Data Delete request emails in priority order (top choice brokers first by default)
+    - Sends as many as the accounts' rolling daily quotas allow; the rest are scheduled for later days
+    - Sends the confirmation email through the pool as well
+    Returns the campaign ID with the brokers sent, failed and deferred.
+    '''
+    reply_to_addr = usrjson['email']
+    request_prefix, request_suffix = request_fragments()
+    # Uploaded files (the photo ID) are normalized and encoded once for every broker that needs them
+    attachments = prepare_attachments(usrjson)
+
+    # One request per privacy contact address, naming every brand that shares it
+    messages = []
+    # Addresses that keep bouncing are skipped or sent last (see bounces.py)
+    health = get_reply_index().address_health()
+    groups, skipped = deliverable_groups(services_map, health)
+    for tier, group in rank_groups(groups, priority_order or get_config().get_campaign_priority(), health):
+        with span('render', broker=group.label):
+            prefix = request_fragments(group.services)[0] if len(group.services) > 1 else request_prefix
+            submap = group.merged_submap()
+            messages.append((tier, OutgoingMessage(
+                group.label, group.contact, request_subject(group.services), reply_to_addr,
+                [prefix, render_userdata(usrjson, submap), request_suffix],
+                brands=group.services, attachments=attachments_for(submap, attachments))))
+
+    scheduler = get_scheduler()
+    with span('scheduler.submit', messages=len(messages)):
+        campaign_id = scheduler.submit(messages, reply_to_addr)
+    annotate_campaign(campaign_id)
+    logger.info(f"Campaign {campaign_id}: {len(messages)} requests queued for {len(services_map)} data brokers",
+                extra={'campaign_id': campaign_id})
+    # Keep one message of quota for the confirmation email
+    with span('scheduler.run_due'):
+        outcome = scheduler.run_due(pool, campaign_id=campaign_id, reserve=1)
+
+    outcome['skipped'] = skippedBrands(skipped)
+    sent_result = campaign_result(outcome['failed'], outcome['deferred'], outcome['skipped'])
+    logger.info(sent_result, extra={'campaign_id': campaign_id})
+
+    cnf_email = SMTP_CONFIRMATION_TEMPLATE.format(sentresult=sent_result)
+    with span('confirmation'):
+        cnf_sent, _ = dispatch(pool, [OutgoingMessage(
+            'confirmation', usrjson['email'], 'PrivacyBot Confirmation', None, cnf_email)],
+            default_from=reply_to_addr)
+    if cnf_sent:
+        logger.info("Confirmation email sent successfully", extra={'campaign_id': campaign_id})
+    else:
+        logger.warning("Confirmation email could not be sent", extra={'campaign_id': campaign_id})
+
+    for account in pool.usage():
+        logger.info(f"Sender {account['name']}: {account['sent']} sent, {account['failed']} failed, {account['remaining']} remaining today",
+                    extra={'campaign_id': campaign_id, 'account': account['name'], 'transport': account['provider']})
+    return dict(outcome, campaign_id=campaign_id, confirmation_sent=bool(cnf_sent))
+
 def sendEmailGmailAPI(usrjson, services_map):
     '''
     This function:
@@ -287,180 +283,77 @@ def sendEmailGmailAPI(usrjson, services_map):
     API_VERSION = 'v1'
     SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
     
+    # Uploaded files (the photo ID) are normalized and encoded once for every broker that needs them
+    attachments = prepare_attachments(usrjson)
+
     gmail_service = Create_Service(CLIENT_SECRET_FILE, API_NAME, API_VERSION, SCOPES)
 
     # Create a new label or use an existing label named "PrivacyBot"
     label_id = createLabel(gmail_service)
     
     # List of brokers used in confirmation email sent to the end user at the end of the transaction
-    sent_brokers = ""
-    notsent_brokers = ""
-
-    # Allowed PII Attributes
-    pii = {
-        "firstname":"First Name",
-        "lastname":"Last Name", 
-        "email":"Email",
-        "full_address":"Address",
-        "city":"City",
-        "state":"State",
-        "zip":"Zip",
-        "country":"Country",
-        "dob":"Date of birth",
-        "age":"Age",
-        "phone_num":"Phone Number",
-        "cc_last4":"Last 4 digits of credit card",
-        "device_ad_id":"Device Advertising ID",
-        "twitter_handle":"Twitter handle",
-        "link_to_profile":"Profile link"}
-
-    # Create the chosen_services_map
-
-    for service in services_map:
-        submap = services_map[service] # build the service submap
-        broker_email = submap["privacy_dept_contact_email"]
+    sent_brokers = []
+    notsent_brokers = []
+
+    # Messages are serialized the way email.message.Message.as_bytes() would
+    builder = MessageBuilder()
+    request_prefix, request_suffix = [builder.fragment(f) for f in request_fragments()]
+
+    # One request per privacy contact address, naming every brand that shares it
+    groups, skipped = deliverable_groups(services_map, get_reply_index().address_health())
+    for group in groups:
+        service = group.label
+        submap = group.merged_submap() # union of the PII the brands require
+        broker_email = group.contact
         
         # Build the user's data that will be sent to the data broker.
-        userdata = []
-        # go through info that a specific service wants
-        for attribute in pii:
-            if submap[attribute] == True:
-                if attribute in usrjson:
-                    userdata.append(pii[attribute] + ": " + usrjson[attribute])
-                
-        ordered_list = ""
-        for item in userdata:
-            ordered_list += "<li>" + str(item) + "</li>"
-
-        # Write the message body - using usrjson, fill only those details as required from each data broker
-        emailMsg = """\
-        <html>
-        <head>
-            <h1 align="center"> CCPA Deletion Request </h1>
-        </head>
-        <body>
-            <p>Hello! <br/>
-            I wish to exercise my rights under the California Consumer Privacy Act (CCPA). <br/>
-            I request that your business complies with the following requests which are granted to me by the CCPA: <br/>
-            <ol>
-                <li>Right to Delete</li>
-                <li>Right to not sell my information</li>
-            </ol>
-            </p>
-            
-            <p>
-            My details are:<br/>
-            <ol>
-                {code}
-            </ol>
-            </p>
-            <p>
-            Let me know if you have any questions.
-            </p>
-            <br/>
-            <p>
-            In the case that no email or user name information exists in your records, under the CCPA the above information can only be used for verification purposes and you may not collect it.
-            </p>
-        </body>
-        </html>
-        """.format(code=ordered_list)
+        with span('render', broker=service):
+            ordered_list = render_userdata(usrjson, submap)
+            if len(group.services) > 1:
+                prefix = builder.fragment(request_fragments(group.services)[0])
+            else:
+                prefix = request_prefix
         
         # Fill the email fields
         # Set reply-to address. All the follow up emails from data brokers will be sent to this address.
         reply_to_addr = usrjson['email']
-        mimeMessage = MIMEMultipart()
-        mimeMessage['to'] = broker_email
-        mimeMessage['subject'] = 'CCPA Data Deletion Request - ' + service
-        mimeMessage.add_header('reply-to', reply_to_addr)
-        mimeMessage.attach(MIMEText(emailMsg, 'html'))
-        raw_string = base64.urlsafe_b64encode(mimeMessage.as_bytes()).decode()
+        request_message_id = make_msgid(domain=reply_to_addr.rpartition('@')[2] or None)
+        raw_string = builder.build_raw([
+            ('to', broker_email),
+            ('subject', request_subject(group.services)),
+            ('reply-to', reply_to_addr),
+            ('Message-ID', request_message_id)], [prefix, ordered_list, request_suffix],
+            attachments=attachments_for(submap, attachments))
         
         email_notsent = False
 
         # Try sending the email. Catch an exception in case the email cannot be sent. 
         try:
-            message = gmail_service.users().messages().send(userId='me', body={'raw': raw_string}).execute()
+            with span('gmail.send', broker=service):
+                message = gmail_service.users().messages().send(userId='me', body={'raw': raw_string}).execute()
             message_id = message['id']
-            label_msg = gmail_service.users().messages().modify(userId='me', id=message_id, body={"addLabelIds":[label_id,]}).execute()
+            with span('gmail.modify', broker=service):
+                label_msg = gmail_service.users().messages().modify(userId='me', id=message_id, body={"addLabelIds":[label_id,]}).execute()
+            # The Gmail reply tracker follows replies through the request's thread
+            get_reply_index().record_sent(request_message_id, service, broker_email, thread_id=message['threadId'])
         except:
-            print("Email could not be sent to", service)
+            logger.warning(f"Email could not be sent to {service}", extra={'broker': service, 'transport': 'gmail_api'})
             email_notsent = True
     
         # List of data brokers to be used for confirmation email
         if email_notsent == False:
-            if sent_brokers == "":
-                sent_brokers += service
-            else:
-                sent_brokers += ", " + service
+            sent_brokers.extend(group.services)
         else:
-            if notsent_brokers == "":
-                notsent_brokers += service
-            else:
-                notsent_brokers += ", " + service
+            notsent_brokers.extend(group.services)
 
-    if notsent_brokers == "":
-        sent_result = "Emails were sent to all chosen data brokers successfully."
-    else:
-        sent_result = "Emails could not be sent to " + notsent_brokers
-
-    cnf_email = """\
-        <html>
-        <head>
-            <h1 align="center">PrivacyBot Confirmation</h1>
-        </head>
-        <body>
-            <p>Thank you for using PrivacyBot!</p>
-
-            <p>So, what just happened?</p>
-            <ol type="1">
-            <li>You filled in the required data fields.</li>
-                <ol type="a">
-                <li>Data brokers needed to collect additional info to verify your identity and ensure they’re deleting the right person’s data. PrivacyBot only sent the minimum amount of information required for each data broker to delete your info, nothing more.</li>
-                </ol>
-            <li>Data deletion requests were sent from your email.</li>
-                <ol type="a">
-                <li>PrivacyBot is essentially a smart email routing tool. You just send CCPA data delete requests en masse right from your own email. PrivacyBot accessed your email through OAuth tokens and ran entirely from your own machine.</li>
-                </ol>
-            <li>Any replies/next steps will be sent to your inbox.</li>
-                <ol type="a">
-                <li>Any follow-ups from the companies themselves will go directly back to you. All further communications will be between you and the company, we just helped to kick start the process.</li>
-                </ol>
-            </ol>
-            If you selected a subset of data brokers that require some follow-up, they will be following up with you directly. Some possible responses you may be receiving include:
-            <ol type="1">
-            <li>The form fill out</li>
-                <ol type="a">
-                <li>Some companies will respond with a form they want you to fill out, regardless of how much info you included in the email. This may be because email was not one of their accepted methods of CCPA deletion requests, but they will still send you the link to the form you need to fill out, making it easier for you to submit your deletion request.</li>
-                <li>E.g “For privacy inquiries, please contact us by filling out the "Privacy Choices and Data Subject Rights" form available at [Link]”</li>
-                </ol>
-            <li>The confirmation email</li>
-                <ol type="a">
-                <li>The number of these you will get will vary depending on how many data fields you included in your requests - if you included all of them, odds are you’ll be getting a lot of these. More often than not, these don’t require any response from you and are merely confirming receipt of your request.</li>
-                <li>E.g “This will confirm that we have received your request to delete your information from the database.” </li>
-                </ol>
-            <li>The information ask</li>
-                <ol type="a">
-                <li>Again depending on how many data fields you included in your request, you may receive a lot or only a few of these responses. These will happen when you did not input enough data into the deletion request, and merely require you to include some additional information. Whether you want to supply that information is up to you, but be assured that companies are legally not allowed to save any of that data they request from you.
-                <li>E.g “Please confirm the following additional information about yourself: Your full residential address.”
-                </ol>
-            </ol>
-            Again, thank you for using PrivacyBot! Here’s a link to our Privacy Policy and our <a href="https://privacybot.io/FAQ">FAQ</a> if you have any other questions! <br/>
-            </br>
-            <h2> Please remove permissions for PrivacyBot from your Gmail account. </h2></br>
-            <br/><br/>
-            Best,<br/>
-            The PrivacyBot Team<br/>
-    
-        </body>
-        </html>
-        """.format(sentresult=sent_result) 
+    sent_result = campaign_result(notsent_brokers, skipped=skippedBrands(skipped))
+
+    cnf_email = GMAIL_CONFIRMATION_TEMPLATE.format(sentresult=sent_result) 
     # Send confirmation email
     # reply_to_addr = usrjson['email']
-    cnfMessage = MIMEMultipart()
-    cnfMessage['to'] = usrjson['email']
-    cnfMessage['subject'] = 'PrivacyBot Confirmation'
-    cnfMessage.attach(MIMEText(cnf_email, 'html'))
-    cnf_string = base64.urlsafe_b64encode(cnfMessage.as_bytes()).decode()
+    cnf_string = builder.build_raw([
+        ('to', usrjson['email']),
+        ('subject', 'PrivacyBot Confirmation')], cnf_email)
     cnf_message = gmail_service.users().messages().send(userId='me', body={'raw': cnf_string}).execute()
     cnf_message_id = cnf_message['id']
     cnf_label = gmail_service.users().messages().modify(userId='me', id=cnf_message_id, body={"addLabelIds":[label_id,]}).execute()
@@ -469,9 +362,27 @@ def sendEmailGmailAPI(usrjson, services_map):
     for filename in glob.glob("token_gmail*"):
         os.remove(filename)
 
-def privacyAPI(usrjson, service_map):
+def previewCampaign(usrjson, services_map):
+    '''
+    Returns a CampaignPreview of the requests privacyAPI would send for the same payload,
+    grouped and ordered the way the sender pool sends them. Nothing is sent or queued.
+    '''
+    return CampaignPreview(usrjson, services_map, get_reply_index().address_health(),
+                           get_config().get_campaign_priority())
+
+def privacyAPI(usrjson, service_map, registry_version=None):
     '''
     This function initiates the logic of sending request-to-delete emails to data brokers.
+    With registry_version, the run is recorded so a later delta campaign only sends to brokers changed since,
+    and to the brokers this run failed to send to or deferred and has not sent yet.
+    Returns the campaign outcome when sending through the sender pool.
     '''
-    sendEmail(usrjson, service_map)
+    outcome = sendEmail(usrjson, service_map)
+    if registry_version is not None:
+        # Only the sender pool reports which brokers failed
+        result = outcome if isinstance(outcome, dict) else {}
+        get_registry_versions().record_run(usrjson['email'], registry_version, usrjson.get('usrchoice'),
+                                           result.get('campaign_id'), attempted=service_map,
+                                           failed=result.get('failed', ()), deferred=result.get('deferred', ()))
+    return outcome
 
@@ -0,0 +1,194 @@
+"""
+Campaign dispatcher for the sender account pool.
+
+Sends a batch of rendered broker requests through a SenderPool, running up to
+the pool's total concurrency in parallel. Concurrent batches share the pool
+through its FairQueue, which interleaves the campaigns of different users
+(see fair_queue.py). Each message is serialized for the
+transport of the account it lands on (CRLF for SMTP, as_bytes() layout for
+the Gmail API). Listeners registered with add_sent_listener are told about
+every delivered message, e.g. to record its Message-ID for reply tracking.
+"""
+
+import logging
+import threading
+
+from fair_queue import fair_queue_for
+from message_builder import MessageBuilder, envelope_addresses
+from tracing import attach, current_trace, span
+
+logger = logging.getLogger(__name__)
+
+
+class OutgoingMessage:
+    """A rendered email waiting to be sent."""
+
+    __slots__ = ('service', 'to', 'subject', 'reply_to', 'body', 'campaign_id', 'message_id', 'brands',
+                 'attachments')
+
+    def __init__(self, service, to, subject, reply_to, body, campaign_id=None, message_id=None, brands=None,
+                 attachments=()):
+        """
+        Args:
+            service: Broker name (or a label such as 'confirmation')
+            to: Recipient address
+            subject: Subject line
+            reply_to: Reply-To address, or None to omit the header
+            body: HTML body, as a str or a sequence of str fragments
+            campaign_id: Campaign the message belongs to, if any
+            message_id: Message-ID header value, or None to let the server assign one
+            brands: Broker names covered by a request to a shared contact
+                (default: just service)
+            attachments: Attachments to send after the body; one Attachment
+                object is shared by all the messages of a campaign
+        """
+        self.service = service
+        self.to = to
+        self.subject = subject
+        self.reply_to = reply_to
+        self.body = body
+        self.campaign_id = campaign_id
+        self.message_id = message_id
+        self.brands = brands or [service]
+        self.attachments = attachments
+
+    def headers(self, from_email):
+        """Return the header list in the order corefunctions always used."""
+        headers = []
+        if from_email is not None:
+            headers.append(('from', from_email))
+        headers.append(('to', self.to))
+        headers.append(('subject', self.subject))
+        if self.reply_to is not None:
+            headers.append(('reply-to', self.reply_to))
+        if self.message_id is not None:
+            headers.append(('Message-ID', self.message_id))
+        return headers
+
+
+_sent_listeners = []
+
+
+def add_sent_listener(listener):
+    """
+    Register a callable invoked as listener(message, result) after each delivered message.
+
+    result is the transport's send result (the Gmail API response, or None for SMTP).
+    """
+    if listener not in _sent_listeners:
+        _sent_listeners.append(listener)
+
+
+def notify_sent(message, result=None):
+    """Tell the registered listeners that a message was delivered."""
+    for listener in _sent_listeners:
+        try:
+            listener(message, result)
+        except Exception as e:
+            logger.warning(f"Sent listener failed for {message.service}: {e}")
+
+
+_local = threading.local()
+
+
+def _builder_for(transport):
+    builders = getattr(_local, 'builders', None)
+    if builders is None:
+        builders = _local.builders = {}
+    key = (transport.linesep, transport.mangle_from)
+    builder = builders.get(key)
+    if builder is None:
+        builder = builders[key] = MessageBuilder(*key)
+    return builder
+
+
+def send_message(lease, message, default_from):
+    """
+    Serialize and send one message on a leased account.
+
+    Args:
+        lease: SenderLease from SenderPool.acquire
+        message: OutgoingMessage
+        default_from: From address for SMTP accounts without a from_email
+
+    Returns:
+        The transport's send result
+    """
+    transport = lease.transport
+    from_email = None
+    if transport.sets_from_header:
+        from_email = transport.from_email if transport.from_email is not None else default_from
+    with span('build', broker=message.service):
+        data = _builder_for(transport).build(message.headers(from_email), message.body,
+                                             attachments=message.attachments)
+    envelope_from, envelope_to = envelope_addresses(from_email or '', message.to)
+    return transport.send(envelope_from, envelope_to, data)
+
+
+def dispatch_results(pool, messages):
+    """
+    Send messages through the pool, spreading them across its accounts.
+
+    Messages are queued under their campaign's owner (default_from), so
+    the pool is shared fairly with other users' campaigns sending at the
+    same time.
+
+    Args:
+        pool: SenderPool
+        messages: List of (OutgoingMessage, default_from) pairs
+
+    Returns:
+        list: Per message, True if sent, False if the send failed, or None if
+        it was not attempted because every account's quota was used up
+    """
+    results = [None] * len(messages)
+    # Send workers record their spans on the submitting request's trace, if any
+    trace = current_trace()
+
+    def work(index):
+        with attach(trace), span('send', broker=messages[index][0].service):
+            send_one(index)
+
+    def send_one(index):
+        message, default_from = messages[index]
+        with span('pool.acquire'):
+            lease = pool.acquire()
+        if lease is None:
+            logger.warning(f"Daily quota exhausted on all sender accounts, not sending to {message.service}",
+                           extra={'campaign_id': message.campaign_id, 'broker': message.service})
+            return
+        context = {'campaign_id': message.campaign_id, 'broker': message.service,
+                   'account': lease.account.name, 'transport': lease.account.settings.get('provider', 'smtp')}
+        try:
+            result = send_message(lease, message, default_from)
+        except Exception as e:
+            logger.warning(f"Email could not be sent to {message.service} via {lease.account.name}: {e}", extra=context)
+            lease.release(False)
+            results[index] = False
+            return
+        lease.release(True)
+        results[index] = True
+        notify_sent(message, result)
+        logger.info(f"Email sent successfully to {message.service} via {lease.account.name}", extra=context)
+
+    fair_queue_for(pool).run([(default_from or message.campaign_id or '', lambda index=index: work(index))
+                              for index, (message, default_from) in enumerate(messages)])
+    return results
+
+
+def dispatch(pool, messages, default_from=''):
+    """
+    Send messages through the pool, spreading them across its accounts.
+
+    Args:
+        pool: SenderPool
+        messages: List of OutgoingMessage
+        default_from: From address for SMTP accounts without a from_email
+
+    Returns:
+        tuple: (sent, notsent) lists of service names, in message order
+    """
+    results = dispatch_results(pool, [(m, default_from) for m in messages])
+    sent = [m.service for m, ok in zip(messages, results) if ok]
+    notsent = [m.service for m, ok in zip(messages, results) if not ok]
+    return sent, notsent
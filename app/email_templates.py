@@ -0,0 +1,238 @@
+"""
+Email templates for CCPA deletion requests and PrivacyBot confirmations.
+Shared by the SMTP and Gmail API sending paths in corefunctions.py.
+"""
+
+# Allowed PII Attributes
+PII_ATTRIBUTES = {
+    "firstname":"First Name",
+    "lastname":"Last Name", 
+    "email":"Email",
+    "full_address":"Address",
+    "city":"City",
+    "state":"State",
+    "zip":"Zip",
+    "country":"Country",
+    "dob":"Date of birth",
+    "age":"Age",
+    "phone_num":"Phone Number",
+    "cc_last4":"Last 4 digits of credit card",
+    "device_ad_id":"Device Advertising ID",
+    "twitter_handle":"Twitter handle",
+    "link_to_profile":"Profile link"}
+
+# Details sent as attachments (see attachments.py); the body only says they are attached
+ATTACHMENT_ATTRIBUTES = {
+    "gov_photo_id":"Government photo ID"}
+
+# Write the message body - {code} is replaced with the <li> list of user details and
+# {brands} with the list of brands a shared-contact request covers (empty for one broker)
+REQUEST_TEMPLATE = """\
+        <html>
+        <head>
+            <h1 align="center"> CCPA Deletion Request </h1>
+        </head>
+        <body>
+            <p>Hello! <br/>
+            I wish to exercise my rights under the California Consumer Privacy Act (CCPA). <br/>
+            I request that your business complies with the following requests which are granted to me by the CCPA: <br/>
+            <ol>
+                <li>Right to Delete</li>
+                <li>Right to not sell my information</li>
+            </ol>
+            </p>{brands}
+            
+            <p>
+            My details are:<br/>
+            <ol>
+                {code}
+            </ol>
+            </p>
+            <p>
+            Let me know if you have any questions.
+            </p>
+            <br/>
+            <p>
+            In the case that no email or user name information exists in your records, under the CCPA the above information can only be used for verification purposes and you may not collect it.
+            </p>
+        </body>
+        </html>
+        """
+
+# Confirmation sent to the end user after an SMTP campaign
+SMTP_CONFIRMATION_TEMPLATE = """\
+        <html>
+        <head>
+            <h1 align="center">PrivacyBot Confirmation</h1>
+        </head>
+        <body>
+            <p>Thank you for using PrivacyBot!</p>
+
+            <p>{sentresult}</p>
+
+            <p>So, what just happened?</p>
+            <ol type="1">
+            <li>You filled in the required data fields.</li>
+                <ol type="a">
+                <li>Data brokers needed to collect additional info to verify your identity and ensure they're deleting the right person's data. PrivacyBot only sent the minimum amount of information required for each data broker to delete your info, nothing more.</li>
+                </ol>
+            <li>Data deletion requests were sent from your email.</li>
+                <ol type="a">
+                <li>PrivacyBot is essentially a smart email routing tool. You just send CCPA data delete requests en masse right from your own email.</li>
+                </ol>
+            <li>Any replies/next steps will be sent to your inbox.</li>
+                <ol type="a">
+                <li>Any follow-ups from the companies themselves will go directly back to you. All further communications will be between you and the company, we just helped to kick start the process.</li>
+                </ol>
+            </ol>
+            If you selected a subset of data brokers that require some follow-up, they will be following up with you directly. Some possible responses you may be receiving include:
+            <ol type="1">
+            <li>The form fill out</li>
+                <ol type="a">
+                <li>Some companies will respond with a form they want you to fill out, regardless of how much info you included in the email. This may be because email was not one of their accepted methods of CCPA deletion requests, but they will still send you the link to the form you need to fill out, making it easier for you to submit your deletion request.</li>
+                <li>E.g "For privacy inquiries, please contact us by filling out the "Privacy Choices and Data Subject Rights" form available at [Link]"</li>
+                </ol>
+            <li>The confirmation email</li>
+                <ol type="a">
+                <li>The number of these you will get will vary depending on how many data fields you included in your requests - if you included all of them, odds are you'll be getting a lot of these. More often than not, these don't require any response from you and are merely confirming receipt of your request.</li>
+                <li>E.g "This will confirm that we have received your request to delete your information from the database." </li>
+                </ol>
+            <li>The information ask</li>
+                <ol type="a">
+                <li>Again depending on how many data fields you included in your request, you may receive a lot or only a few of these responses. These will happen when you did not input enough data into the deletion request, and merely require you to include some additional information. Whether you want to supply that information is up to you, but be assured that companies are legally not allowed to save any of that data they request from you.
+                <li>E.g "Please confirm the following additional information about yourself: Your full residential address."
+                </ol>
+            </ol>
+            Again, thank you for using PrivacyBot! Here's a link to our Privacy Policy and our <a href="https://privacybot.io/FAQ">FAQ</a> if you have any other questions! <br/>
+            </br>
+            <br/><br/>
+            Best,<br/>
+            The PrivacyBot Team<br/>
+    
+        </body>
+        </html>
+        """
+
+# Confirmation sent to the end user after a Gmail API campaign
+GMAIL_CONFIRMATION_TEMPLATE = """\
+        <html>
+        <head>
+            <h1 align="center">PrivacyBot Confirmation</h1>
+        </head>
+        <body>
+            <p>Thank you for using PrivacyBot!</p>
+
+            <p>{sentresult}</p>
+
+            <p>So, what just happened?</p>
+            <ol type="1">
+            <li>You filled in the required data fields.</li>
+                <ol type="a">
+                <li>Data brokers needed to collect additional info to verify your identity and ensure they’re deleting the right person’s data. PrivacyBot only sent the minimum amount of information required for each data broker to delete your info, nothing more.</li>
+                </ol>
+            <li>Data deletion requests were sent from your email.</li>
+                <ol type="a">
+                <li>PrivacyBot is essentially a smart email routing tool. You just send CCPA data delete requests en masse right from your own email. PrivacyBot accessed your email through OAuth tokens and ran entirely from your own machine.</li>
+                </ol>
+            <li>Any replies/next steps will be sent to your inbox.</li>
+                <ol type="a">
+                <li>Any follow-ups from the companies themselves will go directly back to you. All further communications will be between you and the company, we just helped to kick start the process.</li>
+                </ol>
+            </ol>
+            If you selected a subset of data brokers that require some follow-up, they will be following up with you directly. Some possible responses you may be receiving include:
+            <ol type="1">
+            <li>The form fill out</li>
+                <ol type="a">
+                <li>Some companies will respond with a form they want you to fill out, regardless of how much info you included in the email. This may be because email was not one of their accepted methods of CCPA deletion requests, but they will still send you the link to the form you need to fill out, making it easier for you to submit your deletion request.</li>
+                <li>E.g “For privacy inquiries, please contact us by filling out the "Privacy Choices and Data Subject Rights" form available at [Link]”</li>
+                </ol>
+            <li>The confirmation email</li>
+                <ol type="a">
+                <li>The number of these you will get will vary depending on how many data fields you included in your requests - if you included all of them, odds are you’ll be getting a lot of these. More often than not, these don’t require any response from you and are merely confirming receipt of your request.</li>
+                <li>E.g “This will confirm that we have received your request to delete your information from the database.” </li>
+                </ol>
+            <li>The information ask</li>
+                <ol type="a">
+                <li>Again depending on how many data fields you included in your request, you may receive a lot or only a few of these responses. These will happen when you did not input enough data into the deletion request, and merely require you to include some additional information. Whether you want to supply that information is up to you, but be assured that companies are legally not allowed to save any of that data they request from you.
+                <li>E.g “Please confirm the following additional information about yourself: Your full residential address.”
+                </ol>
+            </ol>
+            Again, thank you for using PrivacyBot! Here’s a link to our Privacy Policy and our <a href="https://privacybot.io/FAQ">FAQ</a> if you have any other questions! <br/>
+            </br>
+            <h2> Please remove permissions for PrivacyBot from your Gmail account. </h2></br>
+            <br/><br/>
+            Best,<br/>
+            The PrivacyBot Team<br/>
+    
+        </body>
+        </html>
+        """
+
+def render_userdata(usrjson, submap):
+    '''
+    Build the <li> list of the user's data that will be sent to a data broker.
+    Only the details the broker requires (per the services map) are included.
+    '''
+    userdata = []
+    # go through info that a specific service wants
+    for attribute in PII_ATTRIBUTES:
+        if submap[attribute] == True:
+            if attribute in usrjson:
+                userdata.append(PII_ATTRIBUTES[attribute] + ": " + usrjson[attribute])
+    for attribute in ATTACHMENT_ATTRIBUTES:
+        if submap.get(attribute) == True and usrjson.get(attribute):
+            userdata.append(ATTACHMENT_ATTRIBUTES[attribute] + ": attached")
+
+    ordered_list = ""
+    for item in userdata:
+        ordered_list += "<li>" + str(item) + "</li>"
+    return ordered_list
+
+def render_brands(brands=None):
+    '''
+    Build the paragraph naming every brand covered by a request sent to a shared privacy contact.
+    Empty for a request to a single broker.
+    '''
+    if not brands or len(brands) < 2:
+        return ""
+    items = "".join("<li>" + str(brand) + "</li>" for brand in brands)
+    return ("\n            <p>\n            This request applies to each of the following brands, which share this privacy contact:"
+            "\n            <ul>" + items + "</ul>\n            </p>")
+
+def request_fragments(brands=None):
+    '''
+    Return the (prefix, suffix) of the request body around the <li> list of user details.
+    '''
+    prefix, suffix = REQUEST_TEMPLATE.split('{code}')
+    return prefix.replace('{brands}', render_brands(brands)), suffix
+
+def request_subject(brands):
+    '''
+    Return the subject line of a request to one broker or to a group of brands sharing a contact.
+    '''
+    return 'CCPA Data Deletion Request - ' + ' / '.join(brands)
+
+def campaign_result(failed=(), deferred=(), skipped=()):
+    '''
+    Return the confirmation email's {sentresult} sentence on what happened to the chosen brokers:
+    failed could not be sent to, deferred wait for the daily sending limit, and skipped were left
+    out because their privacy contact address is missing or keeps bouncing.
+    '''
+    if failed:
+        sent_result = "Emails could not be sent to " + ", ".join(failed) + "."
+    elif deferred:
+        sent_result = "Emails were sent successfully to the chosen data brokers the daily sending limit allowed today."
+    else:
+        sent_result = "Emails were sent to all chosen data brokers successfully."
+    if deferred:
+        sent_result += " Emails to " + ", ".join(deferred) + " will be sent once the daily sending limit allows."
+    if skipped:
+        sent_result += (" Emails were not sent to " + ", ".join(skipped)
+                        + " because their privacy contact address is missing or keeps bouncing.")
+    return sent_result
+
+def render_request(usrjson, submap, brands=None):
+    '''
+    Return the HTML body of the CCPA deletion request for one data broker (or group of brands).
+    '''
+    return REQUEST_TEMPLATE.format(code=render_userdata(usrjson, submap), brands=render_brands(brands))
@@ -0,0 +1,231 @@
+"""
+Fair sharing of a sender pool between concurrent campaigns.
+
+Every message sent through a SenderPool goes through the pool's FairQueue.
+Messages are queued per tenant (the user a campaign belongs to) and a shared
+set of worker threads, as many as the pool can have in flight, takes them in
+deficit round-robin order: each turn a tenant may start quantum x weight
+messages, then the next tenant with queued messages gets its turn. A
+470-broker campaign therefore shares the accounts with a 20-broker campaign
+submitted after it instead of holding them until it is done, and the small
+campaign finishes in a few rounds. Within a tenant, messages keep the order
+they were queued in (the campaign's priority order).
+
+Weights and per-tenant concurrency caps come from the fair_scheduling section
+of email_config.json (see config.py).
+"""
+
+import collections
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Messages a weight 1 tenant may start per round
+DEFAULT_QUANTUM = 1
+
+DEFAULT_WEIGHT = 1.0
+
+# Workers with nothing to do exit after this long and are restarted on demand
+IDLE_TIMEOUT_SECONDS = 5.0
+
+
+class _Tenant:
+    """Queued messages and round-robin state of one tenant."""
+
+    __slots__ = ('name', 'jobs', 'deficit', 'in_flight', 'turn_started')
+
+    def __init__(self, name):
+        self.name = name
+        self.jobs = collections.deque()
+        self.deficit = 0.0
+        self.in_flight = 0
+        self.turn_started = False
+
+
+class _Batch:
+    """Completion tracking for the jobs of one run() call."""
+
+    def __init__(self, count):
+        self.remaining = count
+        self.error = None
+        self.done = threading.Event()
+        if not count:
+            self.done.set()
+
+
+class FairQueue:
+    """Deficit round-robin scheduler feeding a bounded set of worker threads."""
+
+    def __init__(self, workers=1, settings=None, idle_timeout=IDLE_TIMEOUT_SECONDS):
+        """
+        Args:
+            workers: Worker threads, normally the pool's max_concurrency()
+            settings: fair_scheduling settings (quantum, weight, max_in_flight
+                and per-tenant overrides), see configure()
+            idle_timeout: Seconds an idle worker waits before exiting
+        """
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._tenants = {}
+        self._active = collections.deque()
+        self._threads = 0
+        self._idle = 0
+        self.workers = 1
+        self.quantum = DEFAULT_QUANTUM
+        self._weight = DEFAULT_WEIGHT
+        self._max_in_flight = None
+        self._overrides = {}
+        self.configure(workers, settings or {})
+
+    def configure(self, workers=None, settings=None):
+        """
+        Update the worker count and scheduling settings; queued messages keep their place.
+
+        Args:
+            workers: Worker threads
+            settings: dict with any of quantum (messages per round at weight 1),
+                weight (default tenant weight), max_in_flight (default per-tenant
+                cap on messages sending at once, None for no cap) and tenants
+                (list of {'tenant', 'weight', 'max_in_flight'} overrides)
+        """
+        with self._cond:
+            if workers is not None:
+                self.workers = max(1, int(workers))
+            if settings is not None:
+                self.quantum = max(1, int(settings.get('quantum') or DEFAULT_QUANTUM))
+                self._weight = float(settings.get('weight') or DEFAULT_WEIGHT)
+                self._max_in_flight = settings.get('max_in_flight') or None
+                self._overrides = {override['tenant']: override for override in settings.get('tenants') or []
+                                   if override.get('tenant')}
+            self._start_workers()
+            self._cond.notify_all()
+
+    def weight(self, tenant):
+        """Return a tenant's share of the sending capacity relative to weight 1."""
+        weight = self._overrides.get(tenant, {}).get('weight') or self._weight
+        return max(float(weight), 0.01)
+
+    def max_in_flight(self, tenant):
+        """Return how many of a tenant's messages may be sending at once (None for no cap)."""
+        return self._overrides.get(tenant, {}).get('max_in_flight') or self._max_in_flight
+
+    def _pick(self):
+        """Take the next job in deficit round-robin order, or None if none may start now."""
+        capped = 0
+        while self._active and capped < len(self._active):
+            tenant = self._active[0]
+            cap = self.max_in_flight(tenant.name)
+            if cap is not None and tenant.in_flight >= cap:
+                self._active.rotate(-1)
+                capped += 1
+                continue
+            if not tenant.turn_started:
+                tenant.deficit += self.quantum * self.weight(tenant.name)
+                tenant.turn_started = True
+            if tenant.deficit >= 1:
+                tenant.deficit -= 1
+                tenant.in_flight += 1
+                job = tenant.jobs.popleft()
+                if not tenant.jobs:
+                    # Leaving the round: unused deficit is not carried over (DRR)
+                    self._active.popleft()
+                    tenant.deficit = 0.0
+                    tenant.turn_started = False
+                return tenant, job
+            tenant.turn_started = False
+            self._active.rotate(-1)
+        return None
+
+    def _start_workers(self):
+        queued = sum(len(tenant.jobs) for tenant in self._active)
+        needed = min(self.workers - self._threads, queued - self._idle)
+        for _ in range(max(0, needed)):
+            self._threads += 1
+            threading.Thread(target=self._worker, name='fair-queue-worker', daemon=True).start()
+
+    def _worker(self):
+        with self._cond:
+            while self._threads <= self.workers:
+                picked = self._pick()
+                if picked is None:
+                    self._idle += 1
+                    notified = self._cond.wait(self.idle_timeout)
+                    self._idle -= 1
+                    if not notified and not self._active:
+                        break
+                    continue
+                tenant, (fn, batch) = picked
+                self._cond.release()
+                error = None
+                try:
+                    fn()
+                except BaseException as e:
+                    logger.exception(f"Send job for {tenant.name} failed")
+                    error = e
+                finally:
+                    self._cond.acquire()
+                tenant.in_flight -= 1
+                if not tenant.jobs and not tenant.in_flight:
+                    self._tenants.pop(tenant.name, None)
+                batch.remaining -= 1
+                if error is not None and batch.error is None:
+                    batch.error = error
+                if not batch.remaining:
+                    batch.done.set()
+                self._cond.notify_all()
+            self._threads -= 1
+
+    def run(self, jobs):
+        """
+        Queue jobs and wait until all of them have run.
+
+        Args:
+            jobs: List of (tenant, callable) pairs, in the order each tenant's
+                jobs should start
+
+        Raises:
+            The first exception a job raised, once every job has finished
+        """
+        batch = _Batch(len(jobs))
+        with self._cond:
+            for name, fn in jobs:
+                tenant = self._tenants.get(name)
+                if tenant is None:
+                    tenant = self._tenants[name] = _Tenant(name)
+                if not tenant.jobs:
+                    self._active.append(tenant)
+                tenant.jobs.append((fn, batch))
+            self._start_workers()
+            self._cond.notify_all()
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def stats(self):
+        """Return {tenant: {'queued', 'in_flight'}} for tenants with work."""
+        with self._cond:
+            return {name: {'queued': len(tenant.jobs), 'in_flight': tenant.in_flight}
+                    for name, tenant in self._tenants.items()}
+
+
+_queues = weakref.WeakKeyDictionary()
+_queues_lock = threading.Lock()
+
+
+def fair_queue_for(pool, settings=None):
+    """
+    Return the FairQueue of a sender pool, sized to the pool's current concurrency.
+
+    Args:
+        pool: SenderPool
+        settings: fair_scheduling settings to apply (default: keep the current ones)
+    """
+    with _queues_lock:
+        queue = _queues.get(pool)
+        if queue is None:
+            queue = _queues[pool] = FairQueue(pool.max_concurrency(), settings)
+            return queue
+    queue.configure(pool.max_concurrency(), settings)
+    return queue
@@ -0,0 +1,303 @@
+"""
+Incremental reply tracking for requests sent through the Gmail API.
+
+Broker requests are tagged with the "PrivacyBot" label when they are sent.
+The first sync reads the labelled threads once; after that the tracker keeps
+the mailbox's last historyId and asks users.history.list only for messages
+added since then, keeping those that land in a broker's thread. Message
+bodies are fetched with batched requests, replies are stored in the reply
+index (which updates each broker's request status) and get the PrivacyBot
+label too, so the whole conversation shows up under it in Gmail.
+
+Failed batch calls are retried with backoff. If some still fail, the saved
+historyId is not advanced, so the next sync asks for those messages again
+(replies already stored are skipped).
+
+Usage:
+    python gmail_tracker.py [token_file]
+"""
+
+import base64
+import logging
+import sys
+import time
+
+from bounces import BounceProcessor
+from imap_ingest import parse_reply
+from logging_setup import setup_logging
+from reply_classifier import classify_pending
+from reply_index import get_reply_index, parse_message_ids
+
+logger = logging.getLogger(__name__)
+
+# Gmail recommends at most 50 calls per batch request
+BATCH_SIZE = 50
+
+# Batch calls that fail (rate limits, server errors, timeouts) are retried this
+# many times, waiting BATCH_BACKOFF_SECONDS, then twice that, and so on
+BATCH_RETRIES = 3
+BATCH_BACKOFF_SECONDS = 1.0
+
+REQUEST_SUBJECT_PREFIX = 'CCPA Data Deletion Request - '
+
+DEFAULT_TRACKER_TOKEN = 'token_tracker_gmail_v1.pickle'
+
+
+def _http_status(error):
+    """Return the HTTP status of a googleapiclient HttpError (None for other errors)."""
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def _header(message, name):
+    for header in message.get('payload', {}).get('headers', []):
+        if header['name'].lower() == name.lower():
+            return header['value']
+    return None
+
+
+class GmailReplyTracker:
+    """Syncs replies to PrivacyBot requests from one Gmail mailbox into the reply index."""
+
+    def __init__(self, index, service, label_id, source='gmail', classifier=None,
+                 retry_backoff=BATCH_BACKOFF_SECONDS):
+        """
+        Initialize the tracker.
+
+        Args:
+            index: ReplyIndex to store replies in
+            service: Gmail API service object
+            label_id: ID of the PrivacyBot label
+            source: Reply source name, unique per mailbox
+            classifier: ReplyClassifier for new replies (default: the seed model)
+            retry_backoff: Seconds before the first retry of failed batch calls
+        """
+        self.index = index
+        self.service = service
+        self.label_id = label_id
+        self.source = source
+        self.classifier = classifier
+        self.retry_backoff = retry_backoff
+        # Callables invoked as handler(reply, request, raw) for every newly stored message
+        self.handlers = []
+
+    def _batch(self, requests):
+        """
+        Execute API calls in batch requests of BATCH_SIZE, retrying failed calls with backoff.
+
+        Args:
+            requests: List of (key, HttpRequest)
+
+        Returns:
+            tuple: (responses by key, keys of calls that still failed after BATCH_RETRIES retries).
+            Calls answered 404 (e.g. a message deleted since) are left out of both.
+        """
+        responses = {}
+        pending = list(requests)
+        for attempt in range(BATCH_RETRIES + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            errors = {}
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif _http_status(exception) == 404:
+                    logger.warning(f"Gmail batch call {request_id} failed: {exception}")
+                else:
+                    errors[request_id] = exception
+
+            for start in range(0, len(pending), BATCH_SIZE):
+                chunk = pending[start:start + BATCH_SIZE]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for key, request in chunk:
+                    batch.add(request, request_id=key)
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # The whole batch request failed (e.g. timed out); retry its unanswered calls
+                    for key, _ in chunk:
+                        if key not in responses:
+                            errors.setdefault(key, e)
+            pending = [(key, request) for key, request in pending if key in errors]
+            if not pending:
+                return responses, []
+            logger.warning(f"{len(pending)} Gmail batch calls failed (attempt {attempt + 1}), "
+                           f"e.g. {pending[0][0]}: {errors[pending[0][0]]}")
+        return responses, [key for key, _ in pending]
+
+    def sync(self):
+        """
+        Fetch and store replies that arrived since the last sync.
+
+        Returns:
+            int: Number of new replies stored
+        """
+        _, history_id = self.index.get_sync_state(self.source)
+        if history_id is None:
+            return self.bootstrap()
+
+        added = {}
+        page_token = None
+        latest = history_id
+        try:
+            while True:
+                response = self.service.users().history().list(
+                    userId='me', startHistoryId=history_id, historyTypes=['messageAdded'],
+                    pageToken=page_token).execute()
+                for record in response.get('history', []):
+                    for item in record.get('messagesAdded', []):
+                        message = item['message']
+                        if 'SENT' not in message.get('labelIds', []):
+                            added[message['id']] = message['threadId']
+                latest = response.get('historyId', latest)
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except Exception as e:
+            if _http_status(e) != 404:
+                raise
+            # The saved historyId is too old to resume from
+            logger.warning(f"Gmail history for {self.source} expired, rescanning PrivacyBot threads")
+            return self.bootstrap()
+
+        replies = {}
+        for message_id, thread_id in added.items():
+            request = self.index.find_request_by_thread(thread_id)
+            if request is not None:
+                replies[message_id] = request
+        stored, failed = self._store(replies)
+        if failed:
+            # Keep the previous starting point so the next sync fetches them again
+            logger.warning(f"Could not fetch {len(failed)} replies from {self.source}; "
+                           f"they will be retried on the next sync")
+        else:
+            self.index.set_sync_state(self.source, None, latest)
+        return stored
+
+    def bootstrap(self):
+        """
+        Read every PrivacyBot thread once and start history tracking from now.
+
+        Requests sent before thread IDs were recorded are added to the index
+        from the labelled sent messages.
+
+        Returns:
+            int: Number of new replies stored
+        """
+        users = self.service.users()
+        # Take the starting point first, so nothing arriving during the scan is missed
+        history_id = users.getProfile(userId='me').execute()['historyId']
+
+        thread_ids = []
+        page_token = None
+        while True:
+            response = users.threads().list(userId='me', labelIds=[self.label_id],
+                                            pageToken=page_token).execute()
+            thread_ids.extend(thread['id'] for thread in response.get('threads', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        threads, failed_threads = self._batch([
+            (thread_id, users.threads().get(userId='me', id=thread_id, format='metadata',
+                                            metadataHeaders=['Subject', 'To', 'Message-ID']))
+            for thread_id in thread_ids])
+        replies = {}
+        for thread_id in thread_ids:
+            messages = threads.get(thread_id, {}).get('messages', [])
+            request = self.index.find_request_by_thread(thread_id) or self._register(thread_id, messages)
+            if request is None:
+                continue
+            for message in messages:
+                if 'SENT' not in message.get('labelIds', []):
+                    replies[message['id']] = request
+        stored, failed = self._store(replies)
+        if failed_threads or failed:
+            # Without a saved historyId the next sync scans the threads again
+            logger.warning(f"Could not fetch {len(failed_threads)} threads and {len(failed)} replies "
+                           f"from {self.source}; they will be retried on the next sync")
+        else:
+            self.index.set_sync_state(self.source, None, history_id)
+        logger.info(f"Scanned {len(thread_ids)} PrivacyBot threads in {self.source}")
+        return stored
+
+    def _register(self, thread_id, messages):
+        """Record the broker request that started a thread, from its sent message."""
+        for message in messages:
+            subject = _header(message, 'Subject') or ''
+            if 'SENT' in message.get('labelIds', []) and subject.startswith(REQUEST_SUBJECT_PREFIX):
+                message_ids = parse_message_ids(_header(message, 'Message-ID'))
+                message_id = message_ids[0] if message_ids else f"<{message['id']}@gmail>"
+                service = subject[len(REQUEST_SUBJECT_PREFIX):]
+                self.index.record_sent(message_id, service, _header(message, 'To') or '',
+                                       sent_at=int(message.get('internalDate', 0)) / 1000 or None,
+                                       thread_id=thread_id)
+                return self.index.find_request_by_thread(thread_id)
+        return None
+
+    def _store(self, replies):
+        """
+        Fetch, store and label replies.
+
+        Args:
+            replies: Dict of Gmail message ID -> the sent request it answers
+
+        Returns:
+            tuple: (number of new replies stored, IDs of messages that could not be fetched)
+        """
+        if not replies:
+            return 0, []
+        users = self.service.users()
+        raw_messages, failed = self._batch([
+            (message_id, users.messages().get(userId='me', id=message_id, format='raw'))
+            for message_id in replies])
+        stored = []
+        for message_id, request in replies.items():
+            response = raw_messages.get(message_id)
+            if response is None:
+                continue
+            raw = base64.urlsafe_b64decode(response['raw'])
+            reply = parse_reply(raw)
+            if self.index.add_reply(
+                    self.source, message_id, message_id=reply['message_id'],
+                    request_message_id=request['message_id'], service=request['service'],
+                    sender=reply['sender'], subject=reply['subject'], date=reply['date'], body=reply['body']):
+                stored.append(message_id)
+                for handler in self.handlers:
+                    handler(reply, request, raw)
+        if stored:
+            users.messages().batchModify(userId='me', body={'ids': stored, 'addLabelIds': [self.label_id]}).execute()
+            logger.info(f"Stored {len(stored)} new replies from {self.source}")
+            classify_pending(self.index, self.classifier)
+        return len(stored), failed
+
+    def run_forever(self, interval_seconds=300):
+        """Sync every interval_seconds."""
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Gmail sync of {self.source} failed: {e}")
+            time.sleep(interval_seconds)
+
+
+def main():
+    """Run the tracker with a Gmail token kept apart from the sending tokens."""
+    from Google import Create_Service
+    from corefunctions import createLabel
+    setup_logging()
+    token_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRACKER_TOKEN
+    service = Create_Service('client_secret.json', 'gmail', 'v1',
+                             ['https://www.googleapis.com/auth/gmail.modify'], pickle_file=token_file)
+    address = service.users().getProfile(userId='me').execute()['emailAddress']
+    tracker = GmailReplyTracker(get_reply_index(), service, createLabel(service), f"gmail:{address}")
+    tracker.handlers.append(BounceProcessor(tracker.index))
+    try:
+        tracker.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Zero-downtime restarts by handing the listening socket to a new process.
+
+The server listens on a socket it owns (or inherited, see below). To restart
+after an update, HandoffServer.handoff() starts a new process with the same
+command line and passes it the listening socket as an inherited file
+descriptor (PRIVACYBOT_LISTEN_FD) plus the write end of a pipe
+(PRIVACYBOT_READY_FD). The new process warms up, starts accepting on the
+same socket and writes to the pipe; only then does the old process stop
+accepting. Connections waiting in the backlog are picked up by the new
+process, requests the old one already accepted run to completion, and the
+old process exits once its active campaigns have drained.
+
+If the new process fails or is not ready within READY_TIMEOUT_SECONDS it is
+killed and the old process keeps serving.
+"""
+
+import logging
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LISTEN_FD_ENV = 'PRIVACYBOT_LISTEN_FD'
+READY_FD_ENV = 'PRIVACYBOT_READY_FD'
+
+READY_TIMEOUT_SECONDS = 120
+
+# Campaigns run inside requests and can take minutes
+DRAIN_TIMEOUT_SECONDS = 900
+
+LISTEN_BACKLOG = 128
+
+
+def listening_socket(host, port, backlog=LISTEN_BACKLOG):
+    """
+    Return the socket to serve on: the one inherited from a predecessor, else a new one.
+
+    Args:
+        host: Address to bind when not inheriting
+        port: Port to bind when not inheriting
+        backlog: Listen backlog for a new socket
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        sock = socket.socket(fileno=int(fd))
+        os.set_inheritable(sock.fileno(), False)
+        logger.info(f"Serving on inherited socket {sock.getsockname()}")
+        return sock
+    return socket.create_server((host, port), backlog=backlog)
+
+
+def werkzeug_server(app, sock):
+    """Create a threaded Werkzeug server accepting on an already listening socket."""
+    from werkzeug.serving import make_server
+    host, port = sock.getsockname()[:2]
+    return make_server(host, port, app, threaded=True, fd=sock.fileno())
+
+
+class _ClosingIterator:
+    """WSGI response wrapper that reports when the response is finished."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+class HandoffServer:
+    """WSGI server that can pass its listening socket to a successor process."""
+
+    def __init__(self, app, host='127.0.0.1', port=5000, server_factory=werkzeug_server, argv=None):
+        """
+        Args:
+            app: WSGI application
+            host: Address to bind (ignored when the socket is inherited)
+            port: Port to bind (ignored when the socket is inherited)
+            server_factory: Callable (wsgi app, listening socket) returning a
+                server with serve_forever(), shutdown() and server_close()
+            argv: Command line of the successor (default: this process's)
+        """
+        self.app = app
+        self.sock = listening_socket(host, port)
+        self.server_factory = server_factory
+        self.argv = argv or [sys.executable] + sys.argv
+        self.server = None
+        self.successor = None
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._handoff_lock = threading.Lock()
+
+    def _request_done(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _wsgi(self, environ, start_response):
+        with self._cond:
+            self.in_flight += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._request_done()
+            raise
+        return _ClosingIterator(body, self._request_done)
+
+    def serve_forever(self, warm_up=None):
+        """
+        Warm up, start accepting, and serve until handed off or shut down.
+
+        When this process was started by handoff(), the predecessor stops
+        accepting once warm_up has run and the server is listening.
+
+        Args:
+            warm_up: Optional callable run before accepting connections
+        """
+        if warm_up is not None:
+            started = time.monotonic()
+            warm_up()
+            logger.info(f"Warm-up finished in {time.monotonic() - started:.2f}s")
+        self.server = self.server_factory(self._wsgi, self.sock)
+        ready_fd = os.environ.pop(READY_FD_ENV, None)
+        if ready_fd is not None:
+            os.write(int(ready_fd), b'1')
+            os.close(int(ready_fd))
+        logger.info(f"Accepting connections on {self.sock.getsockname()}")
+        self.server.serve_forever()
+
+    def handoff(self, timeout=READY_TIMEOUT_SECONDS):
+        """
+        Start a successor on the listening socket and stop accepting once it is ready.
+
+        Returns:
+            bool: True if the successor took over; False if this process is
+            not serving yet or the successor failed (this process keeps serving)
+        """
+        if self.server is None:
+            return False
+        with self._handoff_lock:
+            read_fd, write_fd = os.pipe()
+            listen_fd = self.sock.fileno()
+            env = dict(os.environ, **{LISTEN_FD_ENV: str(listen_fd), READY_FD_ENV: str(write_fd)})
+            try:
+                child = subprocess.Popen(self.argv, pass_fds=(listen_fd, write_fd), env=env)
+            except OSError as e:
+                logger.error(f"Could not start successor process: {e}")
+                os.close(read_fd)
+                os.close(write_fd)
+                return False
+            os.close(write_fd)
+            try:
+                ready, _, _ = select.select([read_fd], [], [], timeout)
+                # EOF without a byte means the successor exited before it was ready
+                ready = bool(ready) and os.read(read_fd, 1) == b'1'
+            finally:
+                os.close(read_fd)
+            if not ready:
+                logger.error(f"Successor process {child.pid} was not ready within {timeout}s, keeping this one")
+                child.kill()
+                child.wait()
+                return False
+            self.successor = child
+            logger.info(f"Successor process {child.pid} is accepting connections, draining")
+            self.server.shutdown()
+            return True
+
+    def drain(self, timeout=DRAIN_TIMEOUT_SECONDS):
+        """
+        Wait for requests already accepted to finish, then close the server.
+
+        Returns:
+            bool: True if every request finished within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"{self.in_flight} requests still running after {timeout}s drain")
+                    break
+                self._cond.wait(remaining)
+            drained = not self.in_flight
+        if self.server is not None:
+            self.server.server_close()
+        self.sock.close()
+        return drained
@@ -0,0 +1,313 @@
+"""
+Incremental reply ingestion over IMAP (Proton Mail Bridge and others).
+
+The worker remembers the mailbox's UIDVALIDITY and the highest UID it has
+seen, so each sync fetches only messages that arrived since the last one; the
+first sync starts at the mailbox's UIDNEXT rather than reading the existing
+mail. Between syncs it waits in IMAP IDLE and wakes up as soon as the server
+announces new mail. Replies are matched to the sent requests through
+In-Reply-To/References and stored in the reply index, together with delivery
+status notifications; any other mail is left alone. Each batch of new replies
+is labelled by the reply classifier.
+
+Usage:
+    python imap_ingest.py
+"""
+
+import email
+import email.policy
+import imaplib
+import logging
+import re
+import select
+import sys
+import time
+
+from bounces import BounceProcessor, parse_dsn
+from logging_setup import setup_logging
+from reply_classifier import classify_pending
+from reply_index import get_reply_index, parse_message_ids
+
+logger = logging.getLogger(__name__)
+
+# Servers drop IDLE after 30 minutes; re-issue it a bit before that
+IDLE_TIMEOUT_SECONDS = 29 * 60
+
+FETCH_BATCH_SIZE = 100
+
+_UID = re.compile(rb'UID (\d+)')
+_UIDVALIDITY = re.compile(rb'UIDVALIDITY (\d+)')
+_UIDNEXT = re.compile(rb'UIDNEXT (\d+)')
+
+
+class IMAPConnection:
+    """Thin wrapper over imaplib adding UID helpers and IDLE."""
+
+    def __init__(self, imap_settings):
+        """
+        Connect and log in.
+
+        Args:
+            imap_settings: Dict with imap_server, imap_port, imap_use_tls,
+                imap_use_ssl, imap_username and imap_password
+        """
+        server = imap_settings.get('imap_server', 'localhost')
+        port = imap_settings.get('imap_port', 1143)
+        if imap_settings.get('imap_use_ssl', False):
+            self._imap = imaplib.IMAP4_SSL(server, port)
+        else:
+            self._imap = imaplib.IMAP4(server, port)
+            if imap_settings.get('imap_use_tls', False):
+                self._imap.starttls()
+        username = imap_settings.get('imap_username', '')
+        if username:
+            self._imap.login(username, imap_settings.get('imap_password', ''))
+
+    def select(self, mailbox):
+        """
+        Select a mailbox read-only.
+
+        Returns:
+            int: The mailbox UIDVALIDITY
+        """
+        typ, data = self._imap.select(mailbox, readonly=True)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"Could not select {mailbox}: {data}")
+        validity = self._imap.untagged_responses.get('UIDVALIDITY', [None])[-1]
+        if validity is None:
+            typ, data = self._imap.status(mailbox, '(UIDVALIDITY)')
+            validity = _UIDVALIDITY.search(data[0]).group(1)
+        return int(validity)
+
+    def uid_next(self, mailbox):
+        """Return the UID the next message in the selected mailbox will get."""
+        uid_next = self._imap.untagged_responses.get('UIDNEXT', [None])[-1]
+        if uid_next is None:
+            typ, data = self._imap.status(mailbox, '(UIDNEXT)')
+            uid_next = _UIDNEXT.search(data[0]).group(1)
+        return int(uid_next)
+
+    def uids_after(self, last_uid):
+        """Return the UIDs greater than last_uid, ascending."""
+        typ, data = self._imap.uid('SEARCH', None, 'UID', f"{last_uid + 1}:*")
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+        # "n:*" always matches the newest message, even when its UID is below n
+        return sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
+    def fetch(self, uids):
+        """
+        Fetch full messages without setting the \\Seen flag.
+
+        Returns:
+            list: (uid, raw message bytes) pairs
+        """
+        typ, data = self._imap.uid('FETCH', ','.join(map(str, uids)), '(UID BODY.PEEK[])')
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        messages = []
+        for item in data:
+            if isinstance(item, tuple):
+                match = _UID.search(item[0])
+                if match:
+                    messages.append((int(match.group(1)), item[1]))
+        return messages
+
+    def idle(self, timeout=IDLE_TIMEOUT_SECONDS):
+        """
+        Wait in IDLE until the server reports new mail or the timeout passes.
+
+        Returns:
+            bool: True if the server announced new messages
+        """
+        imap = self._imap
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        line = imap.readline()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE not accepted: {line!r}")
+        activity = False
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                # Wait on the socket rather than with a socket timeout, which
+                # would leave imaplib's buffered reader unusable afterwards.
+                remaining = deadline - time.monotonic()
+                pending = getattr(imap.sock, 'pending', None)
+                if not (pending and pending()):
+                    if remaining <= 0 or not select.select([imap.sock], [], [], remaining)[0]:
+                        break
+                line = imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("Connection closed during IDLE")
+                if line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line):
+                    activity = True
+                    break
+        finally:
+            imap.send(b'DONE\r\n')
+        while True:
+            line = imap.readline()
+            if not line or line.startswith(tag):
+                break
+            if line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line):
+                activity = True
+        return activity
+
+    def close(self):
+        """Log out."""
+        try:
+            self._imap.logout()
+        except Exception:
+            pass
+
+
+def parse_reply(raw):
+    """
+    Parse the parts of a reply the index needs.
+
+    Returns:
+        dict: message_id, references (list), sender, subject, date and text body
+    """
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    references = parse_message_ids(message.get('References')) + parse_message_ids(message.get('In-Reply-To'))
+    body = message.get_body(preferencelist=('plain', 'html'))
+    try:
+        text = body.get_content() if body is not None else ''
+    except (LookupError, UnicodeError):
+        text = ''
+    message_ids = parse_message_ids(message.get('Message-ID'))
+    return {
+        'message_id': message_ids[0] if message_ids else None,
+        'references': references,
+        'sender': str(message.get('From', '')),
+        'subject': str(message.get('Subject', '')),
+        'date': str(message.get('Date', '')),
+        'body': text,
+    }
+
+
+class ReplyIngestor:
+    """Syncs new replies from one IMAP mailbox into the reply index."""
+
+    def __init__(self, index, connection_factory, mailbox='INBOX', classifier=None):
+        """
+        Initialize the ingestor.
+
+        Args:
+            index: ReplyIndex to store replies in
+            connection_factory: Callable returning a connected IMAPConnection
+            mailbox: Mailbox to watch
+            classifier: ReplyClassifier for new replies (default: the seed model)
+        """
+        self.index = index
+        self.connection_factory = connection_factory
+        self.mailbox = mailbox
+        self.classifier = classifier
+        self.source = f"imap:{mailbox}"
+        self.connection = None
+        self.running = False
+        # Callables invoked as handler(reply, request, raw) for every newly stored message
+        self.handlers = []
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = self.connection_factory()
+        return self.connection
+
+    def sync(self):
+        """
+        Fetch and store messages that arrived since the last sync.
+
+        The first sync only records where the mailbox ends, so mail already in
+        it is never read. After a UIDVALIDITY change the whole mailbox is
+        scanned again, since the old UIDs no longer mean anything.
+
+        Returns:
+            int: Number of new replies stored
+        """
+        connection = self._connect()
+        validity = connection.select(self.mailbox)
+        saved_validity, last_uid = self.index.get_sync_state(self.source)
+        if saved_validity is None:
+            last_uid = connection.uid_next(self.mailbox) - 1
+        elif int(saved_validity) != validity:
+            logger.warning(f"UIDVALIDITY of {self.mailbox} changed, resyncing mailbox")
+            last_uid = 0
+        last_uid = int(last_uid or 0)
+
+        uids = connection.uids_after(last_uid)
+        stored = 0
+        for start in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[start:start + FETCH_BATCH_SIZE]
+            for uid, raw in sorted(connection.fetch(batch)):
+                if self.ingest(uid, raw, validity):
+                    stored += 1
+            # Save progress per batch so an interrupted sync resumes where it stopped
+            self.index.set_sync_state(self.source, validity, batch[-1])
+        if not uids:
+            self.index.set_sync_state(self.source, validity, last_uid)
+        if stored:
+            logger.info(f"Stored {stored} new replies from {self.mailbox}")
+            classify_pending(self.index, self.classifier)
+        return stored
+
+    def ingest(self, uid, raw, validity):
+        """
+        Parse, match and store one message.
+
+        Only replies to a recorded request and delivery status notifications
+        are stored; the rest of the user's mail is skipped.
+
+        Returns:
+            bool: True if the message was stored and is new
+        """
+        reply = parse_reply(raw)
+        request = self.index.find_request(reply['references'])
+        if request is None and parse_dsn(raw) is None:
+            return False
+        is_new = self.index.add_reply(
+            self.source, f"{validity}:{uid}", message_id=reply['message_id'],
+            request_message_id=request['message_id'] if request else None,
+            service=request['service'] if request else None,
+            sender=reply['sender'], subject=reply['subject'], date=reply['date'], body=reply['body'])
+        if is_new:
+            for handler in self.handlers:
+                handler(reply, request, raw)
+        return is_new
+
+    def run_forever(self, idle_timeout=IDLE_TIMEOUT_SECONDS, retry_seconds=30):
+        """Sync, then IDLE until new mail arrives; reconnect after errors."""
+        self.running = True
+        while self.running:
+            try:
+                self.sync()
+                self.connection.idle(idle_timeout)
+            except (imaplib.IMAP4.error, OSError) as e:
+                logger.warning(f"IMAP error on {self.mailbox}: {e}; reconnecting in {retry_seconds}s")
+                self.stop_connection()
+                time.sleep(retry_seconds)
+
+    def stop_connection(self):
+        """Close the current connection, if any."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def main():
+    """Run the ingestion worker with the configured IMAP settings."""
+    from config import get_config
+    setup_logging()
+    imap_settings = get_config().get_imap_settings()
+    ingestor = ReplyIngestor(get_reply_index(), lambda: IMAPConnection(imap_settings),
+                             imap_settings.get('mailbox', 'INBOX'))
+    ingestor.handlers.append(BounceProcessor(ingestor.index))
+    try:
+        ingestor.run_forever()
+    except KeyboardInterrupt:
+        ingestor.stop_connection()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+Load-test harness for the /privacyAPI/v1/ endpoint.
+
+Starts app.app in a child process with a throwaway config whose sender pool
+uses the 'null' or 'latency' transport (nothing is actually sent), fires
+concurrent profile submissions at it and reports response time percentiles,
+the error rate, and the server's CPU use and RSS.
+
+Usage:
+    python loadtest.py --transport latency --latency-ms 80 --concurrency 16 --requests 400
+    python loadtest.py --usrchoice all_services --output results.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_PROFILE = {
+    'firstname': 'Load',
+    'lastname': 'Test',
+    'email': 'loadtest@example.com',
+    'full_address': '1 Test Street',
+    'city': 'Testville',
+    'state': 'CA',
+    'zip': '90000',
+    'country': 'USA',
+    'dob': '01/01/1990',
+    'age': '35',
+    'phone_num': '5550000000',
+    'usrchoice': 'top_choice',
+}
+
+
+def percentile(sorted_values, pct):
+    """Return the nearest-rank percentile of an ascending list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, wall_seconds):
+    """
+    Summarize one load run.
+
+    Args:
+        latencies: Response times in seconds of successful requests
+        errors: Dict of error kind -> count
+        wall_seconds: Duration of the run
+
+    Returns:
+        dict: Request counts, throughput, error rate and latency percentiles (ms)
+    """
+    latencies = sorted(latencies)
+    failed = sum(errors.values())
+    total = len(latencies) + failed
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'requests': total,
+        'succeeded': len(latencies),
+        'failed': failed,
+        'errors': dict(errors),
+        'error_rate': failed / total if total else 0.0,
+        'throughput_rps': round(total / wall_seconds, 2) if wall_seconds else None,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+            'mean': ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+    }
+
+
+class ProcessSampler:
+    """Samples a process's CPU time and RSS from /proc while a run is in progress."""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._running = False
+        self._thread = None
+        self._start_cpu = None
+        self._start_time = None
+        self.result = {}
+
+    def cpu_seconds(self):
+        """Return user + system CPU seconds used by the process (None off Linux)."""
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rpartition(')')[2].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15; fields[0] here is field 3
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def rss_bytes(self):
+        """Return the resident set size of the process (None off Linux)."""
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def _loop(self):
+        while self._running:
+            rss = self.rss_bytes()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss, rss)
+            time.sleep(self.interval)
+
+    def start(self):
+        self._start_cpu = self.cpu_seconds()
+        self._start_time = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        Returns:
+            dict: cpu_seconds, cpu_percent (of one core), rss_peak_mb and rss_end_mb
+        """
+        self._running = False
+        self._thread.join()
+        wall = time.monotonic() - self._start_time
+        end_cpu = self.cpu_seconds()
+        rss = self.rss_bytes()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss, rss)
+        cpu = None if end_cpu is None or self._start_cpu is None else end_cpu - self._start_cpu
+        self.result = {
+            'cpu_seconds': None if cpu is None else round(cpu, 2),
+            'cpu_percent': None if cpu is None or not wall else round(100 * cpu / wall, 1),
+            'rss_peak_mb': round(self.peak_rss / 2**20, 1) if self.peak_rss else None,
+            'rss_end_mb': None if rss is None else round(rss / 2**20, 1),
+        }
+        return self.result
+
+
+def write_config(directory, transport, accounts, account_concurrency, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    """
+    Write an email config whose sender pool uses a fake transport.
+
+    Returns:
+        str: Path of the config file
+    """
+    config = {
+        'email_provider': 'smtp',
+        'sender_accounts': [{
+            'name': f"loadtest-{i + 1}",
+            'provider': transport,
+            'daily_quota': 10 ** 9,
+            'max_concurrency': account_concurrency,
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'error_rate': error_rate,
+        } for i in range(accounts)],
+    }
+    path = os.path.join(directory, 'email_config.json')
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=4)
+    return path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workdir, config_path, log_file=None):
+    """
+    Start app.app in a child process with its databases in workdir.
+
+    Returns:
+        subprocess.Popen
+    """
+    env = dict(os.environ,
+               PRIVACYBOT_EMAIL_CONFIG=config_path,
+               PRIVACYBOT_SCHEDULE_DB=os.path.join(workdir, 'campaign_schedule.db'),
+               PRIVACYBOT_REPLY_DB=os.path.join(workdir, 'replies.db'),
+               # Synthetic profiles' runs must not reach the real delta campaign history
+               PRIVACYBOT_VERSIONS_DB=os.path.join(workdir, 'registry_versions.db'))
+    output = open(log_file, 'w') if log_file else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                            cwd=APP_DIR, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+
+def wait_for_port(port, process, timeout=30):
+    """Wait until the server accepts connections; raise if it exits or times out."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port} within {timeout}s")
+
+
+def post_profile(port, body, timeout=300):
+    """
+    POST one profile.
+
+    Returns:
+        tuple: (latency in seconds, error kind or None)
+    """
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('POST', '/privacyAPI/v1/', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        error = None if response.status == 200 else f"HTTP {response.status}"
+    except Exception as e:
+        error = type(e).__name__
+    finally:
+        conn.close()
+    return time.perf_counter() - start, error
+
+
+def run_load(port, profile, concurrency, total):
+    """
+    Send total submissions with concurrency requests in flight.
+
+    Returns:
+        tuple: (latencies of successful requests, {error kind: count}, wall seconds)
+    """
+    body = json.dumps(profile).encode()
+    latencies = []
+    errors = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, error in executor.map(lambda _: post_profile(port, body), range(total)):
+            if error is None:
+                latencies.append(latency)
+            else:
+                errors[error] = errors.get(error, 0) + 1
+    return latencies, errors, time.perf_counter() - start
+
+
+def serve(port):
+    """Run app.app (called in the child process)."""
+    from app import app
+    app.run(host='127.0.0.1', port=port, threaded=True, debug=False, use_reloader=False)
+
+
+def format_report(report):
+    latency = report['latency_ms']
+    server = report['server']
+    return "\n".join([
+        f"Requests:    {report['requests']} ({report['failed']} failed, error rate {report['error_rate']:.2%})",
+        f"Throughput:  {report['throughput_rps']} req/s at concurrency {report['concurrency']}",
+        f"Latency ms:  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}",
+        f"Server CPU:  {server['cpu_seconds']}s ({server['cpu_percent']}% of one core)",
+        f"Server RSS:  peak {server['rss_peak_mb']} MB, end {server['rss_end_mb']} MB",
+    ] + [f"Error:       {kind} x{count}" for kind, count in report['errors'].items()])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the privacyAPI endpoint with fake transports")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help="Server port (default: a free port)")
+    parser.add_argument('--transport', choices=['null', 'latency'], default='null')
+    parser.add_argument('--latency-ms', type=float, default=50, help="Mean send latency for --transport latency")
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of sends that fail")
+    parser.add_argument('--accounts', type=int, default=4, help="Sender accounts in the pool")
+    parser.add_argument('--account-concurrency', type=int, default=4, help="max_concurrency per account")
+    parser.add_argument('--concurrency', type=int, default=8, help="Submissions in flight")
+    parser.add_argument('--requests', type=int, default=100, help="Submissions to send")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured submissions sent first")
+    parser.add_argument('--usrchoice', default='top_choice', choices=['top_choice', 'people_search', 'all_services'])
+    parser.add_argument('--server-log', help="Write the server's output to this file")
+    parser.add_argument('--output', help="Also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port)
+        return 0
+
+    port = args.port or free_port()
+    profile = dict(SAMPLE_PROFILE, usrchoice=args.usrchoice)
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = write_config(workdir, args.transport, args.accounts, args.account_concurrency,
+                                   args.latency_ms, args.jitter_ms, args.error_rate)
+        server = start_server(port, workdir, config_path, args.server_log)
+        try:
+            wait_for_port(port, server)
+            if args.warmup:
+                run_load(port, profile, 1, args.warmup)
+            sampler = ProcessSampler(server.pid)
+            sampler.start()
+            latencies, errors, wall = run_load(port, profile, args.concurrency, args.requests)
+            report = summarize(latencies, errors, wall)
+            report['server'] = sampler.stop()
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report.update(concurrency=args.concurrency, transport=args.transport, usrchoice=args.usrchoice,
+                  accounts=args.accounts, account_concurrency=args.account_concurrency)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
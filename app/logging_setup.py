@@ -0,0 +1,160 @@
+"""
+Structured, non-blocking logging for PrivacyBot.
+
+setup_logging() routes every logger through a QueueHandler, so code on the
+send path only puts the record on an in-memory queue; a QueueListener thread
+redacts, formats and writes it. Records are written as one JSON object per
+line with the standard fields (time, level, logger, message) plus any of
+campaign_id, broker, account and transport passed through `extra`.
+
+Settings (environment variables):
+    PRIVACYBOT_LOG_LEVEL   - DEBUG, INFO (default), WARNING, ...
+    PRIVACYBOT_LOG_FORMAT  - json (default) or text
+    PRIVACYBOT_LOG_PII     - set to 1 to log email addresses and phone numbers
+                             unredacted (off by default)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+
+# Context fields attached to records through `extra`
+CONTEXT_FIELDS = ('campaign_id', 'broker', 'account', 'transport')
+
+_EMAIL = re.compile(r'[\w.+-]+@([\w-]+\.[\w.-]+)')
+# Phone-shaped numbers only: an international number (+, 7 or more digits in
+# groups) or a national one grouped 3-3-4, so timestamps, byte counts and IDs
+# in log messages are left alone
+_PHONE = re.compile(r'(?<![\w.+-])'
+                    r'(?:\+(?=(?:[ .()-]{0,2}\d){7})\d{1,3}(?:[ .-]?\(\d{1,4}\))?(?:[ .-]?\d{2,4}){1,5}'
+                    r'|(?:\(\d{3}\) ?|\d{3}[ .-])\d{3}[ .-]\d{4})'
+                    r'(?!\w|[.-]?\d)')
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def redact(text):
+    """Mask the local part of email addresses and any phone numbers in text."""
+    if '@' in text:
+        text = _EMAIL.sub(r'***@\1', text)
+    return _PHONE.sub('<phone>', text)
+
+
+class RedactingFilter(logging.Filter):
+    """Redacts PII from the message, traceback and string extras of each record."""
+
+    _traceback_formatter = logging.Formatter()
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        # Exception messages (SMTP and Gmail errors) carry addresses too: format the
+        # traceback here, so formatters use the redacted exc_text instead of exc_info
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        if record.stack_info:
+            record.stack_info = redact(record.stack_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and isinstance(value, str):
+                setattr(record, key, redact(value))
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread."""
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record needs no pickling-safe
+        # copy; merging args and formatting tracebacks happens on the listener.
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level=None, stream=None, fmt=None, redact_pii=None):
+    """
+    Install the queue-based structured logging on the root logger (once per process).
+
+    Args:
+        level: Log level name or number (default: PRIVACYBOT_LOG_LEVEL or INFO)
+        stream: Output stream (default: stderr)
+        fmt: 'json' or 'text' (default: PRIVACYBOT_LOG_FORMAT or json)
+        redact_pii: Redact email addresses and phone numbers (default: unless
+            PRIVACYBOT_LOG_PII=1)
+
+    Returns:
+        logging.handlers.QueueListener: The running listener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = level or os.environ.get('PRIVACYBOT_LOG_LEVEL', 'INFO')
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+    fmt = fmt or os.environ.get('PRIVACYBOT_LOG_FORMAT', 'json')
+    if redact_pii is None:
+        redact_pii = os.environ.get('PRIVACYBOT_LOG_PII', '').lower() not in ('1', 'true', 'yes')
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'text':
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    else:
+        output.setFormatter(JSONFormatter())
+    if redact_pii:
+        output.addFilter(RedactingFilter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_InProcessQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,237 @@
+"""
+Opt-in memory watchdog for a long-running server.
+
+With PRIVACYBOT_MEMWATCH=1 the server traces allocations with tracemalloc and
+a background thread takes a snapshot every PRIVACYBOT_MEMWATCH_INTERVAL
+seconds (default 600). Each snapshot is compared with the previous one, and
+the allocation sites that grew the most are kept with the process RSS and
+traced heap size (the last HISTORY checks).
+
+When RSS or the traced heap has grown by more than PRIVACYBOT_MEMWATCH_GROWTH_MB
+(default 100) since startup or the last alert, a warning listing the top
+growing sites is logged and the snapshot is dumped to PRIVACYBOT_MEMWATCH_DIR
+(default: memwatch/) for a closer look:
+    python -c "import tracemalloc; s = tracemalloc.Snapshot.load('memwatch/<file>.snapshot'); ..."
+
+GET /admin/memory returns stats() when the request carries the
+X-PrivacyBot-Admin header with the admin token (see admin.py).
+Tracing slows allocation-heavy code down and costs memory of its own, so it
+is off unless enabled.
+"""
+
+import collections
+import gc
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMWATCH_DIR = 'memwatch'
+DEFAULT_INTERVAL_SECONDS = 600
+DEFAULT_GROWTH_MB = 100
+
+# Stack frames recorded per allocation; more frames give better sites at a higher cost
+DEFAULT_FRAMES = 1
+
+# Growing sites reported per check
+TOP_SITES = 10
+
+# Checks kept for stats()
+HISTORY = 24
+
+_ENABLED = os.environ.get('PRIVACYBOT_MEMWATCH', '').lower() in ('1', 'true', 'yes')
+
+# Allocations made by tracemalloc itself and the import machinery are not interesting
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def rss_bytes():
+    """Return the resident set size of this process (None off Linux)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    site = f"{frame.filename}:{frame.lineno}"
+    if len(stat.traceback) > 1:
+        site += ' <- ' + ' <- '.join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in list(stat.traceback)[1:])
+    return site
+
+
+class MemoryWatchdog:
+    """Periodic tracemalloc snapshots, diffs of the top growing sites, and growth alerts."""
+
+    def __init__(self, interval=None, growth_mb=None, output_dir=None, frames=None, top=TOP_SITES,
+                 history=HISTORY, clock=time.time):
+        """
+        Args:
+            interval: Seconds between checks (default: PRIVACYBOT_MEMWATCH_INTERVAL)
+            growth_mb: Growth in MB that triggers an alert and dump (default: PRIVACYBOT_MEMWATCH_GROWTH_MB)
+            output_dir: Directory for snapshot dumps (default: PRIVACYBOT_MEMWATCH_DIR)
+            frames: Stack frames traced per allocation (default: PRIVACYBOT_MEMWATCH_FRAMES)
+            top: Growing sites kept per check
+            history: Checks kept for stats()
+            clock: Returns the current time (for tests)
+        """
+        self.interval = float(interval or os.environ.get('PRIVACYBOT_MEMWATCH_INTERVAL') or DEFAULT_INTERVAL_SECONDS)
+        growth_mb = float(growth_mb or os.environ.get('PRIVACYBOT_MEMWATCH_GROWTH_MB') or DEFAULT_GROWTH_MB)
+        self.growth_bytes = int(growth_mb * 2**20)
+        self.output_dir = output_dir or os.environ.get('PRIVACYBOT_MEMWATCH_DIR', DEFAULT_MEMWATCH_DIR)
+        self.frames = int(frames or os.environ.get('PRIVACYBOT_MEMWATCH_FRAMES') or DEFAULT_FRAMES)
+        self.top = top
+        self.clock = clock
+        self.history = collections.deque(maxlen=history)
+        self.alerts = []
+        self.started_at = None
+        self.baseline = None
+        self._previous = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracing = False
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+    def start(self, background=True):
+        """
+        Start tracing and take the baseline snapshot.
+
+        Args:
+            background: Also start the thread that checks every interval
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._started_tracing = True
+            self.started_at = self.clock()
+            self._previous = self._snapshot()
+            self.baseline = {'rss_bytes': rss_bytes(), 'heap_bytes': tracemalloc.get_traced_memory()[0]}
+        logger.info(f"Memory watchdog started: checking every {self.interval:g}s, "
+                    f"alerting on {self.growth_bytes // 2**20} MB of growth")
+        if background and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='memory-watchdog', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and tracing (if this watchdog started it)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._previous = None
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Memory watchdog check failed")
+
+    def check(self):
+        """
+        Take a snapshot, diff it with the previous one, and alert on growth.
+
+        Returns:
+            dict: The check as recorded in history (time, rss_bytes, heap_bytes,
+            heap_peak_bytes, rss_growth, heap_growth and the top growing sites)
+        """
+        with self._lock:
+            if self._previous is None:
+                raise RuntimeError("Memory watchdog is not started")
+            snapshot = self._snapshot()
+            diff = snapshot.compare_to(self._previous, 'traceback' if self.frames > 1 else 'lineno')
+            self._previous = snapshot
+            heap, peak = tracemalloc.get_traced_memory()
+            rss = rss_bytes()
+            check = {
+                'time': self.clock(),
+                'rss_bytes': rss,
+                'heap_bytes': heap,
+                'heap_peak_bytes': peak,
+                'rss_growth': None if rss is None or self.baseline['rss_bytes'] is None
+                else rss - self.baseline['rss_bytes'],
+                'heap_growth': heap - self.baseline['heap_bytes'],
+                'top': [{'site': _site(stat), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff,
+                         'size': stat.size}
+                        for stat in diff if stat.size_diff > 0][:self.top],
+            }
+            self.history.append(check)
+            if max(check['rss_growth'] or 0, check['heap_growth']) > self.growth_bytes:
+                self._alert(check, snapshot)
+            return check
+
+    def _alert(self, check, snapshot):
+        sites = '; '.join(f"{site['site']} +{site['size_diff'] / 1024:.0f} KiB" for site in check['top'][:5])
+        logger.warning(f"Memory grew by {(check['rss_growth'] or 0) / 2**20:.1f} MB RSS, "
+                       f"{check['heap_growth'] / 2**20:.1f} MB traced heap; top growing sites: {sites}")
+        path = None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"memwatch-{time.strftime('%Y%m%d-%H%M%S', time.localtime(check['time']))}"
+                                                 f"-{os.getpid()}.snapshot")
+            snapshot.dump(path)
+            logger.warning(f"Memory snapshot written to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write memory snapshot: {e}")
+        self.alerts.append({'time': check['time'], 'rss_growth': check['rss_growth'],
+                            'heap_growth': check['heap_growth'], 'snapshot': path})
+        # The next alert needs another growth_bytes on top of this
+        self.baseline = {'rss_bytes': check['rss_bytes'], 'heap_bytes': check['heap_bytes']}
+
+    def stats(self):
+        """
+        Return current memory figures and the recent checks.
+
+        Returns:
+            dict: rss_bytes, heap_bytes, heap_peak_bytes, tracemalloc_bytes (its
+            own overhead), gc_counts, baseline, started_at, interval, growth_bytes,
+            checks (oldest first) and alerts
+        """
+        with self._lock:
+            heap, peak = tracemalloc.get_traced_memory()
+            return {
+                'rss_bytes': rss_bytes(),
+                'heap_bytes': heap,
+                'heap_peak_bytes': peak,
+                'tracemalloc_bytes': tracemalloc.get_tracemalloc_memory(),
+                'gc_counts': list(gc.get_count()),
+                'baseline': self.baseline,
+                'started_at': self.started_at,
+                'interval': self.interval,
+                'growth_bytes': self.growth_bytes,
+                'checks': list(self.history),
+                'alerts': list(self.alerts),
+            }
+
+
+_watchdog = None
+
+
+def get_memory_watchdog():
+    """Return the process-wide watchdog, or None unless PRIVACYBOT_MEMWATCH is set."""
+    global _watchdog
+    if _ENABLED and _watchdog is None:
+        _watchdog = MemoryWatchdog()
+    return _watchdog
+
@@ -0,0 +1,169 @@
+"""
+Byte-level assembler for PrivacyBot emails.
+
+Every message PrivacyBot sends is a multipart/mixed container with a
+text/html part, followed by any attachments (see attachments.py). MessageBuilder
+writes that structure straight into a reusable buffer from pre-encoded
+fragments and attachment parts, producing the same bytes the email.mime
+classes produce under the compat32 policy (as_bytes() for the Gmail API,
+BytesGenerator with CRLF line endings for smtplib.send_message), without
+building a MIME object tree per message.
+"""
+
+import base64
+import random
+import re
+import sys
+from email.base64mime import body_encode
+from email.header import Header
+from email.utils import getaddresses
+
+# Same shape as email.generator.Generator._make_boundary
+_BOUNDARY_WIDTH = len(repr(sys.maxsize - 1))
+_BOUNDARY_FMT = '%%0%dd' % _BOUNDARY_WIDTH
+
+# compat32 folds header lines longer than this
+_MAX_HEADER_LEN = 78
+
+_FROM_LINE = re.compile(rb'^From ', re.MULTILINE)
+
+
+def make_boundary():
+    """Return a random multipart boundary in the email package's format."""
+    token = random.randrange(sys.maxsize)
+    return '=' * 15 + (_BOUNDARY_FMT % token) + '=='
+
+
+def envelope_addresses(from_header, to_header):
+    """
+    Derive SMTP envelope addresses from header values like send_message does.
+
+    Returns:
+        tuple: (from_addr, to_addrs)
+    """
+    from_addrs = getaddresses([from_header])
+    from_addr = from_addrs[0][1] if from_addrs else ''
+    to_addrs = [addr for _, addr in getaddresses([to_header])]
+    return from_addr, to_addrs
+
+
+class MessageBuilder:
+    """
+    Assembles RFC 5322 text/html messages into one reusable buffer.
+
+    A builder keeps its own scratch buffer, so use one instance per thread.
+    """
+
+    def __init__(self, linesep='\n', mangle_from=False):
+        """
+        Initialize the builder.
+
+        Args:
+            linesep: Line separator ('\\n' to match as_bytes(), '\\r\\n' for SMTP)
+            mangle_from: Escape body lines starting with "From " (send_message
+                does this under compat32, as_bytes() does not)
+        """
+        self.linesep = linesep
+        self.mangle_from = mangle_from
+        self._nl = linesep.encode('ascii')
+        self._buf = bytearray()
+        self._part_7bit = self._encode_lines(
+            'Content-Type: text/html; charset="us-ascii"\n'
+            'MIME-Version: 1.0\n'
+            'Content-Transfer-Encoding: 7bit\n\n')
+        self._part_base64 = self._encode_lines(
+            'Content-Type: text/html; charset="utf-8"\n'
+            'MIME-Version: 1.0\n'
+            'Content-Transfer-Encoding: base64\n\n')
+        self._mime_version = self._encode_lines('MIME-Version: 1.0\n')
+
+    def _encode_lines(self, text):
+        data = text.encode('utf-8')
+        if self._nl != b'\n':
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n').replace(b'\n', self._nl)
+        return data
+
+    def fragment(self, text):
+        """
+        Pre-encode a body fragment once so it can be reused across messages.
+
+        Args:
+            text: Part of an HTML body
+
+        Returns:
+            bytes: The fragment encoded with this builder's line separator
+        """
+        return self._encode_lines(text)
+
+    def _header(self, name, value):
+        if value.isascii() and '\n' not in value and '\r' not in value \
+                and len(name) + 2 + len(value) <= _MAX_HEADER_LEN:
+            return ('%s: %s' % (name, value)).encode('ascii') + self._nl
+        # Long or non-ASCII values: fold/encode exactly like the compat32 policy
+        folded = Header(value, header_name=name).encode(
+            linesep=self.linesep, maxlinelen=_MAX_HEADER_LEN)
+        return ('%s: ' % name).encode('ascii') + folded.encode('ascii', 'surrogateescape') + self._nl
+
+    def build(self, headers, body, boundary=None, attachments=()):
+        """
+        Assemble a complete message.
+
+        Args:
+            headers: Sequence of (name, value) pairs, in output order
+            body: HTML body as a str, or a sequence of str/pre-encoded bytes fragments
+            boundary: Multipart boundary (default: random, as email.generator does)
+            attachments: Attachments to add after the body; their encoded parts
+                are reused as is
+
+        Returns:
+            bytes: The serialized message
+        """
+        if isinstance(body, str):
+            body = (body,)
+        chunks = [c if isinstance(c, bytes) else self._encode_lines(c) for c in body]
+
+        if all(c.isascii() for c in chunks):
+            part_headers = self._part_7bit
+            payload = b''.join(chunks)
+        else:
+            # Non-ASCII text is sent as base64 UTF-8, encoded from '\n' lines
+            text = b''.join(chunks).decode('utf-8')
+            if self._nl != b'\n':
+                text = text.replace(self.linesep, '\n')
+            part_headers = self._part_base64
+            payload = self._encode_lines(body_encode(text.encode('utf-8')))
+        if self.mangle_from:
+            payload = _FROM_LINE.sub(b'>From ', payload)
+
+        if boundary is None:
+            boundary = make_boundary()
+            while boundary.encode('ascii') in payload:
+                boundary = make_boundary()
+        delimiter = b'--' + boundary.encode('ascii')
+
+        nl = self._nl
+        buf = self._buf
+        del buf[:]
+        buf += self._header('Content-Type', 'multipart/mixed; boundary="%s"' % boundary)
+        buf += self._mime_version
+        for name, value in headers:
+            buf += self._header(name, value)
+        buf += nl
+        buf += delimiter
+        buf += nl
+        buf += part_headers
+        buf += payload
+        for attachment in attachments:
+            buf += nl
+            buf += delimiter
+            buf += nl
+            buf += attachment.part(self.linesep)
+        buf += nl
+        buf += delimiter
+        buf += b'--'
+        buf += nl
+        return bytes(buf)
+
+    def build_raw(self, headers, body, boundary=None, attachments=()):
+        """Assemble a message and return it base64url-encoded for the Gmail API."""
+        return base64.urlsafe_b64encode(self.build(headers, body, boundary, attachments)).decode()
@@ -0,0 +1,147 @@
+"""
+Preview of the requests a campaign would send, without sending anything.
+
+The brokers are grouped and ordered exactly as sendEmailPool does: one
+request per privacy contact, addresses that keep bouncing skipped or sent
+last. Grouping, filtering and counting only use the registry rows, so a
+preview of the full registry is cheap. Bodies are only rendered for the page
+that is asked for, and every distinct body is rendered once and sent once:
+requests reference it by body_id, and brokers that receive the same details
+share it.
+"""
+
+import hashlib
+
+from broker_groups import deliverable_groups, rank_groups
+from campaign_scheduler import DEFAULT_PRIORITY_ORDER
+from email_templates import ATTACHMENT_ATTRIBUTES, PII_ATTRIBUTES, render_userdata, request_fragments, request_subject
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def body_id(body):
+    """Return a short, stable identifier for a rendered body."""
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class CampaignPreview:
+    """The requests a campaign would send, rendered a page at a time."""
+
+    def __init__(self, usrjson, services_map, health=None, priority_order=None):
+        """
+        Args:
+            usrjson: Request data, the same payload /privacyAPI/v1/ takes
+            services_map: Services map for the user's choice
+            health: Optional {address: score} from ReplyIndex.address_health
+            priority_order: Campaign priority order (default: DEFAULT_PRIORITY_ORDER)
+        """
+        self.usrjson = usrjson
+        health = health or {}
+        groups, skipped = deliverable_groups(services_map, health)
+        self.entries = rank_groups(groups, priority_order or DEFAULT_PRIORITY_ORDER, health)
+        self.skipped = [brand for group in skipped for brand in group.services]
+        self._prefix, self._suffix = request_fragments()
+        self._bodies = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def filter(self, category=None, search=None, field=None):
+        """
+        Return the (tier, BrokerGroup) entries matching every given filter.
+
+        Args:
+            category: Registry category of any brand in the group ('top_choice' for top choice brokers)
+            search: Text in a brand name or the contact address (case-insensitive)
+            field: PII attribute the request includes, e.g. 'dob'
+        """
+        if field is not None and field not in PII_ATTRIBUTES and field not in ATTACHMENT_ATTRIBUTES:
+            raise ValueError(f"Unknown field: {field}")
+        entries = self.entries
+        if category:
+            category = category.lower()
+            if category == 'top_choice':
+                entries = [entry for entry in entries
+                           if any(submap.get('top_choice') == 'YES' for submap in entry[1].submaps)]
+            else:
+                entries = [entry for entry in entries
+                           if any(str(submap.get('category', '')).lower() == category for submap in entry[1].submaps)]
+        if search:
+            search = search.lower()
+            entries = [entry for entry in entries
+                       if search in entry[1].contact.lower() or any(search in brand.lower() for brand in entry[1].services)]
+        if field:
+            entries = [entry for entry in entries if field in self.fields(entry[1].merged_submap())[0]]
+        return entries
+
+    def fields(self, submap):
+        """
+        Return (included, missing): the details a broker requires that the
+        request includes (as render_userdata decides), and those the user left out.
+        """
+        included, missing = [], []
+        for attribute in PII_ATTRIBUTES:
+            if submap.get(attribute) is True:
+                (included if attribute in self.usrjson else missing).append(attribute)
+        for attribute in ATTACHMENT_ATTRIBUTES:
+            if submap.get(attribute) is True:
+                (included if self.usrjson.get(attribute) else missing).append(attribute)
+        return included, missing
+
+    def body(self, group, submap):
+        """Return (body_id, body) of a request, reusing an identical body rendered before."""
+        userdata = render_userdata(self.usrjson, submap)
+        key = (tuple(group.services) if len(group.services) > 1 else None, userdata)
+        rendered = self._bodies.get(key)
+        if rendered is None:
+            prefix = request_fragments(group.services)[0] if key[0] else self._prefix
+            body = prefix + userdata + self._suffix
+            rendered = self._bodies[key] = (body_id(body), body)
+        return rendered
+
+    def page(self, page=1, per_page=DEFAULT_PAGE_SIZE, **filters):
+        """
+        Render one page of requests.
+
+        Args:
+            page: Page number, from 1
+            per_page: Requests per page, up to MAX_PAGE_SIZE
+            **filters: See filter()
+
+        Returns:
+            dict: total, page, per_page, pages, skipped (brands left out of the
+            campaign), requests (recipient, subject, fields, body_id, ...) and
+            bodies ({body_id: body} for the requests on the page)
+        """
+        page, per_page = int(page), int(per_page)
+        if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+            raise ValueError(f"page must be at least 1 and per_page between 1 and {MAX_PAGE_SIZE}")
+        entries = self.filter(**filters)
+        requests, bodies = [], {}
+        for tier, group in entries[(page - 1) * per_page:page * per_page]:
+            submap = group.merged_submap()
+            included, missing = self.fields(submap)
+            key, bodies[key] = self.body(group, submap)
+            requests.append({
+                'service': group.label,
+                'brands': list(group.services),
+                'recipient': group.contact,
+                'subject': request_subject(group.services),
+                'reply_to': self.usrjson.get('email'),
+                'category': submap.get('category'),
+                'tier': tier,
+                'fields': included,
+                'missing': missing,
+                'attachments': [attribute for attribute in included if attribute in ATTACHMENT_ATTRIBUTES],
+                'body_id': key,
+            })
+        return {
+            'total': len(entries),
+            'page': page,
+            'per_page': per_page,
+            'pages': -(-len(entries) // per_page),
+            'skipped': self.skipped,
+            'requests': requests,
+            'bodies': bodies,
+        }
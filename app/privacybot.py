@@ -0,0 +1,265 @@
+"""
+Headless command-line runner for bulk campaigns.
+
+Reads one user profile per line (the same JSON the React app posts to
+/privacyAPI/v1/) from a JSONL file or stdin, runs each profile's campaign
+through corefunctions.privacyAPI on a pool of worker processes, and writes
+one JSON result line per profile as soon as it finishes:
+
+    {"line": 3, "status": "ok", "campaign_id": "...", "sent": [...], ...}
+    {"line": 4, "status": "error", "error": "KeyError: 'email'"}
+
+Input is read lazily and only a bounded number of profiles is in flight, so
+memory use does not grow with the input. Results carry the profile's line
+number (counting non-blank input lines from 1); with --resume the output file
+is scanned and profiles already completed are skipped.
+
+With --delta, each profile's campaign only goes to the brokers that were
+added, or whose contact or required details changed, since that user's last
+recorded run (see registry_versions.py); users with no recorded run and users
+with nothing new are reported as "skipped".
+
+Usage:
+    python privacybot.py profiles.jsonl --output results.jsonl --workers 4
+    python privacybot.py profiles.jsonl --output delta.jsonl --delta
+    cat profiles.jsonl | python privacybot.py - --output results.jsonl
+    python privacybot.py profiles.jsonl --output results.jsonl --resume
+"""
+
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from config import ConfigError, get_config
+from logging_setup import setup_logging
+from registry_snapshot import DEFAULT_REGISTRY_CSV, services_for_choice
+from registry_versions import get_registry_versions
+
+logger = logging.getLogger(__name__)
+
+# Profiles in flight per worker process
+QUEUE_DEPTH = 2
+
+
+def read_profiles(stream, done=None):
+    """
+    Yield the profile lines still to run.
+
+    Args:
+        stream: Iterable of input lines
+        done: Optional ResumePoint of lines already completed
+
+    Yields:
+        tuple: (line number, line text); blank lines are skipped and not counted
+    """
+    line_no = 0
+    for text in stream:
+        if not text.strip():
+            continue
+        line_no += 1
+        if done is not None and done.contains(line_no):
+            continue
+        yield line_no, text
+
+
+class ResumePoint:
+    """Lines completed by a previous run: a contiguous prefix plus a few stragglers."""
+
+    __slots__ = ('watermark', 'above')
+
+    def __init__(self):
+        self.watermark = 0
+        self.above = set()
+
+    def add(self, line_no):
+        """Mark a line completed, advancing the watermark past contiguous lines."""
+        if line_no <= self.watermark:
+            return
+        self.above.add(line_no)
+        while self.watermark + 1 in self.above:
+            self.watermark += 1
+            self.above.remove(self.watermark)
+
+    def contains(self, line_no):
+        """Return True if the line was completed."""
+        return line_no <= self.watermark or line_no in self.above
+
+    @classmethod
+    def from_results(cls, path):
+        """
+        Build the resume point from an existing results file.
+
+        Results finish out of order by at most the in-flight window, so only
+        that many line numbers are held beyond the watermark. A partial last
+        line left by an interrupted run is cut off so appended results start
+        on a line of their own.
+        """
+        point = cls()
+        if not os.path.exists(path):
+            return point
+        _truncate_partial_line(path)
+        with open(path) as f:
+            for text in f:
+                try:
+                    point.add(json.loads(text)['line'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return point
+
+
+def _truncate_partial_line(path):
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        # Walk back to the last complete line
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def run_profile(line_no, text, csv_file=DEFAULT_REGISTRY_CSV, delta=False):
+    """
+    Run one profile's campaign (in a worker process).
+
+    Args:
+        line_no: Input line number, echoed in the result
+        text: The profile's JSON line
+        csv_file: Broker registry CSV
+        delta: Only send to brokers new or changed since the user's last run
+
+    Returns:
+        dict: The result line
+    """
+    started = time.perf_counter()
+    result = {'line': line_no}
+    try:
+        usrjson = json.loads(text)
+        if not isinstance(usrjson, dict) or 'email' not in usrjson:
+            raise ValueError("profile must be a JSON object with an email")
+        if 'id' in usrjson:
+            result['id'] = usrjson['id']
+        versions = get_registry_versions()
+        version = versions.record_version(csv_file)
+        result['registry_version'] = version
+        services = services_for_choice(usrjson.get('usrchoice', 'top_choice'), csv_file)
+        if delta:
+            services = versions.delta_services(usrjson['email'], services, version)
+            if not services:
+                result['status'] = 'skipped'
+                result['reason'] = 'no previous run' if services is None else 'no changed brokers'
+                return result
+            result['brokers'] = sorted(services)
+        from corefunctions import privacyAPI
+        outcome = privacyAPI(usrjson, services, version)
+        result['status'] = 'ok'
+        if isinstance(outcome, dict):
+            result.update(outcome)
+    except Exception as e:
+        logger.warning(f"Campaign for input line {line_no} failed: {e}")
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _init_worker():
+    setup_logging()
+
+
+def run_stream(profiles, output, workers=1, runner=run_profile):
+    """
+    Run profiles on a process pool, writing each result line as it finishes.
+
+    Args:
+        profiles: Iterable of (line number, text) from read_profiles
+        output: Writable text stream for the result lines
+        workers: Worker processes
+        runner: Picklable callable (line number, text) -> result dict
+
+    Returns:
+        dict: Counts of 'ok', 'skipped' and 'error' results
+    """
+    counts = {'ok': 0, 'skipped': 0, 'error': 0}
+
+    def write(futures):
+        for future in futures:
+            result = future.result()
+            status = result.get('status')
+            counts[status if status in counts else 'error'] += 1
+            output.write(json.dumps(result, default=str) + '\n')
+        output.flush()
+
+    window = max(1, workers) * QUEUE_DEPTH
+    # Spawned workers start clean instead of inheriting the parent's threads and logging queue
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context,
+                             initializer=_init_worker) as executor:
+        pending = set()
+        for line_no, text in profiles:
+            if len(pending) >= window:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(finished)
+            pending.add(executor.submit(runner, line_no, text))
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(finished)
+    return counts
+
+
+def main(argv=None):
+    """Parse arguments and run the profiles; exits non-zero if any campaign failed."""
+    parser = argparse.ArgumentParser(prog='privacybot', description="Run PrivacyBot campaigns for JSONL user profiles")
+    parser.add_argument('input', nargs='?', default='-', help="JSONL profiles file, or - for stdin (default)")
+    parser.add_argument('-o', '--output', help="JSONL results file (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip input lines that already have a result in --output and append to it")
+    parser.add_argument('--delta', action='store_true',
+                        help="Only send to brokers new or changed since each user's last run")
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY_CSV, help="Broker registry CSV")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+
+    setup_logging()
+    # An invalid email config stops the run here rather than failing every campaign
+    try:
+        get_config()
+    except ConfigError as e:
+        logger.error(str(e))
+        return 1
+    done = ResumePoint.from_results(args.output) if args.resume else None
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = open(args.output, 'a' if args.resume else 'w') if args.output else sys.stdout
+    try:
+        runner = functools.partial(run_profile, csv_file=args.registry, delta=args.delta)
+        counts = run_stream(read_profiles(source, done), output, args.workers, runner)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"{counts['ok']} campaigns completed, {counts['skipped']} skipped, {counts['error']} failed")
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Opt-in profiling of single privacyAPI requests.
+
+A request is profiled when PRIVACYBOT_PROFILE=1 is set (every request) or
+when it carries the X-PrivacyBot-Profile header with the admin token (see
+admin.py). The request thread runs under cProfile, and a
+sampler thread records the stacks of that thread and of the send workers it
+starts. Both are written to PRIVACYBOT_PROFILE_DIR (default: profiles/),
+named after the campaign ID (see request_context.annotate_campaign):
+    <campaign>.pstats     - load with pstats / snakeviz
+    <campaign>.collapsed  - collapsed stacks for flamegraph.pl or speedscope
+
+With profiling off, request_profiler returns a shared no-op context manager.
+"""
+
+import collections
+import contextlib
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+
+import request_context
+from admin import admin_authorized
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-PrivacyBot-Profile'
+
+DEFAULT_PROFILE_DIR = 'profiles'
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_PROFILE_ALL = os.environ.get('PRIVACYBOT_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+_NOT_PROFILING = contextlib.nullcontext()
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    """Context manager profiling the current thread and the threads it starts."""
+
+    def __init__(self, output_dir=None, sample_interval=SAMPLE_INTERVAL_SECONDS):
+        """
+        Args:
+            output_dir: Directory for the profile files (default: PRIVACYBOT_PROFILE_DIR)
+            sample_interval: Seconds between stack samples
+        """
+        self.output_dir = output_dir or os.environ.get('PRIVACYBOT_PROFILE_DIR', DEFAULT_PROFILE_DIR)
+        self.sample_interval = sample_interval
+        self.campaign_id = None
+        self.stacks = collections.Counter()
+        self.paths = []
+        self._profiler = cProfile.Profile()
+        self._running = False
+        self._sampler = None
+
+    def _sample(self, watched_thread, ignored):
+        own = threading.get_ident()
+        while self._running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (ident in ignored and ident != watched_thread):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.sample_interval)
+
+    def __enter__(self):
+        self._previous = request_context.activate('profile', self)
+        self.started = time.time()
+        # Threads running before the request (the server, other requests) are not sampled
+        ignored = set(sys._current_frames())
+        self._running = True
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), ignored),
+                                         name='profile-sampler', daemon=True)
+        self._sampler.start()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profiler.disable()
+        self._running = False
+        self._sampler.join()
+        request_context.activate('profile', self._previous)
+        try:
+            self.write()
+        except OSError as e:
+            logger.warning(f"Could not write request profile: {e}")
+        return False
+
+    def write(self):
+        """Write the pstats and collapsed-stack files; returns their paths."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, request_context.output_name(self.campaign_id, self.started))
+        self._profiler.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        self.paths = [base + '.pstats', base + '.collapsed']
+        logger.info(f"Request profile written to {base}.pstats and {base}.collapsed")
+        return self.paths
+
+
+def request_profiler(header_value=None):
+    """
+    Return the context manager to run a request under.
+
+    Args:
+        header_value: Value of the X-PrivacyBot-Profile request header, if any
+
+    Returns:
+        RequestProfile if this request should be profiled, else a no-op context
+    """
+    if _PROFILE_ALL or admin_authorized(header_value):
+        return RequestProfile()
+    return _NOT_PROFILING
@@ -0,0 +1,31 @@
+"""
+Broker registry loading.
+Reads the services CSV into the maps used by the email logic in corefunctions.py.
+"""
+
+import csv
+
+def csv_to_map(csv_file):
+    """
+    converts csv of services to map, returns services map
+    Ex: services["AcmeData"]["privacy_dept_contact_email"] = "privacy@acmedata.com"...
+    """
+    all_services = {}
+    top_choice = {}
+    people_search = {}
+    with open(csv_file, 'r') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        cols = next(csv_reader) 
+        # cols = ['service_name', 'service_source', 'category', 'topchoice', 'service_privacy_url', 'privacy_dept_contact_email', ...]
+        for line in csv_reader:
+            # LINE: ['databroker1', 'service_source1', 'category1', 'YES/NO', 'https://someprivacyurl.com/', 'privacy@this.does.not.exist', 'T/F', 'T/F',...]
+            line = [True if x == 'TRUE' else False if x == 'FALSE' else x for x in line]
+            # creates the map schemas we want
+            submap = dict(zip(cols[1:], line[1:]))
+            all_services[line[0]] = submap
+            if submap['top_choice'] == 'YES':
+                top_choice[line[0]] = submap
+                people_search[line[0]] = submap
+            elif submap['category'] == 'people search':
+                people_search[line[0]] = submap
+    return all_services, top_choice, people_search
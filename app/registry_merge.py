@@ -0,0 +1,353 @@
+"""
+Merge several broker lists into one registry CSV.
+
+Sources are CSV files in the layout of services_list_06May2021.csv, JSON
+files (a list of broker objects, or {"services": [...]}) and JSON Lines
+files (.jsonl, one broker object per line). They are given highest
+precedence first, e.g. our own additions before the upstream list before a
+community list, and read in one streaming pass.
+
+Brokers are matched on a canonical name: lowercased, corporate suffixes
+(Inc, LLC, ...) and a domain-style TLD dropped, punctuation removed, so
+"Acxiom LLC", "acxiom" and "Acxiom.com" are one broker. When a broker
+appears in several sources:
+    - fields the higher precedence source leaves empty are filled from the
+      lower one;
+    - other differing fields keep the higher precedence value and are
+      reported as conflicts;
+    - requirement flags (the PII columns and gov_photo_id) are read as TRUE
+      or FALSE whichever way a source spells them (yes/no, 1/0, x, ...);
+      other values are reported as invalid and left out. They follow the
+      flag policy: 'priority' (default, the same rule as other fields) or
+      'union' (a detail is required if any source requires it).
+A broker listed twice in one source keeps its last row, as csv_to_map does.
+
+The merged registry also indexes brokers by contact-address domain. Brands
+sharing a contact are kept as separate brokers (a campaign groups them, see
+broker_groups.py), but the report lists differently named brokers at one
+domain so they can be checked for duplicates.
+
+Usage:
+    python registry_merge.py our_additions.csv services_list_06May2021.csv community.json \\
+        --output services_merged.csv --report merge_report.json --snapshot
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+
+from email_templates import ATTACHMENT_ATTRIBUTES, PII_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+NAME_COLUMN = 'service_name_cleaned'
+CONTACT_COLUMN = 'privacy_dept_contact_email'
+
+FLAG_COLUMNS = frozenset(PII_ATTRIBUTES) | frozenset(ATTACHMENT_ATTRIBUTES)
+
+FLAG_POLICIES = ('priority', 'union')
+
+# Column names community lists use for ours
+DEFAULT_ALIASES = {
+    'name': NAME_COLUMN,
+    'service': NAME_COLUMN,
+    'service_name': NAME_COLUMN,
+    'contact_email': CONTACT_COLUMN,
+    'privacy_email': CONTACT_COLUMN,
+}
+
+_CORPORATE_SUFFIXES = re.compile(
+    r'[\s,]+(inc|llc|l\.l\.c|ltd|limited|corp|corporation|co|company|lp|plc|gmbh)\.?$')
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+_DOMAIN_NAME = re.compile(r'^(?:https?://)?(?:www\.)?([a-z0-9-]+)(?:\.[a-z]{2,})+/?$')
+
+# Spellings of requirement flags in community lists, lowercased
+_TRUE_CELLS = frozenset(('true', 't', 'yes', 'y', '1', 'x', 'required'))
+_FALSE_CELLS = frozenset(('false', 'f', 'no', 'n', '0', 'not required'))
+
+
+def canonical_name(name):
+    """Return the key brokers are matched on, e.g. 'Acxiom, LLC' -> 'acxiom'."""
+    name = name.strip().lower()
+    match = _DOMAIN_NAME.match(name)
+    if match:
+        name = match.group(1)
+    previous = None
+    while previous != name:
+        previous, name = name, _CORPORATE_SUFFIXES.sub('', name)
+    return _NON_ALNUM.sub('', name)
+
+
+def contact_domain(address):
+    """Return the lowercased domain of a contact address ('' if there is none)."""
+    local, at, domain = address.strip().lower().rpartition('@')
+    if not at:
+        return ''
+    domain = domain.rstrip('.>')
+    return domain[4:] if domain.startswith('www.') else domain
+
+
+def _cell(value):
+    """Return a source value as the CSV cell it is written as."""
+    if value is True:
+        return 'TRUE'
+    if value is False:
+        return 'FALSE'
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _flag_cell(value):
+    """Return a requirement flag cell as 'TRUE' or 'FALSE' ('' if empty), or None if it is not a flag."""
+    lowered = value.lower()
+    if lowered in _TRUE_CELLS:
+        return 'TRUE'
+    if lowered in _FALSE_CELLS:
+        return 'FALSE'
+    return '' if not value else None
+
+
+def read_source(path, aliases=None):
+    """
+    Yield the rows of a source as {column: cell} dicts, without loading the whole file.
+
+    Args:
+        path: .csv, .json or .jsonl file
+        aliases: {source column: registry column} renames (default: DEFAULT_ALIASES)
+    """
+    aliases = DEFAULT_ALIASES if aliases is None else aliases
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            columns = [aliases.get(column.strip(), column.strip()) for column in next(reader, [])]
+            for line in reader:
+                yield dict(zip(columns, (cell.strip() for cell in line)))
+        return
+    if extension == '.jsonl':
+        with open(path) as f:
+            records = (json.loads(line) for line in f if line.strip())
+            for record in records:
+                yield {aliases.get(key, key): _cell(value) for key, value in record.items()}
+        return
+    if extension == '.json':
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('services', [])
+        for record in data:
+            yield {aliases.get(key, key): _cell(value) for key, value in record.items()}
+        return
+    raise ValueError(f"Unsupported registry source {path}: expected .csv, .json or .jsonl")
+
+
+class MergedRegistry:
+    """Brokers merged from several sources, indexed by canonical name and contact domain."""
+
+    def __init__(self, sources, flag_policy='priority'):
+        """
+        Args:
+            sources: Source labels, highest precedence first
+            flag_policy: 'priority' or 'union', see the module docstring
+        """
+        if flag_policy not in FLAG_POLICIES:
+            raise ValueError(f"Unknown flag policy {flag_policy!r}: expected one of {', '.join(FLAG_POLICIES)}")
+        self.sources = list(sources)
+        self.flag_policy = flag_policy
+        self.columns = []
+        self._column_set = set()
+        # canonical name -> row; dicts keep first-seen order
+        self.rows = {}
+        self.row_source = {}
+        # (key, column) -> source index, for cells filled or overridden after the row was created
+        self._origins = {}
+        self.by_domain = {}
+        self.duplicates = []
+        self.conflicts = []
+        self.invalid = []
+        self.read = [0] * len(self.sources)
+
+    def _add_columns(self, row):
+        for column in row:
+            if column not in self._column_set:
+                self._column_set.add(column)
+                self.columns.append(column)
+
+    def origin(self, key, column):
+        """Return the index of the source a merged cell came from."""
+        return self._origins.get((key, column), self.row_source[key])
+
+    def add(self, source, row, line):
+        """
+        Merge one row from a source; sources must be added highest precedence first.
+
+        Args:
+            source: Index of the source in self.sources
+            row: {column: cell}
+            line: Row number in the source, for the report
+        """
+        self.read[source] += 1
+        name = row.get(NAME_COLUMN, '')
+        key = canonical_name(name)
+        if not key:
+            self.invalid.append({'source': self.sources[source], 'line': line, 'reason': 'no service name'})
+            return
+        row = dict(row)
+        for column, value in row.items():
+            if column in FLAG_COLUMNS:
+                flag = _flag_cell(value)
+                if flag is None:
+                    self.invalid.append({'source': self.sources[source], 'line': line,
+                                         'reason': f"{column} is not a flag: {value!r}"})
+                    flag = ''
+                row[column] = flag
+        self._add_columns(row)
+        existing = self.rows.get(key)
+        if existing is None:
+            self.rows[key] = row
+            self.row_source[key] = source
+            domain = contact_domain(row.get(CONTACT_COLUMN, ''))
+            if domain:
+                self.by_domain.setdefault(domain, []).append(key)
+            return
+
+        self.duplicates.append({'service': existing[NAME_COLUMN], 'name': name,
+                                'source': self.sources[source], 'line': line,
+                                'kept_source': self.sources[self.row_source[key]]})
+        for column, value in row.items():
+            if column == NAME_COLUMN:
+                continue
+            current = existing.get(column, '')
+            if value == current:
+                continue
+            origin = self.origin(key, column)
+            if origin == source:
+                # Listed twice in one source: the last row wins, as in csv_to_map
+                self._set(key, existing, column, value, source)
+            elif value == '':
+                continue
+            elif current == '':
+                self._set(key, existing, column, value, source)
+            else:
+                self.conflicts.append({'service': existing[NAME_COLUMN], 'column': column,
+                                       'kept': current, 'kept_source': self.sources[origin],
+                                       'other': value, 'other_source': self.sources[source]})
+                if self.flag_policy == 'union' and column in FLAG_COLUMNS and value == 'TRUE':
+                    self._set(key, existing, column, value, source)
+
+    def _set(self, key, row, column, value, source):
+        if column == CONTACT_COLUMN:
+            old, new = contact_domain(row.get(column, '')), contact_domain(value)
+            if old != new:
+                if old:
+                    self.by_domain[old].remove(key)
+                    if not self.by_domain[old]:
+                        del self.by_domain[old]
+                if new:
+                    self.by_domain.setdefault(new, []).append(key)
+        row[column] = value
+        self._origins[(key, column)] = source
+
+    def lookup(self, name):
+        """Return the merged row of a broker by any spelling of its name, or None."""
+        return self.rows.get(canonical_name(name))
+
+    def at_domain(self, address_or_domain):
+        """Return the merged rows whose contact address is at a domain."""
+        domain = contact_domain(address_or_domain) if '@' in address_or_domain else address_or_domain.lower()
+        return [self.rows[key] for key in self.by_domain.get(domain, [])]
+
+    def output_columns(self):
+        """Return the merged CSV's columns: the name first, then in first-seen order."""
+        return [NAME_COLUMN] + [column for column in self.columns if column != NAME_COLUMN]
+
+    def write_csv(self, path):
+        """
+        Write the merged registry as a services CSV that csv_to_map and the snapshot compiler read.
+
+        Flags no source gave are written as FALSE.
+        """
+        columns = self.output_columns()
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(columns)
+            for row in self.rows.values():
+                writer.writerow([row.get(column) or ('FALSE' if column in FLAG_COLUMNS else '')
+                                 for column in columns])
+        os.replace(tmp_path, path)
+        return path
+
+    def report(self):
+        """
+        Return what the merge did.
+
+        Returns:
+            dict: sources (rows read from each), brokers, duplicates, conflicts,
+            invalid rows, and shared_domains ({domain: names} for domains with
+            several differently named brokers)
+        """
+        return {
+            'sources': dict(zip(self.sources, self.read)),
+            'brokers': len(self.rows),
+            'flag_policy': self.flag_policy,
+            'duplicates': self.duplicates,
+            'conflicts': self.conflicts,
+            'invalid': self.invalid,
+            'shared_domains': {domain: [self.rows[key][NAME_COLUMN] for key in keys]
+                               for domain, keys in self.by_domain.items() if len(keys) > 1},
+        }
+
+
+def merge_sources(paths, flag_policy='priority', aliases=None):
+    """
+    Merge registry sources in one pass.
+
+    Args:
+        paths: Source files, highest precedence first
+        flag_policy: 'priority' or 'union'
+        aliases: Column renames for non-standard sources (default: DEFAULT_ALIASES)
+
+    Returns:
+        MergedRegistry
+    """
+    registry = MergedRegistry([os.path.basename(path) for path in paths], flag_policy)
+    for source, path in enumerate(paths):
+        for line, row in enumerate(read_source(path, aliases), 2 if path.lower().endswith('.csv') else 1):
+            registry.add(source, row, line)
+    logger.info(f"Merged {sum(registry.read)} rows from {len(paths)} sources into {len(registry.rows)} brokers "
+                f"({len(registry.duplicates)} duplicates, {len(registry.conflicts)} conflicts)")
+    return registry
+
+
+def main(argv=None):
+    """Merge the given sources into one registry CSV."""
+    parser = argparse.ArgumentParser(description="Merge broker lists into one registry CSV")
+    parser.add_argument('sources', nargs='+', help="CSV, JSON or JSONL sources, highest precedence first")
+    parser.add_argument('-o', '--output', required=True, help="Merged registry CSV")
+    parser.add_argument('--flags', choices=FLAG_POLICIES, default='priority',
+                        help="How conflicting requirement flags are merged (default: priority)")
+    parser.add_argument('--report', help="Write the duplicates and conflicts to this JSON file")
+    parser.add_argument('--snapshot', action='store_true', help="Also compile the merged registry's snapshot")
+    args = parser.parse_args(argv)
+
+    from logging_setup import setup_logging
+    setup_logging()
+    registry = merge_sources(args.sources, args.flags)
+    registry.write_csv(args.output)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(registry.report(), f, indent=2)
+    if args.snapshot:
+        from registry_snapshot import compile_snapshot
+        compile_snapshot(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Precompiled binary snapshot of the broker registry.
+
+The services CSV is compiled once into a versioned, memory-mappable file
+(columnar cell arrays plus a deduplicated string table). Loading a snapshot
+only maps the file and reads a fixed header, so startup and auto-updater
+restarts skip CSV parsing entirely, and every worker process mapping the same
+snapshot shares its pages through the OS page cache.
+
+Usage:
+    python registry_snapshot.py services_list_06May2021.csv
+"""
+
+import csv
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Mapping
+
+from registry import csv_to_map
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'PBREGSNP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = '.regsnap'
+
+# magic, version, reserved, n_rows, n_cols, n_strings, strings_size,
+# n_all, n_top, n_people, csv_size, csv_mtime_ns, csv_sha256
+_HEADER = struct.Struct('<8sHHIIIIIIIQq32s')
+
+# Cell encoding: 0 and 1 are the parsed FALSE/TRUE values, anything else is
+# a string table index shifted by _STRING_BASE.
+_FALSE = 0
+_TRUE = 1
+_STRING_BASE = 2
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, corrupt or of another version."""
+
+
+def snapshot_path_for(csv_file):
+    """Return the default snapshot path for a services CSV."""
+    return os.path.splitext(csv_file)[0] + SNAPSHOT_SUFFIX
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _uint32_array(values):
+    arr = array('I', values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def compile_snapshot(csv_file, snapshot_file=None):
+    """
+    Compile a services CSV into a binary registry snapshot.
+
+    The row selection for the all/top_choice/people_search maps mirrors
+    csv_to_map (last duplicate wins, first-seen order), so a snapshot always
+    describes exactly what the CSV path would have returned.
+
+    Args:
+        csv_file: Path to the services CSV
+        snapshot_file: Output path (default: CSV path with .regsnap suffix)
+
+    Returns:
+        str: Path of the written snapshot
+    """
+    snapshot_file = snapshot_file or snapshot_path_for(csv_file)
+    stat = os.stat(csv_file)
+    csv_sha = _file_sha256(csv_file)
+
+    with open(csv_file, 'r') as f:
+        reader = csv.reader(f)
+        cols = next(reader)
+        rows = list(reader)
+
+    # Row index of the entry csv_to_map would keep for each service, in dict order.
+    top_col, category_col = cols.index('top_choice'), cols.index('category')
+    all_rows, top_rows, people_rows = {}, {}, {}
+    for i, line in enumerate(rows):
+        all_rows[line[0]] = i
+        if line[top_col] == 'YES':
+            top_rows[line[0]] = i
+            people_rows[line[0]] = i
+        elif line[category_col] == 'people search':
+            people_rows[line[0]] = i
+
+    strings = {}
+
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    col_ids = [intern(c) for c in cols]
+    cells = []
+    for c in range(len(cols)):
+        for line in rows:
+            value = line[c] if c < len(line) else None
+            if value == 'TRUE':
+                cells.append(_TRUE)
+            elif value == 'FALSE':
+                cells.append(_FALSE)
+            elif value is None:
+                # Short rows: zip() in csv_to_map drops the missing columns.
+                cells.append(0xFFFFFFFF)
+            else:
+                cells.append(intern(value) + _STRING_BASE)
+
+    blobs = [s.encode('utf-8') for s in strings]
+    offsets = [0]
+    for b in blobs:
+        offsets.append(offsets[-1] + len(b))
+    blob = b''.join(blobs)
+
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0,
+        len(rows), len(cols), len(strings), len(blob),
+        len(all_rows), len(top_rows), len(people_rows),
+        stat.st_size, stat.st_mtime_ns, csv_sha)
+
+    tmp_file = '%s.%d.tmp' % (snapshot_file, os.getpid())
+    with open(tmp_file, 'wb') as out:
+        out.write(header)
+        _uint32_array(col_ids).tofile(out)
+        _uint32_array(cells).tofile(out)
+        _uint32_array(all_rows.values()).tofile(out)
+        _uint32_array(top_rows.values()).tofile(out)
+        _uint32_array(people_rows.values()).tofile(out)
+        _uint32_array(offsets).tofile(out)
+        out.write(blob)
+    # Atomic replace: processes that already mapped the old file keep their pages.
+    os.replace(tmp_file, snapshot_file)
+    logger.info(f"Compiled registry snapshot {snapshot_file} ({len(rows)} rows)")
+    return snapshot_file
+
+
+class RegistrySnapshot:
+    """Read-only, memory-mapped view over a compiled registry snapshot."""
+
+    def __init__(self, snapshot_file):
+        """
+        Map a snapshot file.
+
+        Args:
+            snapshot_file: Path of the .regsnap file
+
+        Raises:
+            SnapshotError: If the file is not a valid snapshot of this version
+        """
+        self.snapshot_file = snapshot_file
+        try:
+            with open(snapshot_file, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"Could not map snapshot {snapshot_file}: {e}")
+
+        if len(self._mmap) < _HEADER.size:
+            raise SnapshotError(f"Snapshot {snapshot_file} is truncated")
+        (magic, version, _, self.n_rows, n_cols, n_strings, strings_size,
+         n_all, n_top, n_people, self.csv_size, self.csv_mtime_ns,
+         self.csv_sha256) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Snapshot {snapshot_file} has an unsupported format")
+
+        expected = (_HEADER.size + 4 * (n_cols + n_cols * self.n_rows + n_all
+                    + n_top + n_people + n_strings + 1) + strings_size)
+        if len(self._mmap) != expected:
+            raise SnapshotError(f"Snapshot {snapshot_file} is truncated")
+
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+
+        def take(count):
+            nonlocal offset
+            chunk = self._uint32_view(view[offset:offset + 4 * count])
+            offset += 4 * count
+            return chunk
+
+        col_ids = take(n_cols)
+        self._cells = take(n_cols * self.n_rows)
+        self._all_rows = take(n_all)
+        self._top_rows = take(n_top)
+        self._people_rows = take(n_people)
+        self._offsets = take(n_strings + 1)
+        self._blob = view[offset:offset + strings_size]
+        self._strings = {}
+
+        self.columns = tuple(self._string(i) for i in col_ids)
+        self._col_index = {name: i for i, name in enumerate(self.columns)}
+
+    @staticmethod
+    def _uint32_view(chunk):
+        if sys.byteorder == 'little':
+            return chunk.cast('I')
+        arr = array('I', chunk.tobytes())
+        arr.byteswap()
+        return arr
+
+    def _string(self, index):
+        value = self._strings.get(index)
+        if value is None:
+            value = str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+            self._strings[index] = value
+        return value
+
+    def cell(self, col, row):
+        """Return the parsed value of a cell, as csv_to_map would produce it."""
+        raw = self._cells[col * self.n_rows + row]
+        if raw == _TRUE:
+            return True
+        if raw == _FALSE:
+            return False
+        return self._string(raw - _STRING_BASE)
+
+    def has_cell(self, col, row):
+        """Return False for cells missing from short CSV rows."""
+        return self._cells[col * self.n_rows + row] != 0xFFFFFFFF
+
+    def is_fresh(self, csv_file):
+        """
+        Check whether this snapshot still describes csv_file.
+
+        A matching size and mtime is accepted without reading the CSV; otherwise
+        (e.g. after a git checkout touched the file) the content hash decides.
+        """
+        try:
+            stat = os.stat(csv_file)
+        except OSError:
+            return False
+        if stat.st_size == self.csv_size and stat.st_mtime_ns == self.csv_mtime_ns:
+            return True
+        if stat.st_size != self.csv_size:
+            return False
+        return _file_sha256(csv_file) == self.csv_sha256
+
+    def maps(self):
+        """Return (all_services, top_choice, people_search) as lazy mappings."""
+        return (ServiceMap(self, self._all_rows),
+                ServiceMap(self, self._top_rows),
+                ServiceMap(self, self._people_rows))
+
+
+class ServiceRecord(Mapping):
+    """One registry row, read on demand from the snapshot."""
+
+    __slots__ = ('_snapshot', '_row')
+
+    def __init__(self, snapshot, row):
+        self._snapshot = snapshot
+        self._row = row
+
+    def __getitem__(self, key):
+        col = self._snapshot._col_index.get(key)
+        if not col or not self._snapshot.has_cell(col, self._row):
+            # Column 0 is the service name, which is the map key, not a field.
+            raise KeyError(key)
+        return self._snapshot.cell(col, self._row)
+
+    def __iter__(self):
+        snapshot = self._snapshot
+        for col in range(1, len(snapshot.columns)):
+            if snapshot.has_cell(col, self._row):
+                yield snapshot.columns[col]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'ServiceRecord(%r)' % dict(self)
+
+
+class ServiceMap(Mapping):
+    """Service name -> ServiceRecord mapping over a subset of snapshot rows."""
+
+    def __init__(self, snapshot, rows):
+        self._snapshot = snapshot
+        self._rows = rows
+        self._index = None
+
+    def _names(self):
+        if self._index is None:
+            snapshot = self._snapshot
+            self._index = {snapshot.cell(0, row): row for row in self._rows}
+        return self._index
+
+    def __getitem__(self, name):
+        return ServiceRecord(self._snapshot, self._names()[name])
+
+    def __contains__(self, name):
+        return name in self._names()
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def __len__(self):
+        return len(self._rows)
+
+
+DEFAULT_REGISTRY_CSV = 'services_list_06May2021.csv'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_registry(csv_file, snapshot_file=None, compile_if_stale=True):
+    """
+    Load the broker registry, preferring a fresh compiled snapshot.
+
+    The mapped snapshot is cached per process and re-validated with a stat()
+    on each call. When the snapshot is missing or stale the CSV is parsed with
+    csv_to_map, and a new snapshot is compiled for the next load.
+
+    Args:
+        csv_file: Path to the services CSV
+        snapshot_file: Snapshot path (default: CSV path with .regsnap suffix)
+        compile_if_stale: Whether to (re)compile a stale or missing snapshot
+
+    Returns:
+        tuple: (all_services, top_choice, people_search)
+    """
+    snapshot_file = snapshot_file or snapshot_path_for(csv_file)
+    with _cache_lock:
+        snapshot = _cache.get(snapshot_file)
+        if snapshot is not None and snapshot.is_fresh(csv_file):
+            return snapshot.maps()
+
+        if snapshot is None and os.path.exists(snapshot_file):
+            try:
+                snapshot = RegistrySnapshot(snapshot_file)
+            except SnapshotError as e:
+                logger.warning(str(e))
+                snapshot = None
+            if snapshot is not None and snapshot.is_fresh(csv_file):
+                _cache[snapshot_file] = snapshot
+                return snapshot.maps()
+
+        _cache.pop(snapshot_file, None)
+        if compile_if_stale:
+            try:
+                compile_snapshot(csv_file, snapshot_file)
+                snapshot = RegistrySnapshot(snapshot_file)
+                _cache[snapshot_file] = snapshot
+                return snapshot.maps()
+            except (OSError, SnapshotError) as e:
+                logger.warning(f"Could not compile registry snapshot, using CSV: {e}")
+
+    logger.info(f"Registry snapshot for {csv_file} is stale, parsing CSV")
+    return csv_to_map(csv_file)
+
+
+def services_for_choice(usrchoice, csv_file=DEFAULT_REGISTRY_CSV):
+    """
+    Return the brokers a request selected.
+
+    Args:
+        usrchoice: 'all_services', 'top_choice', or anything else for people search sites
+        csv_file: Path to the services CSV
+
+    Returns:
+        dict-like: Services map for the choice
+    """
+    all_services, top_choice, people_search = load_registry(csv_file)
+    if usrchoice == 'all_services':
+        return all_services
+    if usrchoice == 'top_choice':
+        return top_choice
+    return people_search
+
+
+if __name__ == '__main__':
+    from logging_setup import setup_logging
+    setup_logging()
+    for path in sys.argv[1:] or [DEFAULT_REGISTRY_CSV]:
+        compile_snapshot(path)
@@ -0,0 +1,325 @@
+"""
+Content-hashed versions of the broker registry and diffs between them.
+
+Each distinct services CSV is recorded once, keyed by the SHA-256 of its
+bytes; its rows are stored by row hash, so versions that share most rows
+share their storage. Any two versions can be diffed row by row (added,
+removed, contact changed, requirements changed), and every user's last run
+is recorded with the version it used, along with the brokers it could not
+send to. A delta campaign then sends only to the brokers that are new or
+changed for that user since their last run, plus those still pending.
+
+Usage:
+    python registry_versions.py list
+    python registry_versions.py record [services.csv]
+    python registry_versions.py diff OLD [NEW]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from email_templates import ATTACHMENT_ATTRIBUTES, PII_ATTRIBUTES
+from registry import csv_to_map
+from registry_snapshot import DEFAULT_REGISTRY_CSV, _file_sha256
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERSIONS_DB = 'registry_versions.db'
+
+CONTACT_FIELD = 'privacy_dept_contact_email'
+
+DIFF_KINDS = ('added', 'removed', 'contact_changed', 'requirements_changed')
+
+# Row fields that say what a broker requires: the PII it asks for and the files it wants attached
+REQUIREMENT_FIELDS = tuple(PII_ATTRIBUTES) + tuple(ATTACHMENT_ATTRIBUTES)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    version TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    n_rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    row_hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS version_rows (
+    version TEXT NOT NULL,
+    service TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (version, service)
+);
+CREATE TABLE IF NOT EXISTS user_runs (
+    email TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    usrchoice TEXT,
+    campaign_id TEXT,
+    ran_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_pending (
+    email TEXT NOT NULL,
+    service TEXT NOT NULL,
+    PRIMARY KEY (email, service)
+);
+"""
+
+
+def row_hash(submap):
+    """Return the content hash of one registry row."""
+    return hashlib.sha256(json.dumps(submap, sort_keys=True).encode()).hexdigest()
+
+
+def diff_rows(old_rows, new_rows):
+    """
+    Diff two registry versions row by row.
+
+    Args:
+        old_rows: Dict of service name to services-map row
+        new_rows: Dict of service name to services-map row
+
+    Returns:
+        dict: Sorted service names per kind in DIFF_KINDS; a row whose contact
+        and required details both changed is listed under both
+    """
+    diff = {kind: [] for kind in DIFF_KINDS}
+    for service, new in new_rows.items():
+        old = old_rows.get(service)
+        if old is None:
+            diff['added'].append(service)
+            continue
+        if old == new:
+            continue
+        if old.get(CONTACT_FIELD, '').strip().lower() != new.get(CONTACT_FIELD, '').strip().lower():
+            diff['contact_changed'].append(service)
+        if any(old.get(field) != new.get(field) for field in REQUIREMENT_FIELDS):
+            diff['requirements_changed'].append(service)
+    diff['removed'] = [service for service in old_rows if service not in new_rows]
+    for services in diff.values():
+        services.sort()
+    return diff
+
+
+def changed_services(diff):
+    """Return the services a delta campaign sends to: new, or changed contact or requirements."""
+    return set(diff['added']) | set(diff['contact_changed']) | set(diff['requirements_changed'])
+
+
+class RegistryVersions:
+    """SQLite-backed store of registry versions and each user's last run."""
+
+    def __init__(self, db_path=DEFAULT_VERSIONS_DB):
+        """
+        Open (or create) the store.
+
+        Args:
+            db_path: SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        # csv path -> ((size, mtime_ns), version), so unchanged files are not re-hashed
+        self._stamps = {}
+
+    def record_version(self, csv_file):
+        """
+        Record the registry in csv_file if its content is new.
+
+        Returns:
+            str: The version (hex SHA-256 of the file)
+        """
+        stat = os.stat(csv_file)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = self._stamps.get(csv_file)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        version = _file_sha256(csv_file).hex()
+        with self._lock:
+            known = self._db.execute("SELECT 1 FROM versions WHERE version = ?", (version,)).fetchone()
+            if not known:
+                rows = csv_to_map(csv_file)[0]
+                hashed = [(service, row_hash(submap), submap) for service, submap in rows.items()]
+                self._db.executemany("INSERT OR IGNORE INTO rows (row_hash, data) VALUES (?, ?)",
+                                     [(h, json.dumps(submap, sort_keys=True)) for _, h, submap in hashed])
+                self._db.executemany("INSERT OR IGNORE INTO version_rows (version, service, row_hash) VALUES (?, ?, ?)",
+                                     [(version, service, h) for service, h, _ in hashed])
+                self._db.execute("INSERT OR IGNORE INTO versions (version, source, recorded_at, n_rows) VALUES (?, ?, ?, ?)",
+                                 (version, os.path.basename(csv_file), time.time(), len(hashed)))
+                self._db.commit()
+                logger.info(f"Recorded registry version {version[:12]} ({len(hashed)} brokers) from {csv_file}")
+        self._stamps[csv_file] = (stamp, version)
+        return version
+
+    def versions(self):
+        """Return the recorded versions, oldest first, as dicts."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version, source, recorded_at, n_rows FROM versions ORDER BY recorded_at").fetchall()
+        return [dict(zip(('version', 'source', 'recorded_at', 'n_rows'), row)) for row in rows]
+
+    def resolve(self, prefix):
+        """
+        Return the full version for a unique version prefix.
+
+        Raises:
+            KeyError: If no version, or more than one, matches
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT version FROM versions WHERE version LIKE ? LIMIT 2",
+                                    (prefix.lower() + '%',)).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"{'Ambiguous' if rows else 'Unknown'} registry version: {prefix}")
+        return rows[0][0]
+
+    def rows(self, version, services=None):
+        """
+        Return a version's rows as a dict of service name to services-map row.
+
+        Args:
+            version: Recorded version
+            services: Optional set of service names to limit the result to
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT v.service, r.data FROM version_rows v JOIN rows r ON r.row_hash = v.row_hash "
+                "WHERE v.version = ?", (version,)).fetchall()
+        return {service: json.loads(data) for service, data in rows if services is None or service in services}
+
+    def diff(self, old_version, new_version):
+        """Diff two recorded versions (see diff_rows)."""
+        with self._lock:
+            old_hashes = dict(self._db.execute(
+                "SELECT service, row_hash FROM version_rows WHERE version = ?", (old_version,)).fetchall())
+            new_hashes = dict(self._db.execute(
+                "SELECT service, row_hash FROM version_rows WHERE version = ?", (new_version,)).fetchall())
+        # Only rows whose hash differs need their contents compared
+        differing = {service for service, h in new_hashes.items() if old_hashes.get(service) != h}
+        differing |= old_hashes.keys() - new_hashes.keys()
+        if not differing:
+            return diff_rows({}, {})
+        return diff_rows(self.rows(old_version, differing), self.rows(new_version, differing))
+
+    def record_run(self, email, version, usrchoice=None, campaign_id=None, attempted=(), failed=(), deferred=()):
+        """
+        Record that a user's campaign ran against a registry version.
+
+        Args:
+            email: The user's email address
+            version: Registry version the campaign used
+            usrchoice: The user's broker choice
+            campaign_id: Campaign ID
+            attempted: Brokers the campaign sent to; they are no longer pending unless in failed or deferred
+            failed: Brokers that did not receive the request, kept pending for the next delta campaign
+            deferred: Brokers whose request waits for sending quota; pending until it is sent
+                (see clear_pending)
+        """
+        email = email.strip().lower()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO user_runs (email, version, usrchoice, campaign_id, ran_at) "
+                "VALUES (?, ?, ?, ?, ?)", (email, version, usrchoice, campaign_id, time.time()))
+            self._db.executemany("DELETE FROM user_pending WHERE email = ? AND service = ?",
+                                 [(email, service) for service in attempted])
+            self._db.executemany("INSERT OR IGNORE INTO user_pending (email, service) VALUES (?, ?)",
+                                 [(email, service) for service in list(failed) + list(deferred)])
+            self._db.commit()
+
+    def clear_pending(self, email, services):
+        """Mark brokers as no longer pending for a user, once their request has been sent."""
+        email = email.strip().lower()
+        with self._lock:
+            self._db.executemany("DELETE FROM user_pending WHERE email = ? AND service = ?",
+                                 [(email, service) for service in services])
+            self._db.commit()
+
+    def pending(self, email):
+        """Return the brokers a user's earlier campaigns could not send to (yet)."""
+        with self._lock:
+            rows = self._db.execute("SELECT service FROM user_pending WHERE email = ?",
+                                    (email.strip().lower(),)).fetchall()
+        return {service for service, in rows}
+
+    def last_run(self, email):
+        """Return a user's last recorded run as a dict, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT email, version, usrchoice, campaign_id, ran_at FROM user_runs WHERE email = ?",
+                (email.strip().lower(),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('email', 'version', 'usrchoice', 'campaign_id', 'ran_at'), row))
+
+    def delta_services(self, email, services_map, version):
+        """
+        Return the part of services_map that changed since the user's last run.
+
+        Args:
+            email: The user's email address
+            services_map: Services map the user chose, from the current registry
+            version: Current registry version
+
+        Returns:
+            dict or None: Services map of the new or changed brokers and those
+            earlier runs could not send to (empty if there are none), or None
+            if the user has no recorded run
+        """
+        last = self.last_run(email)
+        if last is None:
+            return None
+        changed = self.pending(email)
+        if last['version'] != version:
+            changed |= changed_services(self.diff(last['version'], version))
+        return {service: services_map[service] for service in services_map if service in changed}
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
+
+
+_versions = None
+_versions_lock = threading.Lock()
+
+
+def get_registry_versions(db_path=None):
+    """Return the process-wide version store (db path from PRIVACYBOT_VERSIONS_DB or the default)."""
+    global _versions
+    with _versions_lock:
+        if _versions is None:
+            _versions = RegistryVersions(db_path or os.environ.get('PRIVACYBOT_VERSIONS_DB', DEFAULT_VERSIONS_DB))
+        return _versions
+
+
+def main(argv=None):
+    """List, record or diff registry versions."""
+    from logging_setup import setup_logging
+    setup_logging()
+    argv = sys.argv[1:] if argv is None else argv
+    store = get_registry_versions()
+    command = argv[0] if argv else 'list'
+    if command == 'record':
+        print(store.record_version(argv[1] if len(argv) > 1 else DEFAULT_REGISTRY_CSV))
+    elif command == 'diff' and len(argv) >= 2:
+        old = store.resolve(argv[1])
+        new = store.resolve(argv[2]) if len(argv) > 2 else store.record_version(DEFAULT_REGISTRY_CSV)
+        print(json.dumps(store.diff(old, new), indent=2))
+    elif command == 'list':
+        for version in store.versions():
+            print(f"{version['version'][:12]}  {time.ctime(version['recorded_at'])}  "
+                  f"{version['n_rows']:5d} brokers  {version['source']}")
+    else:
+        print(__doc__.strip().split('Usage:')[1])
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Local index of sent broker requests and the replies they receive.
+
+Every request PrivacyBot sends is recorded with its Message-ID. Reply
+ingestion workers store incoming messages here and match them back to the
+request they answer through In-Reply-To/References, so the status of each
+broker request can be tracked without reading the mailbox by hand.
+
+Each contact address also has a health score: 1.0 until it bounces, halved
+by every hard bounce and reduced slightly by soft ones, and reset when the
+broker replies from it. The campaign planner skips or deprioritizes addresses
+whose score has dropped (see broker_groups.py).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_REPLY_DB = 'replies.db'
+
+# Health score multipliers per bounce
+HARD_BOUNCE_FACTOR = 0.5
+SOFT_BOUNCE_FACTOR = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent_requests (
+    message_id TEXT PRIMARY KEY,
+    campaign_id TEXT,
+    service TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'sent',
+    updated_at REAL NOT NULL,
+    thread_id TEXT
+);
+CREATE INDEX IF NOT EXISTS sent_requests_service ON sent_requests (service);
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    message_id TEXT,
+    request_message_id TEXT,
+    service TEXT,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    body TEXT,
+    received_at REAL NOT NULL,
+    category TEXT,
+    confidence REAL,
+    form_urls TEXT,
+    requested_fields TEXT,
+    UNIQUE (source, source_id)
+);
+CREATE INDEX IF NOT EXISTS replies_request ON replies (request_message_id);
+CREATE TABLE IF NOT EXISTS address_health (
+    address TEXT PRIMARY KEY,
+    sends INTEGER NOT NULL DEFAULT 0,
+    hard_bounces INTEGER NOT NULL DEFAULT 0,
+    soft_bounces INTEGER NOT NULL DEFAULT 0,
+    score REAL NOT NULL DEFAULT 1.0,
+    last_status TEXT,
+    last_diagnostic TEXT,
+    last_bounce_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    validity TEXT,
+    position TEXT
+);
+"""
+
+# Columns added after the first release, created on older databases when opened
+_ADDED_COLUMNS = {
+    'sent_requests': [('thread_id', 'TEXT')],
+    'replies': [('category', 'TEXT'), ('confidence', 'REAL'), ('form_urls', 'TEXT'),
+                ('requested_fields', 'TEXT')],
+}
+
+# Indexes on added columns
+_ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS sent_requests_thread ON sent_requests (thread_id);
+"""
+
+_MSGID = re.compile(r'<[^<>\s]+>')
+
+
+def address_key(address):
+    """Normalize a contact address for health tracking."""
+    return (address or '').strip().lower()
+
+
+def parse_message_ids(value):
+    """Return the <...> message IDs in a header value, in order."""
+    if not value:
+        return []
+    return _MSGID.findall(str(value))
+
+
+class ReplyIndex:
+    """SQLite-backed index of sent requests, replies and sync positions."""
+
+    def __init__(self, db_path=DEFAULT_REPLY_DB):
+        """
+        Open (or create) the index.
+
+        Args:
+            db_path: SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns:
+                if column not in existing:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self._db.executescript(_ADDED_INDEXES)
+        self._db.commit()
+
+    def record_sent(self, message_id, service, recipient, campaign_id=None, sent_at=None, thread_id=None):
+        """
+        Record a broker request that was sent with the given Message-ID.
+
+        Args:
+            thread_id: Gmail thread ID, for requests sent through the Gmail API
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sent_requests (message_id, campaign_id, service, recipient, "
+                "sent_at, updated_at, thread_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (message_id, campaign_id, service, recipient, sent_at or now, now, thread_id))
+            self._db.execute(
+                "INSERT INTO address_health (address, sends, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT (address) DO UPDATE SET sends = sends + 1, updated_at = excluded.updated_at",
+                (address_key(recipient), now))
+            self._db.commit()
+
+    def find_request(self, message_ids):
+        """
+        Return the sent request referenced by any of the given Message-IDs.
+
+        The last ID wins, since References lists ancestors oldest first and
+        In-Reply-To names the direct parent.
+
+        Returns:
+            dict or None: The sent_requests row
+        """
+        if not message_ids:
+            return None
+        with self._lock:
+            for message_id in reversed(message_ids):
+                row = self._db.execute(
+                    "SELECT message_id, campaign_id, service, recipient, sent_at, status "
+                    "FROM sent_requests WHERE message_id = ?", (message_id,)).fetchone()
+                if row:
+                    return dict(zip(('message_id', 'campaign_id', 'service', 'recipient',
+                                     'sent_at', 'status'), row))
+        return None
+
+    def find_request_by_thread(self, thread_id):
+        """
+        Return the sent request that started a Gmail thread.
+
+        Returns:
+            dict or None: The sent_requests row
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT message_id, campaign_id, service, recipient, sent_at, status "
+                "FROM sent_requests WHERE thread_id = ? ORDER BY sent_at LIMIT 1", (thread_id,)).fetchone()
+        if row:
+            return dict(zip(('message_id', 'campaign_id', 'service', 'recipient', 'sent_at', 'status'), row))
+        return None
+
+    def add_reply(self, source, source_id, message_id=None, request_message_id=None, service=None,
+                  sender=None, subject=None, date=None, body=None):
+        """
+        Store a reply (ignored if this source/source_id was already stored).
+
+        Args:
+            source: Where the reply came from (e.g. 'imap:INBOX', 'gmail')
+            source_id: ID of the message within that source (UID, Gmail ID)
+
+        Returns:
+            bool: True if the reply was new
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO replies (source, source_id, message_id, request_message_id, service, "
+                "sender, subject, date, body, received_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, str(source_id), message_id, request_message_id, service, sender, subject,
+                 date, body, time.time()))
+            if cursor.rowcount and request_message_id:
+                self._db.execute(
+                    "UPDATE sent_requests SET status = 'replied', updated_at = ? "
+                    "WHERE message_id = ? AND status = 'sent'", (time.time(), request_message_id))
+            self._db.commit()
+            return bool(cursor.rowcount)
+
+    def set_request_status(self, message_id, status):
+        """Update the tracking status of a sent request."""
+        with self._lock:
+            self._db.execute("UPDATE sent_requests SET status = ?, updated_at = ? WHERE message_id = ?",
+                             (status, time.time(), message_id))
+            self._db.commit()
+
+    def replies(self, service=None):
+        """Return stored replies, optionally for one broker, oldest first."""
+        query = ("SELECT id, source, source_id, message_id, request_message_id, service, sender, "
+                 "subject, date, body, category, confidence, form_urls, requested_fields FROM replies")
+        params = []
+        if service is not None:
+            query += " WHERE service = ?"
+            params.append(service)
+        query += " ORDER BY id"
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        keys = ('id', 'source', 'source_id', 'message_id', 'request_message_id', 'service',
+                'sender', 'subject', 'date', 'body', 'category', 'confidence')
+        results = []
+        for row in rows:
+            reply = dict(zip(keys, row))
+            reply['form_urls'] = json.loads(row[12]) if row[12] else []
+            reply['requested_fields'] = json.loads(row[13]) if row[13] else []
+            results.append(reply)
+        return results
+
+    def unclassified_replies(self, limit=1000):
+        """Return up to limit replies without a category, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, request_message_id, subject, body FROM replies WHERE category IS NULL "
+                "ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [dict(zip(('id', 'request_message_id', 'subject', 'body'), row)) for row in rows]
+
+    def set_classifications(self, classifications):
+        """
+        Store classifier results.
+
+        Args:
+            classifications: List of (reply id, result dict with label,
+                confidence, form_urls and requested_fields)
+        """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE replies SET category = ?, confidence = ?, form_urls = ?, requested_fields = ? "
+                "WHERE id = ?",
+                [(result['label'], result['confidence'], json.dumps(result['form_urls']),
+                  json.dumps(result['requested_fields']), reply_id)
+                 for reply_id, result in classifications])
+            self._db.commit()
+
+    def mark_bounce(self, message_id, request=None):
+        """
+        Label a stored message as a bounce so the reply classifier skips it.
+
+        Args:
+            message_id: Message-ID of the delivery status notification
+            request: The sent request it reports on, if known, to link it to
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE replies SET category = 'bounce', confidence = 1.0, "
+                "request_message_id = COALESCE(request_message_id, ?), service = COALESCE(service, ?) "
+                "WHERE message_id = ?",
+                (request['message_id'] if request else None, request['service'] if request else None,
+                 message_id))
+            self._db.commit()
+
+    def record_bounce(self, address, hard, status=None, diagnostic=None):
+        """
+        Lower an address's health score for a bounce.
+
+        Args:
+            address: The contact address that bounced
+            hard: True for a permanent failure (5.x.x), False for a delay or
+                temporary failure
+            status: RFC 3463 status code, e.g. '5.1.1'
+            diagnostic: The remote server's diagnostic text
+
+        Returns:
+            float: The address's new score
+        """
+        now = time.time()
+        factor = HARD_BOUNCE_FACTOR if hard else SOFT_BOUNCE_FACTOR
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO address_health (address, updated_at) VALUES (?, ?) ON CONFLICT (address) DO NOTHING",
+                (address_key(address), now))
+            self._db.execute(
+                "UPDATE address_health SET score = score * ?, hard_bounces = hard_bounces + ?, "
+                "soft_bounces = soft_bounces + ?, last_status = ?, last_diagnostic = ?, last_bounce_at = ?, "
+                "updated_at = ? WHERE address = ?",
+                (factor, int(bool(hard)), int(not hard), status, diagnostic, now, now, address_key(address)))
+            self._db.commit()
+            return self._db.execute("SELECT score FROM address_health WHERE address = ?",
+                                    (address_key(address),)).fetchone()[0]
+
+    def record_delivery(self, address):
+        """Restore an address's health score after a reply from the broker proves it works."""
+        with self._lock:
+            self._db.execute("UPDATE address_health SET score = 1.0, updated_at = ? WHERE address = ?",
+                             (time.time(), address_key(address)))
+            self._db.commit()
+
+    def address_health(self):
+        """Return {address: score} for addresses that have bounced and not recovered."""
+        with self._lock:
+            return dict(self._db.execute("SELECT address, score FROM address_health WHERE score < 1.0"))
+
+    def address_report(self):
+        """Return the health rows of every address that has bounced, worst first."""
+        keys = ('address', 'sends', 'hard_bounces', 'soft_bounces', 'score', 'last_status',
+                'last_diagnostic', 'last_bounce_at')
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(keys)} FROM address_health "
+                "WHERE hard_bounces > 0 OR soft_bounces > 0 ORDER BY score, address").fetchall()
+        return [dict(zip(keys, row)) for row in rows]
+
+    def request_statuses(self, campaign_id=None):
+        """Return {service: status} for sent requests, optionally for one campaign."""
+        query = "SELECT service, status FROM sent_requests"
+        params = []
+        if campaign_id is not None:
+            query += " WHERE campaign_id = ?"
+            params.append(campaign_id)
+        query += " ORDER BY sent_at"
+        with self._lock:
+            return dict(self._db.execute(query, params).fetchall())
+
+    def get_sync_state(self, source):
+        """Return (validity, position) saved for a source, or (None, None)."""
+        with self._lock:
+            row = self._db.execute("SELECT validity, position FROM sync_state WHERE source = ?",
+                                   (source,)).fetchone()
+        return row if row else (None, None)
+
+    def set_sync_state(self, source, validity, position):
+        """Save the sync position for a source."""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sync_state (source, validity, position) VALUES (?, ?, ?)",
+                             (source, None if validity is None else str(validity),
+                              None if position is None else str(position)))
+            self._db.commit()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_reply_index(db_path=None):
+    """Return the process-wide reply index (db path from PRIVACYBOT_REPLY_DB or the default)."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReplyIndex(db_path or os.environ.get('PRIVACYBOT_REPLY_DB', DEFAULT_REPLY_DB))
+        return _index
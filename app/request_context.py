@@ -0,0 +1,57 @@
+"""
+Per-request diagnostics context shared by profiling.py and tracing.py.
+
+A request's diagnostic collectors (a RequestProfile, a CampaignTrace) are
+active on the thread handling it, each under its own slot ('profile',
+'trace'). annotate_campaign names all of them after the request's campaign
+in one call, and output_name gives each request's files a name no other
+request in any process uses.
+"""
+
+import itertools
+import os
+import threading
+import time
+
+_local = threading.local()
+
+# Requests without a campaign ID are numbered, so two in the same second get different files
+_sequence = itertools.count(1)
+
+
+def current(slot):
+    """Return the collector active in a slot on this thread, or None."""
+    return getattr(_local, slot, None)
+
+
+def activate(slot, collector):
+    """
+    Make collector the active one in a slot on this thread.
+
+    Returns:
+        The collector it replaces (or None), to restore when the block ends
+    """
+    previous = getattr(_local, slot, None)
+    setattr(_local, slot, collector)
+    return previous
+
+
+def annotate_campaign(campaign_id):
+    """Name every collector active on this thread after the request's campaign (no-op if none)."""
+    for collector in vars(_local).values():
+        if collector is not None:
+            collector.campaign_id = campaign_id
+
+
+def output_name(campaign_id, started=None):
+    """
+    Return the base file name for a request's diagnostics.
+
+    Args:
+        campaign_id: The request's campaign ID, if it got one
+        started: time.time() when the request started (default: now)
+    """
+    if campaign_id:
+        return campaign_id
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+    return f"request-{stamp}-{os.getpid()}-{next(_sequence)}"
@@ -0,0 +1,419 @@
+"""
+Pool of sender accounts for spreading a campaign across several mailboxes.
+
+Each account (an SMTP login or a Gmail OAuth token) has its own daily quota and
+concurrency limit. The pool hands out the least-used account that still has
+quota and a free slot, and keeps per-account usage counters so throughput
+grows with the number of configured accounts. Quotas are counted per calendar
+day in memory, or over a rolling 24 hours when the pool is given a persistent
+QuotaLedger. A ledger is shared by every process using the same schedule
+database: each send reserves its place in it first, so several worker
+processes together stay within each account's quota and concurrency. When
+the account config changes, the pool is reconfigured in place: unchanged
+accounts keep their open sessions and only changed accounts reconnect, on
+their next message.
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+from transports import create_transport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DAILY_QUOTA = 400
+DEFAULT_MAX_CONCURRENCY = 1
+
+# With a shared ledger, slots freed by other processes are noticed within this long
+SHARED_POLL_SECONDS = 0.05
+
+
+class SenderAccount:
+    """One sending identity with its quota, concurrency limit and usage counters."""
+
+    def __init__(self, name, settings, daily_quota=DEFAULT_DAILY_QUOTA,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, transport_factory=create_transport,
+                 ledger=None):
+        """
+        Initialize the account.
+
+        Args:
+            name: Account name used in logs and usage reports
+            settings: Account config dict passed to the transport factory
+            daily_quota: Messages this account may send per day
+            max_concurrency: Messages this account may have in flight at once
+            transport_factory: Callable creating a transport from settings
+            ledger: Optional QuotaLedger for rolling 24h quota accounting
+        """
+        self.name = name
+        self.settings = settings
+        self.daily_quota = daily_quota
+        self.max_concurrency = max_concurrency
+        self.transport_factory = transport_factory
+        self.ledger = ledger
+        self.sent = 0
+        self.failed = 0
+        self.in_flight = 0
+        # Bumped when the account's transport settings change, retiring older transports
+        self.generation = 0
+        self._day = datetime.date.today()
+        self._idle_transports = []
+
+    def _roll_day(self):
+        today = datetime.date.today()
+        if today != self._day:
+            self._day = today
+            self.sent = 0
+            self.failed = 0
+
+    def remaining_quota(self):
+        """Return how many more messages may be started today."""
+        self._roll_day()
+        return max(0, self.daily_quota - self._counted())
+
+    def used(self):
+        """Return messages counted against the quota (rolling 24h with a ledger)."""
+        if self.ledger is not None:
+            return self.ledger.used(self.name)
+        return self.sent
+
+    def _counted(self):
+        """Return sent and in-flight messages; the ledger counts both, for every process."""
+        if self.ledger is not None:
+            return self.ledger.used(self.name)
+        return self.sent + self.in_flight
+
+    def all_in_flight(self):
+        """Return messages in flight on this account, in every process sharing the ledger."""
+        if self.ledger is not None:
+            return max(self.in_flight, self.ledger.in_flight(self.name))
+        return self.in_flight
+
+    def next_quota_time(self):
+        """Return the epoch time at which this account next gets quota back."""
+        if self.ledger is not None:
+            return self.ledger.next_release(self.name)
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+    def has_capacity(self):
+        """Return True if a message can be started on this account now."""
+        return self.all_in_flight() < self.max_concurrency and self.remaining_quota() > 0
+
+    def utilization(self):
+        """Return the fraction of today's quota used or reserved."""
+        if self.daily_quota <= 0:
+            return 1.0
+        return self._counted() / self.daily_quota
+
+    def usage(self):
+        """Return a usage summary for this account."""
+        self._roll_day()
+        return {
+            'name': self.name,
+            'provider': self.settings.get('provider', 'smtp'),
+            'daily_quota': self.daily_quota,
+            'max_concurrency': self.max_concurrency,
+            'sent': self.sent,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'remaining': self.remaining_quota(),
+        }
+
+
+class SenderLease:
+    """A reserved slot on one account, with a transport checked out for it."""
+
+    def __init__(self, pool, account, transport, reservation=None):
+        self.pool = pool
+        self.account = account
+        self.transport = transport
+        # The account's QuotaLedger reservation, if it has a ledger
+        self.reservation = reservation
+        self.generation = account.generation
+        self.released = False
+
+    def release(self, sent):
+        """
+        Return the slot to the pool.
+
+        Args:
+            sent: True if the message was delivered, False if it failed
+        """
+        if not self.released:
+            self.released = True
+            self.pool._release(self, sent)
+
+
+class SenderPool:
+    """Hands out sender accounts with per-account quota and concurrency accounting."""
+
+    def __init__(self, accounts):
+        """
+        Initialize the pool.
+
+        Args:
+            accounts: List of SenderAccount
+        """
+        if not accounts:
+            raise ValueError("A sender pool needs at least one account")
+        self.accounts = accounts
+        self.account_configs = None
+        self.transport_factory = accounts[0].transport_factory
+        self.ledger = accounts[0].ledger
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, account_configs, transport_factory=create_transport, ledger=None):
+        """
+        Build a pool from the sender_accounts entries of EmailConfig.
+
+        Args:
+            account_configs: List of account dicts (name, provider, daily_quota,
+                max_concurrency and provider settings)
+            transport_factory: Callable creating a transport from an account dict
+            ledger: Optional QuotaLedger shared by all accounts
+
+        Returns:
+            SenderPool
+        """
+        accounts = [SenderAccount(_account_name(i, config), config, transport_factory=transport_factory,
+                                  ledger=ledger, **_account_limits(config))
+                    for i, config in enumerate(account_configs)]
+        pool = cls(accounts)
+        pool.account_configs = account_configs
+        return pool
+
+    def reconfigure(self, account_configs):
+        """
+        Apply a changed sender_accounts config without rebuilding the pool.
+
+        Accounts are matched by name. Quota and concurrency changes apply at
+        once and keep the account's connections; accounts whose transport
+        settings (credentials, server, token) changed drop their idle
+        transports and reconnect lazily, and transports still in flight are
+        closed when their message finishes. Removed accounts stop receiving
+        messages.
+
+        Args:
+            account_configs: New list of account dicts
+        """
+        if not account_configs:
+            raise ValueError("A sender pool needs at least one account")
+        stale = []
+        with self._cond:
+            current = {account.name: account for account in self.accounts}
+            accounts = []
+            for i, config in enumerate(account_configs):
+                name = _account_name(i, config)
+                account = current.pop(name, None)
+                if account is None:
+                    account = SenderAccount(name, config, transport_factory=self.transport_factory,
+                                            ledger=self.ledger, **_account_limits(config))
+                else:
+                    limits = _account_limits(config)
+                    account.daily_quota = limits['daily_quota']
+                    account.max_concurrency = limits['max_concurrency']
+                    if _transport_settings(account.settings) != _transport_settings(config):
+                        account.generation += 1
+                        stale.extend(account._idle_transports)
+                        account._idle_transports = []
+                    account.settings = config
+                accounts.append(account)
+            for account in current.values():
+                account.generation += 1
+                stale.extend(account._idle_transports)
+                account._idle_transports = []
+            self.accounts = accounts
+            self.account_configs = account_configs
+            self._cond.notify_all()
+        for transport in stale:
+            try:
+                transport.close()
+            except Exception as e:
+                logger.warning(f"Error closing retired transport: {e}")
+        logger.info(f"Sender pool reconfigured with {len(accounts)} accounts, {len(stale)} idle sessions closed")
+
+    def max_concurrency(self):
+        """Return the total number of messages the pool can have in flight."""
+        return sum(account.max_concurrency for account in self.accounts)
+
+    def remaining_quota(self):
+        """Return the total number of messages the pool may still send today."""
+        with self._cond:
+            return sum(account.remaining_quota() for account in self.accounts)
+
+    def next_quota_time(self):
+        """Return the epoch time at which the first account gets quota back."""
+        with self._cond:
+            return min(account.next_quota_time() for account in self.accounts)
+
+    def acquire(self, timeout=None):
+        """
+        Reserve a slot on the least-used account with quota left.
+
+        Blocks while every account with quota is at its concurrency limit.
+        With a ledger, the slot is reserved in it first, so the quota and
+        concurrency hold across every process sharing the ledger.
+
+        Args:
+            timeout: Seconds to wait for a free slot (default: wait forever)
+
+        Returns:
+            SenderLease, or None if every account's daily quota is used up
+            (or the timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                account, reservation = self._reserve()
+                if account is not None:
+                    account.in_flight += 1
+                    if account._idle_transports:
+                        transport = account._idle_transports.pop()
+                    else:
+                        transport = None
+                    break
+                if not any(a.remaining_quota() > 0 for a in self.accounts):
+                    return None
+                # Other processes' releases are not notified, so a shared ledger is polled
+                wait = SHARED_POLL_SECONDS if self.ledger is not None else None
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return None
+                    wait = left if wait is None else min(wait, left)
+                self._cond.wait(wait)
+
+        if transport is None:
+            try:
+                transport = account.transport_factory(account.settings)
+            except Exception:
+                with self._cond:
+                    account.in_flight -= 1
+                    if reservation is not None:
+                        account.ledger.release(reservation, False)
+                    self._cond.notify()
+                raise
+        return SenderLease(self, account, transport, reservation)
+
+    def _reserve(self):
+        """
+        Pick the least-used account with a free slot (caller holds the lock).
+
+        Returns:
+            tuple: (account, ledger reservation or None), or (None, None) if
+            no account can take a message now
+        """
+        candidates = sorted((a for a in self.accounts if a.has_capacity()), key=lambda a: a.utilization())
+        for account in candidates:
+            if account.ledger is None:
+                return account, None
+            reservation = account.ledger.reserve(account.name, account.daily_quota, account.max_concurrency)
+            if reservation is not None:
+                return account, reservation
+        return None, None
+
+    def _release(self, lease, sent):
+        account = lease.account
+        # A transport from before a settings change is not reused
+        reuse = sent and lease.generation == account.generation
+        with self._cond:
+            account.in_flight -= 1
+            if sent:
+                account.sent += 1
+            else:
+                account.failed += 1
+            if lease.reservation is not None:
+                account.ledger.release(lease.reservation, sent)
+            if reuse:
+                account._idle_transports.append(lease.transport)
+            self._cond.notify()
+        if not reuse:
+            # The session may be in a bad state or use old settings; start the next message on a fresh one.
+            try:
+                lease.transport.close()
+            except Exception as e:
+                logger.warning(f"Error closing transport for {account.name}: {e}")
+
+    def warm_up(self):
+        """
+        Open one idle transport per account that has quota left and none idle.
+
+        Lets a freshly started server take its first campaign without paying
+        for SMTP handshakes or Gmail service discovery. Accounts that fail to
+        connect are logged and left to connect on first use.
+
+        Returns:
+            int: Transports opened
+        """
+        with self._cond:
+            cold = [(account, account.generation) for account in self.accounts
+                    if not account._idle_transports and account.remaining_quota() > 0]
+        opened = 0
+        for account, generation in cold:
+            try:
+                transport = account.transport_factory(account.settings)
+                transport.open()
+            except Exception as e:
+                logger.warning(f"Could not warm up sender {account.name}: {e}")
+                continue
+            with self._cond:
+                if generation == account.generation:
+                    account._idle_transports.append(transport)
+                    opened += 1
+                    continue
+            transport.close()
+        return opened
+
+    def usage(self):
+        """Return per-account usage summaries."""
+        with self._cond:
+            return [account.usage() for account in self.accounts]
+
+    def close(self):
+        """Close all idle transports."""
+        with self._cond:
+            for account in self.accounts:
+                for transport in account._idle_transports:
+                    try:
+                        transport.close()
+                    except Exception as e:
+                        logger.warning(f"Error closing transport for {account.name}: {e}")
+                account._idle_transports = []
+
+
+def _account_name(index, config):
+    return config.get('name', f"account-{index + 1}")
+
+
+def _account_limits(config):
+    return {'daily_quota': int(config.get('daily_quota', DEFAULT_DAILY_QUOTA)),
+            'max_concurrency': max(1, int(config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)))}
+
+
+def _transport_settings(config):
+    """Return the part of an account config its transport is built from."""
+    return {key: value for key, value in config.items() if key not in ('name', 'daily_quota', 'max_concurrency')}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sender_pool(account_configs, ledger=None):
+    """
+    Return the process-wide pool, reconfigured in place if the accounts changed.
+
+    Usage counters and open sessions live on the pool, so they carry over
+    across campaigns and config reloads for the lifetime of the process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SenderPool.from_config(account_configs, ledger=ledger)
+        elif _pool.account_configs != account_configs:
+            _pool.reconfigure(account_configs)
+        return _pool
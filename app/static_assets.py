@@ -0,0 +1,329 @@
+"""
+Serving the prebuilt React UI (PB_UI/build) from the backend.
+
+StaticAssets is WSGI middleware in front of the Flask app. It indexes the
+build directory once, then answers GET/HEAD requests for its files without
+touching Flask; everything else (the API) passes through, so the UI and the
+API share one origin and need no CORS.
+
+- Compressible files are precompressed next to the original (.br when the
+  optional brotli package is installed, .gz always) by precompress(), run by
+  the UI's postbuild script and again at server warm-up for anything missing.
+  The best variant the client accepts is sent as is, with Vary: Accept-Encoding.
+- Files whose names carry a content hash (static/js/main.134abbdc.chunk.js)
+  are cached by browsers for a year as immutable; everything else, including
+  index.html, is revalidated on every use.
+- Every response has a strong ETag and Last-Modified, and If-None-Match /
+  If-Modified-Since are answered with 304 Not Modified.
+- Client-side routes (/inputform, /about) get index.html; the API and admin
+  routes never do.
+
+Usage:
+    python static_assets.py [build_dir]    # precompress a build
+"""
+
+import email.utils
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'PB_UI', 'build')
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.js', '.css', '.json', '.map', '.svg', '.txt', '.ico', '.xml'}
+
+# Below this size the compressed file saves less than a packet
+MIN_COMPRESS_SIZE = 1024
+
+# A variant is only kept if it is at most this fraction of the original
+MAX_COMPRESSED_RATIO = 0.9
+
+# Files up to this size are kept in memory, larger ones are streamed from disk
+MEMORY_LIMIT = 256 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Client preference among equally acceptable encodings, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Paths served by Flask routes, never by the single-page app fallback
+SERVER_ROUTE_PREFIXES = ('/privacyAPI/', '/admin/')
+
+# Content-hashed names produced by the React build, e.g. main.134abbdc.chunk.js
+_HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _brotli():
+    """Return the brotli module, or None if the optional package is not installed."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _compressors():
+    compressors = {'.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        compressors['.br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def _is_fresh(variant, source_mtime_ns):
+    try:
+        return os.stat(variant).st_mtime_ns >= source_mtime_ns
+    except OSError:
+        return False
+
+
+def precompress(build_dir=DEFAULT_BUILD_DIR):
+    """
+    Write compressed variants of the compressible files in a build.
+
+    Variants that are newer than their file are left alone, and a variant
+    that would not be meaningfully smaller is not written.
+
+    Args:
+        build_dir: React build directory
+
+    Returns:
+        int: Variants written
+    """
+    compressors = _compressors()
+    written = 0
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            stat = os.stat(path)
+            if stat.st_size < MIN_COMPRESS_SIZE:
+                continue
+            data = None
+            for suffix, compress in compressors.items():
+                if _is_fresh(path + suffix, stat.st_mtime_ns):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = compress(data)
+                if len(compressed) > len(data) * MAX_COMPRESSED_RATIO:
+                    continue
+                with open(path + suffix + '.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.replace(path + suffix + '.tmp', path + suffix)
+                written += 1
+    if written:
+        logger.info(f"Precompressed {written} UI assets in {build_dir}")
+    return written
+
+
+class _Variant:
+    """One encoding of a file as it is sent."""
+
+    def __init__(self, path, encoding, etag, body):
+        self.path = path
+        self.encoding = encoding
+        self.etag = etag
+        self.size = os.path.getsize(path)
+        self.body = body
+
+
+class _Asset:
+    """A build file with its headers and encoded variants."""
+
+    def __init__(self, path, url_path):
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=12).hexdigest()
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.last_modified = int(stat.st_mtime)
+        self.last_modified_header = email.utils.formatdate(self.last_modified, usegmt=True)
+        immutable = url_path.startswith('/static/') and _HASHED_NAME.search(os.path.basename(path))
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            if _is_fresh(path + suffix, stat.st_mtime_ns):
+                body = None
+                if os.path.getsize(path + suffix) <= MEMORY_LIMIT:
+                    with open(path + suffix, 'rb') as f:
+                        body = f.read()
+                self.variants[encoding] = _Variant(path + suffix, encoding, f'"{digest}-{encoding}"', body)
+        self.identity = _Variant(path, None, f'"{digest}"', data if len(data) <= MEMORY_LIMIT else None)
+
+    def select(self, accept_encoding):
+        """Return the variant to send for an Accept-Encoding header."""
+        if self.variants and accept_encoding:
+            accepted = _parse_accept_encoding(accept_encoding)
+            best = max((variant for encoding, variant in self.variants.items()
+                        if accepted.get(encoding, accepted.get('*', 0)) > 0),
+                       key=lambda v: accepted.get(v.encoding, accepted.get('*', 0)), default=None)
+            if best is not None:
+                return best
+        return self.identity
+
+
+def _parse_accept_encoding(header):
+    """Return {coding: q} for an Accept-Encoding header."""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as RFC 7232 requires for If-None-Match
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class StaticAssets:
+    """WSGI middleware serving a React build in front of another WSGI app."""
+
+    def __init__(self, app, build_dir=DEFAULT_BUILD_DIR):
+        """
+        Args:
+            app: WSGI app for everything that is not a build file (the API)
+            build_dir: React build directory
+        """
+        self.app = app
+        self.build_dir = os.path.abspath(build_dir)
+        self.assets = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-index the build directory (e.g. after precompress())."""
+        assets = {}
+        if not os.path.isdir(self.build_dir):
+            logger.warning(f"UI build {self.build_dir} not found, run 'npm run build' in PB_UI to serve the UI")
+        else:
+            suffixes = tuple(suffix for _, suffix in ENCODINGS) + ('.tmp',)
+            for root, _, files in os.walk(self.build_dir):
+                for name in files:
+                    if name.endswith(suffixes):
+                        continue
+                    path = os.path.join(root, name)
+                    url_path = '/' + os.path.relpath(path, self.build_dir).replace(os.sep, '/')
+                    assets[url_path] = _Asset(path, url_path)
+        self.assets = assets
+        self.index = assets.get('/index.html')
+        return len(assets)
+
+    def precompress(self):
+        """Compress whatever the build step left uncompressed and re-index."""
+        if os.path.isdir(self.build_dir):
+            precompress(self.build_dir)
+        return self.refresh()
+
+    def _lookup(self, environ):
+        path = environ.get('PATH_INFO') or '/'
+        if path == '/':
+            return self.index
+        asset = self.assets.get(path)
+        if asset is not None:
+            return asset
+        # Client-side routes of the single-page app. Server routes are never one, even
+        # when a browser asks for them with an Accept header that includes HTML.
+        if path.startswith(SERVER_ROUTE_PREFIXES):
+            return None
+        if '.' not in path.rsplit('/', 1)[-1] and 'text/html' in environ.get('HTTP_ACCEPT', ''):
+            return self.index
+        return None
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        asset = self._lookup(environ) if method in ('GET', 'HEAD') else None
+        if asset is None:
+            return self.app(environ, start_response)
+
+        variant = asset.select(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        headers = [('Cache-Control', asset.cache_control),
+                   ('ETag', variant.etag),
+                   ('Last-Modified', asset.last_modified_header)]
+        if asset.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, variant.etag)
+        else:
+            since = environ.get('HTTP_IF_MODIFIED_SINCE')
+            try:
+                since = email.utils.parsedate_to_datetime(since).timestamp() if since else None
+            except (TypeError, ValueError):
+                since = None
+            not_modified = since is not None and asset.last_modified <= since
+        if not_modified:
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers += [('Content-Type', asset.content_type), ('Content-Length', str(variant.size))]
+        if variant.encoding:
+            headers.append(('Content-Encoding', variant.encoding))
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return []
+        if variant.body is not None:
+            return [variant.body]
+        f = open(variant.path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, _CHUNK_SIZE)
+        return _FileIterator(f)
+
+
+class _FileIterator:
+    """Streams a file in chunks and closes it when the response is done."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def __iter__(self):
+        return iter(lambda: self._f.read(_CHUNK_SIZE), b'')
+
+    def close(self):
+        self._f.close()
+
+
+def main():
+    """Precompress the build directories given on the command line."""
+    for build_dir in sys.argv[1:] or [DEFAULT_BUILD_DIR]:
+        written = precompress(build_dir)
+        print(f"{build_dir}: {written} compressed variants written"
+              + ("" if _brotli() is not None else " (gzip only, install brotli for .br)"))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Unit tests for the Flask routes in app.py.
+Skipped unless Flask, Flask-Cors and the Google API client are installed.
+"""
+
+import unittest
+import json
+import os
+import sys
+from unittest.mock import Mock, patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import admin
+from attachments import AttachmentError
+from email_templates import PII_ATTRIBUTES
+from preview import CampaignPreview, MAX_PAGE_SIZE
+
+try:
+    import app as server
+except ImportError:
+    server = None
+
+USER = {'firstname': 'Jane', 'lastname': 'Doe', 'email': 'jane@example.com', 'usrchoice': 'all_services'}
+
+
+def broker(contact, **required):
+    submap = {'category': 'data broker', 'top_choice': 'NO', 'privacy_dept_contact_email': contact,
+              'gov_photo_id': False}
+    for attribute in PII_ATTRIBUTES:
+        submap[attribute] = required.get(attribute, False)
+    return submap
+
+
+SERVICES = {
+    'acme': broker('privacy@acme.com', firstname=True),
+    'bravo': broker('privacy@bravo.com', firstname=True, lastname=True),
+    'charlie': broker('privacy@charlie.com', firstname=True),
+}
+
+
+@unittest.skipIf(server is None, "Flask, Flask-Cors and the Google API client are not installed")
+class TestRoutes(unittest.TestCase):
+    """Test cases for the API and admin routes."""
+
+    def setUp(self):
+        self.client = server.app.test_client()
+        for name, value in (('services_for_choice', lambda usrchoice: SERVICES),
+                            ('previewCampaign', lambda usrjson, services: CampaignPreview(usrjson, services)),
+                            ('get_registry_versions', Mock)):
+            patcher = patch.object(server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_preview(self):
+        response = self.client.post('/privacyAPI/v1/preview?page=2&per_page=2', json=USER)
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual((result['total'], result['pages'], len(result['requests'])), (3, 2, 1))
+
+    def test_preview_bad_parameters(self):
+        """Test that invalid page, per_page and field parameters are a 400, not a server error."""
+        for query in ('page=0', 'page=x', f"per_page={MAX_PAGE_SIZE + 1}", 'per_page=0', 'field=ssn'):
+            response = self.client.post(f"/privacyAPI/v1/preview?{query}", json=USER)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('error', json.loads(response.data))
+
+    def test_rejected_upload(self):
+        """Test that an unusable photo ID upload is a 400 with the reason."""
+        with patch.object(server, 'privacyAPI', Mock(side_effect=AttachmentError("Upload is not valid base64"))):
+            response = self.client.post('/privacyAPI/v1/', json=dict(USER, gov_photo_id='not base64!'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data), {'error': "Upload is not valid base64"})
+
+    def test_admin_memory(self):
+        """Test that /admin/memory is missing with the watchdog off and needs the admin token."""
+        with patch.object(server, 'get_memory_watchdog', lambda: None):
+            self.assertEqual(self.client.get('/admin/memory').status_code, 404)
+
+        watchdog = Mock()
+        watchdog.stats.return_value = {'rss_bytes': 1024}
+        with patch.object(server, 'get_memory_watchdog', lambda: watchdog), \
+                patch.object(admin, '_ADMIN_TOKEN', 's3cret'):
+            self.assertEqual(self.client.get('/admin/memory').status_code, 403)
+            self.assertEqual(self.client.get('/admin/memory', headers={admin.ADMIN_HEADER: 'wrong'}).status_code,
+                             403)
+            response = self.client.get('/admin/memory?check=1', headers={admin.ADMIN_HEADER: 's3cret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'rss_bytes': 1024})
+        watchdog.check.assert_called_once()
+
+        # Without a configured token nothing is authorized
+        with patch.object(server, 'get_memory_watchdog', lambda: watchdog):
+            self.assertEqual(self.client.get('/admin/memory', headers={admin.ADMIN_HEADER: ''}).status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Unit tests for attachments module.
+"""
+
+import unittest
+import base64
+import io
+import os
+import struct
+import sys
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import attachments
+from attachments import (Attachment, AttachmentError, attachments_for, decode_upload, normalize_image,
+                         prepare_attachments, strip_jpeg_metadata)
+from broker_groups import group_by_contact
+from email_templates import PII_ATTRIBUTES, render_userdata
+
+def segment(marker, payload):
+    return bytes((0xFF, marker)) + struct.pack('>H', len(payload) + 2) + payload
+
+
+JPEG = (b'\xff\xd8' + segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+        + segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') + bytes(range(256)) * 8 + b'\xff\xd9')
+
+
+def data_url(data, content_type='image/jpeg'):
+    return f"data:{content_type};base64," + base64.b64encode(data).decode()
+
+
+def broker(contact, **required):
+    submap = {'category': 'data broker', 'top_choice': 'NO', 'privacy_dept_contact_email': contact,
+              'gov_photo_id': required.pop('gov_photo_id', False)}
+    for attribute in PII_ATTRIBUTES:
+        submap[attribute] = required.get(attribute, False)
+    return submap
+
+
+class TestAttachments(unittest.TestCase):
+    """Test cases for preparing uploaded attachments once per campaign."""
+
+    def test_decode_upload(self):
+        self.assertEqual(decode_upload(data_url(JPEG)), JPEG)
+        self.assertEqual(decode_upload(base64.encodebytes(JPEG).decode()), JPEG)
+        with self.assertRaises(AttachmentError):
+            decode_upload('data:image/jpeg;base64,not base64!')
+        with patch.object(attachments, 'MAX_UPLOAD_BYTES', 100):
+            with self.assertRaises(AttachmentError):
+                decode_upload(data_url(JPEG))
+
+    @patch.object(attachments, '_pillow', lambda: None)
+    def test_images_sent_as_uploaded_without_pillow(self):
+        self.assertEqual(normalize_image(JPEG), (JPEG, 'image/jpeg'))
+        self.assertEqual(normalize_image(b'\x89PNG\r\n\x1a\n' + bytes(10))[1], 'image/png')
+        with self.assertRaises(AttachmentError):
+            normalize_image(b'%PDF-1.4')
+        with patch.object(attachments, 'MAX_UNPROCESSED_BYTES', 100):
+            with self.assertRaises(AttachmentError):
+                normalize_image(JPEG)
+
+    @patch.object(attachments, '_pillow', lambda: None)
+    def test_exif_stripped_without_pillow(self):
+        """Test that a JPEG's EXIF (e.g. GPS position), XMP and comments are not attached."""
+        exif = segment(0xE1, b'Exif\x00\x00GPS 37.4275N 122.1697W')
+        comment = segment(0xFE, b'Jane Doe')
+        photo = JPEG[:2] + exif + JPEG[2:20] + b'\xff' + comment + JPEG[20:]
+        data, content_type = normalize_image(photo)
+        self.assertEqual((data, content_type), (JPEG, 'image/jpeg'))
+        self.assertNotIn(b'GPS', data)
+        with self.assertRaises(AttachmentError):
+            strip_jpeg_metadata(JPEG[:2] + exif[:10])
+
+    @unittest.skipIf(attachments._pillow() is None, "Pillow is not installed")
+    def test_images_downscaled_with_pillow(self):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGBA', (4000, 1000), (255, 0, 0, 128)).save(buffer, 'PNG')
+        data, content_type = normalize_image(buffer.getvalue())
+        self.assertEqual(content_type, 'image/jpeg')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (1600, 400))
+            self.assertNotIn('exif', image.info)
+
+    @patch.object(attachments, '_pillow', lambda: None)
+    def test_encoded_once_and_shared(self):
+        """Test that one campaign attachment goes to exactly the brokers that require it."""
+        usrjson = {'firstname': 'Jane', 'gov_photo_id': data_url(JPEG)}
+        prepared = prepare_attachments(usrjson)
+        photo = prepared['gov_photo_id']
+        self.assertEqual((photo.filename, photo.content_type, photo.data), ('photo_id.jpg', 'image/jpeg', JPEG))
+        self.assertEqual(prepare_attachments({'firstname': 'Jane', 'gov_photo_id': ''}), {})
+
+        part = photo.part('\r\n')
+        self.assertIs(photo.part('\r\n'), part)
+        self.assertTrue(part.startswith(b'Content-Type: image/jpeg\r\n'))
+        self.assertIn(base64.encodebytes(JPEG).replace(b'\n', b'\r\n'), part)
+
+        services = {'idcheck': broker('privacy@idcheck.com', firstname=True, gov_photo_id=True),
+                    'plain': broker('privacy@plain.com', firstname=True),
+                    'famA': broker('privacy@family.com', firstname=True),
+                    'famB': broker('privacy@family.com', gov_photo_id=True)}
+        groups = group_by_contact(services)
+        needs = {group.label: attachments_for(group.merged_submap(), prepared) for group in groups}
+        self.assertEqual(needs, {'idcheck': [photo], 'plain': [], 'famA / famB': [photo]})
+        self.assertIs(needs['idcheck'][0], needs['famA / famB'][0])
+
+        self.assertEqual(render_userdata(usrjson, services['idcheck']),
+                         "<li>First Name: Jane</li><li>Government photo ID: attached</li>")
+        self.assertEqual(render_userdata({'firstname': 'Jane'}, services['idcheck']), "<li>First Name: Jane</li>")
+        self.assertEqual(len(Attachment(b'abc', 'image/gif', 'x.gif')), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -122,6 +122,25 @@ class TestAutoUpdater(unittest.TestCase):
         mock_git_pull.assert_called_once()
         mock_restart.assert_not_called()
 
+    @patch('os.execv')
+    def test_restart_handler(self, mock_execv):
+        """Test that a successful zero-downtime restart skips re-executing the process."""
+        AutoUpdater(restart_handler=lambda: True).restart_program()
+        mock_execv.assert_not_called()
+
+    @patch('os.execv')
+    def test_restart_handler_failed(self, mock_execv):
+        """Test that a failed zero-downtime restart is logged and the process keeps serving."""
+        with self.assertLogs('auto_updater', level='ERROR') as logs:
+            AutoUpdater(restart_handler=lambda: False).restart_program()
+            AutoUpdater(restart_handler=Mock(side_effect=OSError("no fork"))).restart_program()
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn("no fork", logs.output[1])
+        mock_execv.assert_not_called()
+
+        AutoUpdater().restart_program()
+        mock_execv.assert_called_once()
+
 
 class TestSetupAutoUpdater(unittest.TestCase):
     """Test cases for setup_auto_updater function."""
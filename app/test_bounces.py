@@ -0,0 +1,123 @@
+"""
+Unit tests for bounces module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bounces import BounceProcessor, parse_dsn
+from imap_ingest import parse_reply
+from reply_classifier import classify_pending
+from reply_index import ReplyIndex
+
+
+def make_dsn(original_id, recipient='privacy@broker.com', action='failed', status='5.1.1',
+             returned='text/rfc822-headers'):
+    original = (f"From: user@example.com\r\nTo: {recipient}\r\n"
+                f"Subject: CCPA Data Deletion Request - broker\r\nMessage-ID: {original_id}\r\n")
+    if returned == 'message/rfc822':
+        original += "\r\nBody of the request.\r\n"
+    return (
+        "From: Mail Delivery System <MAILER-DAEMON@mx.example.com>\r\n"
+        "To: user@example.com\r\n"
+        "Subject: Undelivered Mail Returned to Sender\r\n"
+        "Message-ID: <dsn-" + original_id.strip('<>') + ">\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: multipart/report; report-type=delivery-status; boundary=\"BOUND\"\r\n"
+        "\r\n"
+        "--BOUND\r\n"
+        "Content-Type: text/plain\r\n"
+        "\r\n"
+        "Your message could not be delivered.\r\n"
+        "--BOUND\r\n"
+        "Content-Type: message/delivery-status\r\n"
+        "\r\n"
+        "Reporting-MTA: dns; mx.example.com\r\n"
+        "Arrival-Date: Mon, 19 Oct 2026 10:00:00 +0000\r\n"
+        "\r\n"
+        f"Final-Recipient: rfc822; {recipient}\r\n"
+        f"Original-Recipient: rfc822;{recipient}\r\n"
+        f"Action: {action}\r\n"
+        f"Status: {status}\r\n"
+        "Diagnostic-Code: smtp; 550 5.1.1 <" + recipient + ">:\r\n"
+        "    Recipient address rejected: User unknown\r\n"
+        "\r\n"
+        "--BOUND\r\n"
+        f"Content-Type: {returned}\r\n"
+        "\r\n"
+        + original +
+        "--BOUND--\r\n").encode()
+
+
+class TestBounces(unittest.TestCase):
+    """Test cases for DSN parsing and address health."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = ReplyIndex(os.path.join(self.tmpdir, 'replies.db'))
+        self.processor = BounceProcessor(self.index)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def deliver(self, raw, source_id):
+        """Store a message the way the ingestion workers do, then run the processor."""
+        reply = parse_reply(raw)
+        request = self.index.find_request(reply['references'])
+        self.index.add_reply('imap:INBOX', source_id, message_id=reply['message_id'],
+                             request_message_id=request['message_id'] if request else None,
+                             service=request['service'] if request else None,
+                             sender=reply['sender'], subject=reply['subject'], body=reply['body'])
+        return self.processor(reply, request, raw)
+
+    def test_parse_dsn(self):
+        for returned in ('text/rfc822-headers', 'message/rfc822'):
+            dsn = parse_dsn(make_dsn('<req1@example.com>', returned=returned))
+            self.assertEqual(dsn['original_message_id'], '<req1@example.com>')
+            self.assertEqual(dsn['reporting_mta'], 'mx.example.com')
+            self.assertEqual(len(dsn['recipients']), 1)
+            recipient = dsn['recipients'][0]
+            self.assertEqual(recipient['recipient'], 'privacy@broker.com')
+            self.assertEqual((recipient['action'], recipient['status'], recipient['hard']), ('failed', '5.1.1', True))
+            self.assertIn('User unknown', recipient['diagnostic'])
+
+        delayed = parse_dsn(make_dsn('<req1@example.com>', action='delayed', status='4.4.1'))
+        self.assertFalse(delayed['recipients'][0]['hard'])
+        self.assertIsNone(parse_dsn(b"From: a@b.com\r\nSubject: Re: request\r\n\r\nDone.\r\n"))
+
+    def test_bounce_links_request_and_lowers_health(self):
+        self.index.record_sent('<req1@example.com>', 'Broker', 'Privacy@Broker.com')
+        self.assertEqual(self.index.address_health(), {})
+
+        self.deliver(make_dsn('<req1@example.com>'), 1)
+        self.assertEqual(self.index.request_statuses(), {'Broker': 'bounced'})
+        self.assertEqual(self.index.address_health(), {'privacy@broker.com': 0.5})
+        reply = self.index.replies()[0]
+        self.assertEqual((reply['category'], reply['service']), ('bounce', 'Broker'))
+        # The classifier leaves bounces alone
+        classify_pending(self.index)
+        self.assertEqual(self.index.replies()[0]['category'], 'bounce')
+
+        self.deliver(make_dsn('<req1@example.com>', action='delayed', status='4.4.1'), 2)
+        report = self.index.address_report()[0]
+        self.assertEqual((report['sends'], report['hard_bounces'], report['soft_bounces']), (1, 1, 1))
+        self.assertAlmostEqual(report['score'], 0.45)
+
+        # A real reply from the broker shows the address works
+        self.deliver(b"From: privacy@broker.com\r\nSubject: Re: request\r\nMessage-ID: <r1@broker.com>\r\n"
+                     b"In-Reply-To: <req1@example.com>\r\n\r\nWe received your request.\r\n", 3)
+        self.assertEqual(self.index.address_health(), {})
+
+    def test_unmatched_bounce_scores_recipient(self):
+        self.deliver(make_dsn('<unknown@example.com>', recipient='optout@gone.example'), 1)
+        self.assertEqual(self.index.address_health(), {'optout@gone.example': 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
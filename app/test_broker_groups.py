@@ -0,0 +1,84 @@
+"""
+Unit tests for broker_groups module.
+"""
+
+import unittest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from broker_groups import deliverable_groups, group_by_contact, prioritize_groups, rank_groups
+from email_templates import PII_ATTRIBUTES, render_request, render_userdata, request_subject
+from registry import csv_to_map
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def broker(contact, category='data broker', top_choice='NO', **required):
+    submap = {'category': category, 'top_choice': top_choice, 'privacy_dept_contact_email': contact}
+    for attribute in PII_ATTRIBUTES:
+        submap[attribute] = required.get(attribute, False)
+    return submap
+
+
+class TestBrokerGroups(unittest.TestCase):
+    """Test cases for grouping brokers by privacy contact."""
+
+    def setUp(self):
+        self.services = {
+            'solo': broker('privacy@solo.com', firstname=True),
+            'famA': broker('Privacy@Family.com ', firstname=True, dob=True),
+            'other': broker('privacy@other.com', category='people search', email=True),
+            'famB': broker('privacy@family.com', top_choice='YES', phone_num=True),
+        }
+
+    def test_group_by_contact(self):
+        groups = group_by_contact(self.services)
+        self.assertEqual([g.services for g in groups], [['solo'], ['famA', 'famB'], ['other']])
+        self.assertEqual(groups[1].contact, 'Privacy@Family.com')
+        self.assertEqual(groups[1].label, 'famA / famB')
+
+    def test_merged_submap_is_union(self):
+        family = group_by_contact(self.services)[1]
+        merged = family.merged_submap()
+        self.assertEqual([a for a in ('firstname', 'dob', 'phone_num', 'email') if merged[a] is True],
+                         ['firstname', 'dob', 'phone_num'])
+        self.assertEqual(merged['top_choice'], 'YES')
+        # The registry rows themselves are left alone
+        self.assertFalse(self.services['famA']['phone_num'])
+        self.assertEqual(render_userdata({'firstname': 'Jane', 'dob': '1990', 'phone_num': '555'}, merged),
+                         "<li>First Name: Jane</li><li>Date of birth: 1990</li><li>Phone Number: 555</li>")
+
+    def test_prioritize_groups(self):
+        """Test that a group takes the best tier of its brands."""
+        order = [(tier, group.services) for tier, group in prioritize_groups(self.services)]
+        self.assertEqual(order, [(0, ['famA', 'famB']), (1, ['other']), (2, ['solo'])])
+
+    def test_bouncing_addresses_skipped_or_sent_last(self):
+        """Test that address health drops groups from a campaign or moves them to the back."""
+        self.services['nocontact'] = broker(' ')
+        health = {'privacy@family.com': 0.5, 'privacy@other.com': 0.25}
+        groups, skipped = deliverable_groups(self.services, health)
+        self.assertEqual([g.services for g in skipped], [['other'], ['nocontact']])
+        order = [(tier, group.services) for tier, group in rank_groups(groups, health=health)]
+        self.assertEqual(order, [(2, ['solo']), (3, ['famA', 'famB'])])
+
+    def test_registry_rows_sharing_an_address(self):
+        all_services, _, _ = csv_to_map(os.path.join(HERE, 'test_services.csv'))
+        groups = group_by_contact(all_services)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0].services, ['db1', 'db2', 'db3', 'db4', 'db5'])
+
+    def test_group_request_names_every_brand(self):
+        family = group_by_contact(self.services)[1]
+        html = render_request({'firstname': 'Jane'}, family.merged_submap(), family.services)
+        self.assertIn('<ul><li>famA</li><li>famB</li></ul>', html)
+        self.assertEqual(request_subject(family.services), 'CCPA Data Deletion Request - famA / famB')
+        # A single-broker request has no brand list
+        self.assertNotIn('<ul>', render_request({'firstname': 'Jane'}, self.services['solo']))
+
+
+if __name__ == '__main__':
+    unittest.main()
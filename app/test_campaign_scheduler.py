@@ -0,0 +1,311 @@
+"""
+Unit tests for campaign_scheduler module.
+"""
+
+import unittest
+import multiprocessing
+import os
+import sys
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from attachments import Attachment
+from campaign_scheduler import CampaignScheduler, IN_FLIGHT_TIMEOUT_SECONDS, QUOTA_WINDOW_SECONDS, prioritize
+from dispatcher import OutgoingMessage
+from registry import csv_to_map
+from sender_pool import SenderAccount, SenderPool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingTransport:
+    linesep = '\n'
+    mangle_from = False
+    sets_from_header = False
+    from_email = None
+
+    def __init__(self, settings):
+        self.sent = settings['sent']
+        self.messages = settings.get('messages', [])
+
+    def send(self, from_addr, to_addrs, message):
+        self.sent.append(to_addrs[0])
+        self.messages.append(message)
+
+    def close(self):
+        pass
+
+
+def send_until_quota(db_path, quota):
+    """Send through a pool sharing the ledger at db_path until it runs out of quota (in a worker process)."""
+    scheduler = CampaignScheduler(db_path)
+    pool = SenderPool.from_config([{'name': 'acct', 'provider': 'null', 'daily_quota': quota, 'max_concurrency': 2}],
+                                  ledger=scheduler.ledger)
+    sent = 0
+    while True:
+        lease = pool.acquire()
+        if lease is None:
+            return sent
+        lease.release(True)
+        sent += 1
+
+
+class TestPrioritize(unittest.TestCase):
+    """Test cases for broker priority ordering."""
+
+    def test_default_order(self):
+        """Test top choice, then people search, then the rest."""
+        all_services, _, _ = csv_to_map(os.path.join(HERE, 'test_services.csv'))
+        self.assertEqual([s for _, s in prioritize(all_services)], ['db2', 'db3', 'db4', 'db1', 'db5'])
+
+    def test_custom_order(self):
+        """Test a configured priority order."""
+        all_services, _, _ = csv_to_map(os.path.join(HERE, 'test_services.csv'))
+        order = prioritize(all_services, ['people search', 'other'])
+        self.assertEqual(order[0], (0, 'db4'))
+
+
+class TestCampaignScheduler(unittest.TestCase):
+    """Test cases for quota-aware scheduling."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'schedule.db')
+        self.clock = FakeClock()
+        self.scheduler = CampaignScheduler(self.db_path, clock=self.clock)
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_pool(self, scheduler, quota):
+        return SenderPool([SenderAccount('acct', {'sent': self.sent}, daily_quota=quota,
+                                         transport_factory=RecordingTransport,
+                                         ledger=scheduler.ledger)])
+
+    def submit(self, count, tier=0):
+        return self.scheduler.submit(
+            [(tier, OutgoingMessage(f"b{i}", f"b{i}@broker.com", 'subject', 'me@x.com', 'body'))
+             for i in range(count)], 'me@x.com')
+
+    def test_campaign_spread_over_days(self):
+        """Test that messages beyond the quota are deferred and sent the next day."""
+        pool = self.make_pool(self.scheduler, quota=3)
+        campaign_id = self.submit(5)
+
+        outcome = self.scheduler.run_due(pool, campaign_id)
+        self.assertEqual(outcome['sent'], ['b0', 'b1', 'b2'])
+        self.assertEqual(outcome['deferred'], ['b3', 'b4'])
+        self.assertEqual(self.scheduler.pending_count(campaign_id), 2)
+        self.assertEqual(self.scheduler.next_due_time(), self.clock.now + QUOTA_WINDOW_SECONDS)
+
+        # Nothing is due until the quota window rolls over
+        self.assertEqual(self.scheduler.run_due(pool)['sent'], [])
+        self.clock.now += QUOTA_WINDOW_SECONDS + 1
+        outcome = self.scheduler.run_due(pool)
+        self.assertEqual(outcome['sent'], ['b3', 'b4'])
+        self.assertEqual(self.scheduler.pending_count(), 0)
+
+    def test_priority_across_campaigns(self):
+        """Test that higher priority messages go first, whichever campaign they belong to."""
+        pool = self.make_pool(self.scheduler, quota=2)
+        self.scheduler.submit([(2, OutgoingMessage('low', 'low@x.com', 's', None, 'b'))], 'me@x.com')
+        self.scheduler.submit([(0, OutgoingMessage('high', 'high@x.com', 's', None, 'b'))], 'me@x.com')
+        self.scheduler.submit([(1, OutgoingMessage('mid', 'mid@x.com', 's', None, 'b'))], 'me@x.com')
+        outcome = self.scheduler.run_due(pool)
+        self.assertEqual(outcome['sent'], ['high', 'mid'])
+        self.assertEqual(outcome['deferred'], ['low'])
+
+    def test_reserve(self):
+        """Test that reserved quota is left unused."""
+        pool = self.make_pool(self.scheduler, quota=3)
+        campaign_id = self.submit(3)
+        outcome = self.scheduler.run_due(pool, campaign_id, reserve=1)
+        self.assertEqual(len(outcome['sent']), 2)
+        self.assertEqual(pool.remaining_quota(), 1)
+
+    def test_shared_contact_reports_every_brand(self):
+        """Test that one request covering several brands reports each brand's outcome."""
+        pool = self.make_pool(self.scheduler, quota=1)
+        self.scheduler.submit([
+            (0, OutgoingMessage('a / b', 'privacy@family.com', 's', None, 'body', brands=['a', 'b'])),
+            (1, OutgoingMessage('c', 'c@x.com', 's', None, 'body'))], 'me@x.com')
+        outcome = self.scheduler.run_due(pool)
+        self.assertEqual(outcome['sent'], ['a', 'b'])
+        self.assertEqual(outcome['deferred'], ['c'])
+        self.assertEqual(self.sent, ['privacy@family.com'])
+
+    def test_schedule_and_quota_survive_restart(self):
+        """Test that pending messages and used quota persist across processes."""
+        pool = self.make_pool(self.scheduler, quota=2)
+        self.submit(4)
+        self.scheduler.run_due(pool)
+
+        reopened = CampaignScheduler(self.db_path, clock=self.clock)
+        pool = self.make_pool(reopened, quota=2)
+        self.assertEqual(pool.remaining_quota(), 0)
+        self.assertEqual(reopened.pending_count(), 2)
+        self.clock.now += QUOTA_WINDOW_SECONDS + 1
+        self.assertEqual(reopened.run_due(pool)['sent'], ['b2', 'b3'])
+        self.assertEqual(self.sent, ['b0@broker.com', 'b1@broker.com', 'b2@broker.com', 'b3@broker.com'])
+
+    def test_bodies_cleared_when_done(self):
+        """Test that a request's body (the user's details) is only kept while it waits to be sent."""
+        pool = self.make_pool(self.scheduler, quota=2)
+        self.submit(3)
+        self.scheduler.run_due(pool)
+
+        class FailingTransport(RecordingTransport):
+            def send(self, from_addr, to_addrs, message):
+                raise ConnectionRefusedError("broker down")
+
+        self.clock.now += QUOTA_WINDOW_SECONDS + 1
+        failing = SenderPool([SenderAccount('acct', {'sent': self.sent}, daily_quota=2,
+                                            transport_factory=FailingTransport, ledger=self.scheduler.ledger)])
+        self.assertEqual(self.scheduler.run_due(failing)['failed'], ['b2'])
+
+        reopened = CampaignScheduler(self.db_path, clock=self.clock)
+        rows = reopened._db.execute("SELECT service, status, body FROM scheduled_messages ORDER BY seq").fetchall()
+        self.assertEqual(rows, [('b0', 'sent', ''), ('b1', 'sent', ''), ('b2', 'failed', '')])
+
+    def test_processes_never_send_the_same_message(self):
+        """Test that messages claimed by one process are skipped by another sharing the database."""
+        other = CampaignScheduler(self.db_path, clock=self.clock)
+        claimed = []
+
+        class ClaimingPool:
+            """Runs the other process's scheduler while this one is mid-send."""
+            def __init__(inner, pool):
+                inner.pool = pool
+
+            def __getattr__(inner, name):
+                return getattr(inner.pool, name)
+
+            def acquire(inner, *args, **kwargs):
+                if not claimed:
+                    claimed.append(other.run_due(self.make_pool(other, quota=10)))
+                return inner.pool.acquire(*args, **kwargs)
+
+        self.submit(3)
+        outcome = self.scheduler.run_due(ClaimingPool(self.make_pool(self.scheduler, quota=10)))
+        self.assertEqual(outcome['sent'], ['b0', 'b1', 'b2'])
+        self.assertEqual(claimed[0]['sent'], [])
+        self.assertEqual(self.sent, ['b0@broker.com', 'b1@broker.com', 'b2@broker.com'])
+
+    def test_attachments_stored_once_per_campaign(self):
+        """Test that a shared attachment is stored once, survives a restart and is deleted when done."""
+        photo = Attachment(b'\xff\xd8\xff photo', 'image/jpeg', 'photo_id.jpg')
+        self.scheduler.submit([
+            (0, OutgoingMessage('a', 'a@x.com', 's', None, 'body', attachments=[photo])),
+            (0, OutgoingMessage('b', 'b@x.com', 's', None, 'body')),
+            (0, OutgoingMessage('c', 'c@x.com', 's', None, 'body', attachments=[photo]))], 'me@x.com')
+        count = "SELECT COUNT(*) FROM campaign_attachments"
+        self.assertEqual(self.scheduler._db.execute(count).fetchone()[0], 1)
+
+        messages = []
+        pool = SenderPool([SenderAccount('acct', {'sent': self.sent, 'messages': messages}, daily_quota=1,
+                                         transport_factory=RecordingTransport, ledger=self.scheduler.ledger)])
+        self.scheduler.run_due(pool)
+        self.assertIn(b'filename="photo_id.jpg"', messages[0])
+
+        # A restarted process loads the attachment from the database for the rest
+        reopened = CampaignScheduler(self.db_path, clock=self.clock)
+        self.clock.now += QUOTA_WINDOW_SECONDS + 1
+        pool = SenderPool([SenderAccount('acct', {'sent': self.sent, 'messages': messages}, daily_quota=10,
+                                         transport_factory=RecordingTransport, ledger=reopened.ledger)])
+        self.assertEqual(reopened.run_due(pool)['sent'], ['b', 'c'])
+        self.assertNotIn(b'photo_id.jpg', messages[1])
+        self.assertIn(b'filename="photo_id.jpg"', messages[2])
+        self.assertEqual(reopened._db.execute(count).fetchone()[0], 0)
+        self.assertEqual(reopened._attachments, {})
+
+    def test_drain(self):
+        """Test that drain stops the worker and waits for the run in progress."""
+        self.scheduler.start(lambda: None, interval_seconds=0.05)
+        self.assertTrue(self.scheduler.drain(timeout=1))
+        self.assertFalse(self.scheduler.running)
+
+
+
+class TestQuotaLedger(unittest.TestCase):
+    """Test cases for quota and concurrency shared between processes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'schedule.db')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_processes_share_quota(self):
+        """Test that worker processes together send exactly the account's quota."""
+        CampaignScheduler(self.db_path)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=4, mp_context=context) as executor:
+            counts = list(executor.map(send_until_quota, [self.db_path] * 4, [40] * 4))
+        self.assertEqual(sum(counts), 40)
+        self.assertEqual(CampaignScheduler(self.db_path).ledger.used('acct'), 40)
+
+    def test_concurrency_shared(self):
+        """Test that an account's in-flight limit counts the sends of other processes."""
+        first = CampaignScheduler(self.db_path, clock=self.clock).ledger
+        second = CampaignScheduler(self.db_path, clock=self.clock).ledger
+        reservation = first.reserve('acct', quota=3, max_in_flight=1)
+        self.assertIsNotNone(reservation)
+        self.assertEqual((second.in_flight('acct'), second.used('acct')), (1, 1))
+        self.assertIsNone(second.reserve('acct', quota=3, max_in_flight=1))
+
+        first.release(reservation, sent=False)
+        self.assertEqual((second.in_flight('acct'), second.used('acct')), (0, 0))
+        reservation = second.reserve('acct', quota=3, max_in_flight=1)
+        second.release(reservation, sent=True)
+        self.assertEqual((first.in_flight('acct'), first.used('acct')), (0, 1))
+
+        # A process that died mid-send stops holding the slot but its send still counts
+        first.reserve('acct', quota=3, max_in_flight=1)
+        self.clock.now += IN_FLIGHT_TIMEOUT_SECONDS + 1
+        self.assertEqual((second.in_flight('acct'), second.used('acct')), (0, 2))
+        self.assertIsNotNone(second.reserve('acct', quota=3, max_in_flight=1))
+        self.assertIsNone(second.reserve('acct', quota=3, max_in_flight=5))
+
+    def test_pool_waits_for_other_process(self):
+        """Test that a pool whose account is busy in another process waits for the slot."""
+        other = CampaignScheduler(self.db_path).ledger
+        scheduler = CampaignScheduler(self.db_path)
+        pool = SenderPool([SenderAccount('acct', {'sent': []}, daily_quota=5, transport_factory=RecordingTransport,
+                                         ledger=scheduler.ledger)])
+        reservation = other.reserve('acct', quota=5, max_in_flight=1)
+        self.assertIsNone(pool.acquire(timeout=0.1))
+        other.release(reservation, sent=True)
+        lease = pool.acquire(timeout=1)
+        self.assertIsNotNone(lease)
+        lease.release(True)
+        self.assertEqual(pool.remaining_quota(), 3)
+
+    def test_checks_are_cheap(self):
+        ledger = CampaignScheduler(self.db_path).ledger
+        for _ in range(400):
+            ledger.release(ledger.reserve('acct', quota=1000), sent=True)
+        start = time.perf_counter()
+        for _ in range(10000):
+            ledger.used('acct')
+        per_check = (time.perf_counter() - start) / 10000
+        self.assertLess(per_check, 200e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Unit tests for config module loading, validation and reloading.
+"""
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import ConfigError, EmailConfig, deep_merge, validate_config
+
+
+class TestEmailConfig(unittest.TestCase):
+    """Test cases for EmailConfig."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'email_config.json')
+
+    def tearDown(self):
+        os.environ.pop('SMTP_USERNAME', None)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, config):
+        with open(self.path, 'w') as f:
+            json.dump(config, f)
+
+    def test_deep_merge(self):
+        merged = deep_merge({'a': {'x': 1, 'y': 2}, 'l': [1]}, {'a': {'y': 3}, 'l': [2]})
+        self.assertEqual(merged, {'a': {'x': 1, 'y': 3}, 'l': [2]})
+
+    def test_partial_smtp_settings_keep_env_values(self):
+        """Test that a partial smtp_settings in the file does not wipe env-provided values."""
+        os.environ['SMTP_USERNAME'] = 'env-user'
+        self.write({'email_provider': 'smtp', 'smtp_settings': {'smtp_port': 2525}})
+        smtp_settings = EmailConfig(self.path).get_smtp_settings()
+        self.assertEqual(smtp_settings['smtp_username'], 'env-user')
+        self.assertEqual(smtp_settings['smtp_port'], 2525)
+        self.assertEqual(smtp_settings['smtp_server'], 'localhost')
+
+    def test_validation(self):
+        self.assertEqual(validate_config({'email_provider': 'smtp', 'sender_accounts': [
+            {'name': 'a', 'provider': 'gmail_api', 'daily_quota': 400}]}), [])
+        problems = validate_config({'email_provider': 'fax', 'smtp_settings': {'smtp_port': '25'},
+                                    'sender_accounts': [{'daily_quota': True}], 'colour': 'blue'})
+        self.assertEqual(problems, [
+            "config.email_provider must be one of gmail_api, smtp",
+            "config.smtp_settings.smtp_port must be of type int",
+            "config.sender_accounts[0].daily_quota must be of type int",
+            "config.colour is not a known setting"])
+        self.write({'smtp_settings': {'smtp_port': 'twenty-five'}})
+        with self.assertRaises(ConfigError):
+            EmailConfig(self.path)
+
+    def test_reload_only_when_file_changes(self):
+        self.write({'email_provider': 'smtp'})
+        config = EmailConfig(self.path)
+        self.assertFalse(config.reload_if_changed())
+
+        self.write({'email_provider': 'smtp', 'daily_quota': 450, 'campaign_priority': ['other']})
+        os.utime(self.path, ns=(1, 1))
+        self.assertTrue(config.reload_if_changed())
+        self.assertEqual(config.get_campaign_priority(), ['other'])
+        self.assertEqual(config.get_sender_accounts()[0]['daily_quota'], 450)
+
+        # An invalid edit is reported and the previous configuration kept
+        self.write({'email_provider': 'pigeon'})
+        os.utime(self.path, ns=(2, 2))
+        self.assertFalse(config.reload_if_changed())
+        self.assertEqual(config.get_email_provider(), 'smtp')
+
+    def test_half_written_file_keeps_config(self):
+        """Test that a file that is not valid JSON is rejected, at startup and on reload."""
+        self.write({'email_provider': 'smtp', 'smtp_settings': {'smtp_server': 'mail.example.org'}})
+        config = EmailConfig(self.path)
+        with open(self.path, 'w') as f:
+            f.write('{"email_provider": "smtp", "smtp_sett')
+        os.utime(self.path, ns=(1, 1))
+        self.assertFalse(config.reload_if_changed())
+        self.assertEqual(config.get_smtp_settings()['smtp_server'], 'mail.example.org')
+        with self.assertRaises(ConfigError):
+            EmailConfig(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Unit tests for email_templates module.
+"""
+
+import unittest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from email_templates import GMAIL_CONFIRMATION_TEMPLATE, SMTP_CONFIRMATION_TEMPLATE, campaign_result
+
+
+class TestConfirmation(unittest.TestCase):
+    """Test cases for the confirmation email sent to the user."""
+
+    def test_all_sent(self):
+        for template in (SMTP_CONFIRMATION_TEMPLATE, GMAIL_CONFIRMATION_TEMPLATE):
+            self.assertIn("Emails were sent to all chosen data brokers successfully.",
+                          template.format(sentresult=campaign_result()))
+
+    def test_failed_and_skipped_brokers_listed(self):
+        """Test that the confirmation names the brokers that failed and those left out."""
+        sent_result = campaign_result(['acme', 'bravo'], skipped=['nocontact'])
+        for template in (SMTP_CONFIRMATION_TEMPLATE, GMAIL_CONFIRMATION_TEMPLATE):
+            body = template.format(sentresult=sent_result)
+            self.assertIn("Emails could not be sent to acme, bravo.", body)
+            self.assertIn("Emails were not sent to nocontact because their privacy contact address", body)
+
+    def test_deferred_brokers_listed(self):
+        """Test that the user is told which requests wait for the daily sending limit."""
+        body = SMTP_CONFIRMATION_TEMPLATE.format(sentresult=campaign_result(['acme'], ['charlie'], ['nocontact']))
+        self.assertIn("Emails could not be sent to acme.", body)
+        self.assertIn("Emails to charlie will be sent once the daily sending limit allows.", body)
+        self.assertIn("Emails were not sent to nocontact", body)
+        self.assertNotIn("all chosen data brokers", campaign_result(deferred=['charlie']))
+
+
+if __name__ == '__main__':
+    unittest.main()
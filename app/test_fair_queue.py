@@ -0,0 +1,127 @@
+"""
+Unit tests for fair_queue module.
+"""
+
+import unittest
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fair_queue import FairQueue
+
+
+class Recorder:
+    """Jobs that record the order they started in."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.started = []
+        self.lock = threading.Lock()
+
+    def job(self, name):
+        def run():
+            with self.lock:
+                self.started.append(name)
+            time.sleep(self.delay)
+        return run
+
+
+class TestFairQueue(unittest.TestCase):
+    """Test cases for sharing senders between concurrent campaigns."""
+
+    def run_blocked(self, queue, batches):
+        """Queue all batches while the single worker is busy, then run them."""
+        gate = threading.Event()
+        blocker = threading.Thread(target=queue.run, args=([('blocker', gate.wait)],))
+        blocker.start()
+        while not queue.stats().get('blocker', {}).get('in_flight'):
+            time.sleep(0.001)
+        threads = [threading.Thread(target=queue.run, args=(batch,)) for batch in batches]
+        for thread in threads:
+            thread.start()
+        while sum(stats['queued'] for stats in queue.stats().values()) < sum(map(len, batches)):
+            time.sleep(0.001)
+        gate.set()
+        for thread in threads + [blocker]:
+            thread.join(5)
+
+    def test_small_campaign_not_stuck_behind_large(self):
+        """Test that tenants take turns instead of first come, first served."""
+        queue = FairQueue(workers=1)
+        recorder = Recorder()
+        large = [('large', recorder.job(f'large{i}')) for i in range(20)]
+        small = [('small', recorder.job(f'small{i}')) for i in range(3)]
+        self.run_blocked(queue, [large, small])
+        self.assertEqual(recorder.started[:6], ['large0', 'small0', 'large1', 'small1', 'large2', 'small2'])
+        self.assertEqual(len(recorder.started), 23)
+        self.assertEqual(queue.stats(), {})
+
+    def test_weights(self):
+        """Test that a tenant with weight 3 starts three messages per round."""
+        queue = FairQueue(workers=1, settings={'tenants': [{'tenant': 'paid', 'weight': 3}]})
+        self.assertEqual(queue.weight('paid'), 3.0)
+        self.assertEqual(queue.weight('free'), 1.0)
+        recorder = Recorder()
+        free = [('free', recorder.job('free')) for _ in range(4)]
+        paid = [('paid', recorder.job('paid')) for _ in range(9)]
+        self.run_blocked(queue, [free, paid])
+        self.assertEqual(recorder.started[:8], ['free', 'paid', 'paid', 'paid', 'free', 'paid', 'paid', 'paid'])
+
+    def test_max_in_flight(self):
+        """Test that a capped tenant never has more messages sending than its cap."""
+        queue = FairQueue(workers=4, settings={'max_in_flight': 1, 'tenants': [{'tenant': 'b', 'max_in_flight': 2}]})
+        running = {'a': 0, 'b': 0}
+        peak = {'a': 0, 'b': 0}
+        lock = threading.Lock()
+
+        def job(tenant):
+            def run():
+                with lock:
+                    running[tenant] += 1
+                    peak[tenant] = max(peak[tenant], running[tenant])
+                time.sleep(0.01)
+                with lock:
+                    running[tenant] -= 1
+            return run
+
+        queue.run([('a', job('a')) for _ in range(5)] + [('b', job('b')) for _ in range(8)])
+        self.assertEqual(peak, {'a': 1, 'b': 2})
+
+    def test_errors_raised_after_batch(self):
+        """Test that a failing job fails its own run() without stopping the other jobs."""
+        queue = FairQueue(workers=2)
+        recorder = Recorder()
+
+        def fail():
+            raise RuntimeError("SMTP down")
+
+        with self.assertLogs('fair_queue', 'ERROR'):
+            with self.assertRaisesRegex(RuntimeError, "SMTP down"):
+                queue.run([('a', fail)] + [('a', recorder.job(i)) for i in range(3)])
+        self.assertEqual(sorted(recorder.started), [0, 1, 2])
+        queue.run([('a', recorder.job(3))])
+        queue.run([])
+        self.assertEqual(len(recorder.started), 4)
+
+    def test_idle_workers_exit(self):
+        """Test that workers stop when there is nothing to send and restart on demand."""
+        queue = FairQueue(workers=3, idle_timeout=0.05)
+        recorder = Recorder(delay=0.01)
+        queue.run([('a', recorder.job(i)) for i in range(6)])
+        deadline = time.time() + 5
+        while queue._threads and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(queue._threads, 0)
+        queue.run([('a', recorder.job(6))])
+        self.assertEqual(len(recorder.started), 7)
+
+        queue.configure(workers=1)
+        self.assertEqual(queue.workers, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""
+Unit tests for gmail_tracker module.
+Uses an in-memory stand-in for the Gmail API service.
+"""
+
+import unittest
+import base64
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gmail_tracker import BATCH_RETRIES, GmailReplyTracker
+from reply_index import ReplyIndex
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type('Resp', (), {'status': status})()
+
+
+class FakeRequest:
+    def __init__(self, gmail, method, kwargs):
+        self.gmail = gmail
+        self.method = method
+        self.kwargs = kwargs
+
+    def execute(self):
+        self.gmail.calls.append(self.method)
+        return getattr(self.gmail, self.method)(**self.kwargs)
+
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.gmail.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            if self.gmail.failures.get(request_id):
+                self.gmail.failures[request_id] -= 1
+                self.callback(request_id, None, FakeHttpError(503))
+            else:
+                self.callback(request_id, getattr(self.gmail, request.method)(**request.kwargs), None)
+
+
+class FakeResource:
+    def __init__(self, gmail, prefix):
+        self.gmail = gmail
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        return lambda **kwargs: FakeRequest(self.gmail, self.prefix + name, kwargs)
+
+
+class FakeGmail:
+    """Mailbox of threads with a history log, exposing the Gmail API call shapes."""
+
+    def __init__(self):
+        self.history_id = 100
+        self.mailbox = {}
+        self.log = []
+        self.calls = []
+        self.batches = []
+        self.min_history_id = 0
+        # Batch call key -> times it fails before succeeding
+        self.failures = {}
+
+    def add_message(self, message_id, thread_id, raw, labels, headers=None):
+        self.history_id += 1
+        self.mailbox[message_id] = {'id': message_id, 'threadId': thread_id, 'labelIds': list(labels),
+                                     'raw': base64.urlsafe_b64encode(raw).decode(),
+                                     'headers': headers or {}, 'internalDate': '1760000000000'}
+        self.log.append((self.history_id, message_id))
+
+    # service plumbing
+    def users(self):
+        return self
+
+    def threads(self):
+        return FakeResource(self, 'threads_')
+
+    def messages(self):
+        return FakeResource(self, 'messages_')
+
+    def history(self):
+        return FakeResource(self, 'history_')
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def getProfile(self, userId):
+        return FakeRequest(self, 'profile', {})
+
+    # API methods
+    def profile(self):
+        return {'emailAddress': 'me@gmail.com', 'historyId': str(self.history_id)}
+
+    def threads_list(self, userId, labelIds, pageToken=None):
+        threads = sorted({m['threadId'] for m in self.mailbox.values() if labelIds[0] in m['labelIds']})
+        return {'threads': [{'id': t} for t in threads]}
+
+    def threads_get(self, userId, id, format, metadataHeaders):
+        return {'id': id, 'messages': [
+            {'id': m['id'], 'threadId': id, 'labelIds': m['labelIds'], 'internalDate': m['internalDate'],
+             'payload': {'headers': [{'name': k, 'value': v} for k, v in m['headers'].items()]}}
+            for m in self.mailbox.values() if m['threadId'] == id]}
+
+    def messages_get(self, userId, id, format):
+        return {'id': id, 'raw': self.mailbox[id]['raw']}
+
+    def messages_batchModify(self, userId, body):
+        for message_id in body['ids']:
+            self.mailbox[message_id]['labelIds'].extend(body['addLabelIds'])
+        return {}
+
+    def history_list(self, userId, startHistoryId, historyTypes, pageToken=None):
+        if int(startHistoryId) < self.min_history_id:
+            raise FakeHttpError(404)
+        records = [(h, mid) for h, mid in self.log if h > int(startHistoryId)]
+        start = int(pageToken or 0)
+        page = records[start:start + 2]
+        response = {'historyId': str(self.history_id),
+                    'history': [{'id': str(h), 'messagesAdded': [{'message': {
+                        'id': mid, 'threadId': self.mailbox[mid]['threadId'],
+                        'labelIds': self.mailbox[mid]['labelIds']}}]} for h, mid in page]}
+        if start + 2 < len(records):
+            response['nextPageToken'] = str(start + 2)
+        return response
+
+
+def make_raw(body, subject='Re: CCPA Data Deletion Request'):
+    return (f"From: privacy@broker.com\r\nSubject: {subject}\r\nMessage-ID: <{abs(hash(body))}@broker.com>\r\n"
+            f"\r\n{body}\r\n").encode()
+
+
+class TestGmailReplyTracker(unittest.TestCase):
+    """Test cases for history-based Gmail reply tracking."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = ReplyIndex(os.path.join(self.tmpdir, 'replies.db'))
+        self.gmail = FakeGmail()
+        self.tracker = GmailReplyTracker(self.index, self.gmail, 'Label_1', retry_backoff=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def send_request(self, n, record=True):
+        self.gmail.add_message(f"s{n}", f"t{n}", make_raw('request'), ['SENT', 'Label_1'], headers={
+            'Subject': f"CCPA Data Deletion Request - broker{n}", 'To': f"privacy@broker{n}.com",
+            'Message-ID': f"<req{n}@me.com>"})
+        if record:
+            self.index.record_sent(f"<req{n}@me.com>", f"broker{n}", f"privacy@broker{n}.com",
+                                   campaign_id='c1', thread_id=f"t{n}")
+
+    def test_bootstrap_reads_labelled_threads(self):
+        """Test that the first sync registers old requests and stores their replies."""
+        self.send_request(1)
+        self.send_request(2, record=False)
+        self.gmail.add_message('r1', 't1', make_raw('We have received your request.'), ['INBOX'])
+        self.gmail.add_message('r2', 't2', make_raw('Please provide your date of birth.'), ['INBOX'])
+        self.gmail.add_message('x1', 'tx', make_raw('Newsletter'), ['INBOX'])
+
+        self.assertEqual(self.tracker.sync(), 2)
+        self.assertEqual(self.index.request_statuses(),
+                         {'broker1': 'confirmed', 'broker2': 'info_requested'})
+        self.assertEqual(self.index.get_sync_state('gmail'), (None, str(self.gmail.history_id)))
+        self.assertIn('Label_1', self.gmail.mailbox['r1']['labelIds'])
+
+    def test_incremental_sync_uses_history(self):
+        """Test that later syncs only fetch messages added to broker threads."""
+        self.send_request(1)
+        self.send_request(2)
+        self.tracker.sync()
+        self.gmail.calls.clear()
+
+        self.gmail.add_message('r1', 't1', make_raw('Please fill out the form at https://b.com/privacy-form'),
+                               ['INBOX'])
+        self.gmail.add_message('x1', 'tx', make_raw('Unrelated'), ['INBOX'])
+        self.gmail.add_message('s3', 't3', make_raw('request'), ['SENT'])
+        self.gmail.add_message('r2', 't2', make_raw('Your request has been completed.'), ['INBOX'])
+        self.assertEqual(self.tracker.sync(), 2)
+
+        self.assertNotIn('threads_list', self.gmail.calls)
+        self.assertEqual(self.gmail.calls.count('history_list'), 2)
+        self.assertEqual(self.gmail.batches[-1], 2)
+        self.assertEqual([r['service'] for r in self.index.replies()], ['broker1', 'broker2'])
+        self.assertEqual(self.index.request_statuses('c1'), {'broker1': 'form_required', 'broker2': 'confirmed'})
+
+        self.gmail.calls.clear()
+        self.assertEqual(self.tracker.sync(), 0)
+        self.assertEqual(self.gmail.calls, ['history_list'])
+
+    def test_failed_fetch_retried(self):
+        """Test that a reply whose fetch keeps failing is stored by the next sync."""
+        self.send_request(1)
+        self.send_request(2)
+        self.tracker.sync()
+        synced = self.index.get_sync_state('gmail')
+
+        self.gmail.add_message('r1', 't1', make_raw('We have received your request.'), ['INBOX'])
+        self.gmail.add_message('r2', 't2', make_raw('Your request has been completed.'), ['INBOX'])
+        # r1 fails past every retry, r2 succeeds on its second attempt
+        self.gmail.failures = {'r1': BATCH_RETRIES + 1, 'r2': 1}
+        self.assertEqual(self.tracker.sync(), 1)
+        self.assertEqual(self.gmail.batches[-BATCH_RETRIES - 1:], [2, 2, 1, 1])
+        self.assertEqual(self.index.get_sync_state('gmail'), synced)
+        self.assertEqual([r['service'] for r in self.index.replies()], ['broker2'])
+
+        self.assertEqual(self.tracker.sync(), 1)
+        self.assertEqual(self.index.request_statuses(), {'broker1': 'confirmed', 'broker2': 'confirmed'})
+        self.assertEqual(self.index.get_sync_state('gmail'), (None, str(self.gmail.history_id)))
+
+    def test_expired_history_rescans(self):
+        """Test that a 404 from history.list falls back to a full rescan without duplicates."""
+        self.send_request(1)
+        self.gmail.add_message('r1', 't1', make_raw('We have received your request.'), ['INBOX'])
+        self.tracker.sync()
+        self.gmail.add_message('r2', 't1', make_raw('It has been processed.'), ['INBOX'])
+        self.gmail.min_history_id = self.gmail.history_id + 1
+        self.assertEqual(self.tracker.sync(), 1)
+        self.assertEqual(len(self.index.replies('broker1')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Unit tests for handoff module.
+Runs a small WSGI server in a subprocess and hands its socket to a successor
+while a client keeps sending requests.
+"""
+
+import unittest
+import http.client
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_SCRIPT = textwrap.dedent("""
+    import os, socketserver, sys, threading, time
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+    sys.path.insert(0, {app_dir!r})
+    from handoff import HandoffServer, LISTEN_FD_ENV
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    def stdlib_server(app, sock):
+        server = ThreadingWSGIServer(sock.getsockname()[:2], QuietHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = sock
+        server.server_name, server.server_port = sock.getsockname()[:2]
+        server.setup_environ()
+        server.set_app(app)
+        return server
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/handoff':
+            threading.Thread(target=server.handoff, args=(10,)).start()
+        elif environ['PATH_INFO'] == '/slow':
+            time.sleep(1.0)
+        elif environ['PATH_INFO'] == '/failed-handoff':
+            argv, server.argv = server.argv, [sys.executable, '-c', 'raise SystemExit(1)']
+            try:
+                assert not server.handoff(10)
+            finally:
+                server.argv = argv
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [str(os.getpid()).encode()]
+
+    first = LISTEN_FD_ENV not in os.environ
+    server = HandoffServer(app, '127.0.0.1', 0, server_factory=stdlib_server)
+    if first:
+        with open(sys.argv[1] + '.tmp', 'w') as f:
+            f.write(str(server.sock.getsockname()[1]))
+        os.rename(sys.argv[1] + '.tmp', sys.argv[1])
+    server.serve_forever(warm_up=lambda: time.sleep(0.3))
+    server.drain()
+""")
+
+
+class TestHandoff(unittest.TestCase):
+    """Test cases for listening-socket handoff between processes."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, 'server.py')
+        with open(self.script, 'w') as f:
+            f.write(SERVER_SCRIPT.format(app_dir=HERE))
+        self.port_file = os.path.join(self.tmpdir, 'port')
+        self.old = subprocess.Popen([sys.executable, self.script, self.port_file])
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.port_file):
+            self.assertLess(time.monotonic(), deadline, "server did not start")
+            time.sleep(0.05)
+        with open(self.port_file) as f:
+            self.port = int(f.read())
+        self.pids = set()
+
+    def tearDown(self):
+        if self.old.poll() is None:
+            self.old.kill()
+            self.old.wait()
+        for pid in self.pids - {self.old.pid}:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, path='/'):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            pid = int(response.read())
+        finally:
+            connection.close()
+        self.pids.add(pid)
+        return pid
+
+    def test_handoff_without_dropped_requests(self):
+        self.assertEqual(self.get(), self.old.pid)
+        results, errors = [], []
+        stop = threading.Event()
+
+        def hammer():
+            while not stop.is_set():
+                try:
+                    results.append(self.get())
+                except Exception as e:
+                    errors.append(e)
+
+        slow = []
+        clients = [threading.Thread(target=hammer) for _ in range(4)]
+        clients.append(threading.Thread(target=lambda: slow.append(self.get('/slow'))))
+        for client in clients:
+            client.start()
+        time.sleep(0.1)
+        self.get('/handoff')
+
+        # The old process exits once its in-flight /slow request has finished
+        self.assertEqual(self.old.wait(timeout=15), 0)
+        time.sleep(0.2)
+        stop.set()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(slow, [self.old.pid])
+        successors = set(results) - {self.old.pid}
+        self.assertEqual(len(successors), 1)
+        self.assertEqual(results[-1], successors.pop())
+        self.assertNotEqual(self.get(), self.old.pid)
+
+    def test_failed_successor_keeps_serving(self):
+        self.assertEqual(self.get('/failed-handoff'), self.old.pid)
+        self.assertEqual(self.get(), self.old.pid)
+        self.assertIsNone(self.old.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
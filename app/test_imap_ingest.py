@@ -0,0 +1,196 @@
+"""
+Unit tests for imap_ingest and reply_index modules.
+Uses a minimal local IMAP server as a stand-in for Proton Mail Bridge.
+"""
+
+import unittest
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from imap_ingest import IMAPConnection, ReplyIngestor, parse_reply
+from reply_index import ReplyIndex
+from test_bounces import make_dsn
+
+
+def make_reply(n, in_reply_to=None, references=None):
+    headers = [f"From: Privacy Team <privacy{n}@broker.com>",
+               f"Subject: Re: CCPA Data Deletion Request - broker{n}",
+               f"Message-ID: <reply{n}@broker.com>",
+               "Date: Mon, 19 Oct 2026 10:00:00 +0000"]
+    if in_reply_to:
+        headers.append(f"In-Reply-To: {in_reply_to}")
+    if references:
+        headers.append(f"References: {references}")
+    return ("\r\n".join(headers) + "\r\n\r\nWe have received your request.\r\n").encode()
+
+
+class FakeIMAPState:
+    def __init__(self):
+        self.uidvalidity = 1
+        self.messages = {}
+        self.fetched = []
+        self.idle_started = threading.Event()
+        self.new_mail = threading.Event()
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough IMAP4rev1 for imaplib and IMAPConnection."""
+
+    def send(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        state = self.server.state
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE] ready')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            tag, command, *args = line.split(' ')
+            command = command.upper()
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE')
+            elif command in ('LOGIN', 'NOOP'):
+                pass
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send(f"* {len(state.messages)} EXISTS")
+                self.send(f"* OK [UIDVALIDITY {state.uidvalidity}] UIDs valid")
+                self.send(f"* OK [UIDNEXT {max(state.messages, default=0) + 1}] Predicted next UID")
+            elif command == 'UID' and args[0].upper() == 'SEARCH':
+                low = int(args[2].split(':')[0])
+                uids = sorted(state.messages)
+                matched = [u for u in uids if u >= low] or uids[-1:]
+                self.send('* SEARCH ' + ' '.join(map(str, matched)))
+            elif command == 'UID' and args[0].upper() == 'FETCH':
+                for seq, uid in enumerate(sorted(state.messages), 1):
+                    if str(uid) in args[1].split(','):
+                        raw = state.messages[uid]
+                        state.fetched.append(uid)
+                        self.wfile.write(f"* {seq} FETCH (UID {uid} BODY[] {{{len(raw)}}}\r\n".encode()
+                                         + raw + b')\r\n')
+            elif command == 'IDLE':
+                self.send('+ idling')
+                state.idle_started.set()
+                if state.new_mail.wait(5):
+                    self.send(f"* {len(state.messages)} EXISTS")
+                self.rfile.readline()  # DONE
+            elif command == 'LOGOUT':
+                self.send('* BYE')
+                self.send(f"{tag} OK LOGOUT completed")
+                return
+            self.send(f"{tag} OK {command} completed")
+
+
+class TestReplyIngestion(unittest.TestCase):
+    """Test cases for incremental IMAP reply ingestion."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = ReplyIndex(os.path.join(self.tmpdir, 'replies.db'))
+        self.index.record_sent('<req1@me.com>', 'broker1', 'privacy1@broker.com', campaign_id='c1')
+        self.index.record_sent('<req2@me.com>', 'broker2', 'privacy2@broker.com', campaign_id='c1')
+
+        self.state = FakeIMAPState()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeIMAPHandler)
+        self.server.daemon_threads = True
+        self.server.state = self.state
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        settings = {'imap_server': '127.0.0.1', 'imap_port': self.server.server_address[1],
+                    'imap_username': 'me', 'imap_password': 'pw'}
+        self.ingestor = ReplyIngestor(self.index, lambda: IMAPConnection(settings))
+
+    def tearDown(self):
+        self.ingestor.stop_connection()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_replies_to_requests(self):
+        """Test matching through In-Reply-To and References, and that other mail is not stored."""
+        self.ingestor.sync()
+        self.state.messages[5] = make_reply(1, in_reply_to='<req1@me.com>')
+        self.state.messages[6] = make_reply(2, references='<other@x.com> <req2@me.com>')
+        self.state.messages[7] = make_reply(3)
+        self.state.messages[8] = make_dsn('<unknown@me.com>')
+        self.assertEqual(self.ingestor.sync(), 3)
+
+        replies = self.index.replies()
+        self.assertEqual([r['service'] for r in replies], ['broker1', 'broker2', None])
+        self.assertIn('Undelivered', replies[2]['subject'])
+        self.assertEqual(self.index.request_statuses('c1'), {'broker1': 'confirmed', 'broker2': 'confirmed'})
+        self.assertIn('received your request', self.index.replies('broker1')[0]['body'])
+        self.assertEqual([r['category'] for r in replies[:2]], ['confirmation'] * 2)
+        self.assertEqual(self.index.get_sync_state('imap:INBOX'), ('1', '8'))
+
+    def test_first_sync_skips_existing_mail(self):
+        """Test that the first sync starts at UIDNEXT instead of reading the whole mailbox."""
+        self.state.messages[1] = make_reply(1, in_reply_to='<req1@me.com>')
+        self.state.messages[2] = make_reply(4)
+        self.assertEqual(self.ingestor.sync(), 0)
+        self.assertEqual(self.state.fetched, [])
+        self.assertEqual(self.index.get_sync_state('imap:INBOX'), ('1', '2'))
+
+        self.state.messages[3] = make_reply(2, in_reply_to='<req2@me.com>')
+        self.assertEqual(self.ingestor.sync(), 1)
+        self.assertEqual(self.state.fetched, [3])
+
+    def test_incremental_sync(self):
+        """Test that each sync only fetches messages newer than the last stored UID."""
+        self.ingestor.sync()
+        self.state.messages[1] = make_reply(1, in_reply_to='<req1@me.com>')
+        self.assertEqual(self.ingestor.sync(), 1)
+        self.assertEqual(self.ingestor.sync(), 0)
+        self.state.messages[2] = make_reply(2, in_reply_to='<req2@me.com>')
+        self.assertEqual(self.ingestor.sync(), 1)
+        self.assertEqual(self.state.fetched, [1, 2])
+
+    def test_uidvalidity_change_resyncs(self):
+        """Test that a new UIDVALIDITY triggers a full resync without duplicates."""
+        self.ingestor.sync()
+        self.state.messages[10] = make_reply(1, in_reply_to='<req1@me.com>')
+        self.assertEqual(self.ingestor.sync(), 1)
+        self.state.uidvalidity = 2
+        self.state.messages = {1: make_reply(1, in_reply_to='<req1@me.com>'),
+                               2: make_reply(2, in_reply_to='<req2@me.com>'), 3: make_reply(3)}
+        self.assertEqual(self.ingestor.sync(), 2)
+        self.assertEqual(self.index.get_sync_state('imap:INBOX'), ('2', '3'))
+
+    def test_idle_wakes_on_new_mail(self):
+        """Test that IDLE returns when the server announces new messages."""
+        self.ingestor.sync()
+        woke = []
+        waiter = threading.Thread(target=lambda: woke.append(self.ingestor.connection.idle(timeout=5)))
+        waiter.start()
+        self.assertTrue(self.state.idle_started.wait(5))
+        self.state.messages[3] = make_reply(1, in_reply_to='<req1@me.com>')
+        self.state.new_mail.set()
+        waiter.join(5)
+        self.assertEqual(woke, [True])
+        self.assertEqual(self.ingestor.sync(), 1)
+
+    def test_idle_timeout(self):
+        """Test that IDLE gives up quietly after the timeout."""
+        self.ingestor.sync()
+        self.assertFalse(self.ingestor.connection.idle(timeout=0.2))
+        self.assertEqual(self.ingestor.sync(), 0)
+
+
+class TestParseReply(unittest.TestCase):
+    """Test cases for reply parsing."""
+
+    def test_parse_reply(self):
+        reply = parse_reply(make_reply(4, in_reply_to='<a@b>', references='<c@d>'))
+        self.assertEqual(reply['message_id'], '<reply4@broker.com>')
+        self.assertEqual(reply['references'], ['<c@d>', '<a@b>'])
+        self.assertIn('broker4', reply['subject'])
+
+
+if __name__ == '__main__':
+    unittest.main()
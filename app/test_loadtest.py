@@ -0,0 +1,76 @@
+"""
+Unit tests for the load-test harness and the fake transports it uses.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import EmailConfig
+from dispatcher import OutgoingMessage, dispatch
+from loadtest import ProcessSampler, percentile, summarize, write_config
+from sender_pool import SenderPool
+from transports import LatencyTransport, NullTransport, create_transport
+
+
+class TestLoadTestStats(unittest.TestCase):
+    """Test cases for the report helpers."""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        report = summarize([0.01, 0.02, 0.03, 0.04], {'HTTP 500': 1}, 2.5)
+        self.assertEqual(report['requests'], 5)
+        self.assertEqual(report['error_rate'], 0.2)
+        self.assertEqual(report['throughput_rps'], 2.0)
+        self.assertEqual(report['latency_ms']['p50'], 20.0)
+        self.assertEqual(report['latency_ms']['max'], 40.0)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'), "needs /proc")
+    def test_process_sampler(self):
+        sampler = ProcessSampler(os.getpid(), interval=0.01)
+        sampler.start()
+        sum(i * i for i in range(200000))
+        result = sampler.stop()
+        self.assertGreaterEqual(result['cpu_seconds'], 0)
+        self.assertGreater(result['rss_peak_mb'], 1)
+
+
+class TestFakeTransports(unittest.TestCase):
+    """Test cases for the null and latency transports."""
+
+    def test_create_transport(self):
+        self.assertIsInstance(create_transport({'provider': 'null'}), NullTransport)
+        transport = create_transport({'provider': 'latency', 'latency_ms': 5, 'error_rate': 1.0})
+        self.assertIsInstance(transport, LatencyTransport)
+        with self.assertRaises(Exception):
+            transport.send('a@b.com', ['c@d.com'], b'message')
+
+    def test_loadtest_config_builds_pool(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = write_config(tmpdir, 'latency', accounts=3, account_concurrency=2, latency_ms=1)
+            pool = SenderPool.from_config(EmailConfig(path).get_sender_accounts())
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(pool.max_concurrency(), 6)
+        messages = [OutgoingMessage(f"broker{i}", f"privacy@broker{i}.com", 'Subject', None, 'Body')
+                    for i in range(12)]
+        sent, notsent = dispatch(pool, messages, default_from='me@example.com')
+        self.assertEqual(len(sent), 12)
+        self.assertEqual(notsent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests for the queue-based structured logging.
+"""
+
+import io
+import json
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logging_setup
+from logging_setup import JSONFormatter, RedactingFilter, redact, setup_logging, stop_logging
+
+
+def _record(msg, args=None, **extra):
+    record = logging.LogRecord('privacybot.test', logging.INFO, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+class TestRedaction(unittest.TestCase):
+    """Test PII redaction."""
+
+    def test_masks_email_local_part_and_phone(self):
+        text = redact("Request for jane.doe+x@example.com, phone +1 (555) 123-4567")
+        self.assertEqual(text, "Request for ***@example.com, phone <phone>")
+
+    def test_leaves_ids_and_counts(self):
+        text = "Campaign 3f2a-91: 427 requests queued for 470 data brokers"
+        self.assertEqual(redact(text), text)
+
+    def test_leaves_numeric_log_text(self):
+        """Test that timestamps, byte counts and IDs are not mistaken for phone numbers."""
+        for text in ("Deferred 3 messages until Mon Oct 19 10:00:00 2026",
+                     "2026-10-19 10:00:00,123 Date: Mon, 19 Oct 2026 10:00:00 +0000",
+                     "RSS grew by 104857600 bytes (102400 KB) in 1234.567 ms",
+                     "Campaign 123e4567-e89b-12d3-a456-426614174000 pid 12345 on 10.0.0.1:5000",
+                     "UID 1000000 to 1000250, 4294967295 quota"):
+            self.assertEqual(redact(text), text)
+
+    def test_phone_formats(self):
+        for phone in ("+1 555 123 4567", "(555) 123-4567", "555.123.4567", "+44 20 7946 0958", "+4915112345678"):
+            self.assertEqual(redact(f"call {phone}."), "call <phone>.")
+
+    def test_filter_redacts_args_and_extras(self):
+        record = _record("Sent to %s", ('jane@example.com',), broker='Acme <jane@example.com>')
+        RedactingFilter().filter(record)
+        self.assertEqual(record.getMessage(), "Sent to ***@example.com")
+        self.assertEqual(record.broker, 'Acme <***@example.com>')
+
+
+class TestJSONFormatter(unittest.TestCase):
+    """Test the JSON line format."""
+
+    def test_includes_context_fields(self):
+        record = _record("Email sent successfully to Acme", campaign_id='c1', broker='Acme',
+                         account='primary', transport='smtp')
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['message'], "Email sent successfully to Acme")
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'privacybot.test')
+        for field in logging_setup.CONTEXT_FIELDS:
+            self.assertIn(field, entry)
+        self.assertEqual(entry['campaign_id'], 'c1')
+
+
+class TestSetupLogging(unittest.TestCase):
+    """Test the queue handler and listener wiring."""
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved = (list(root.handlers), root.level)
+
+    def tearDown(self):
+        stop_logging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in self.saved[0]:
+            root.addHandler(handler)
+        root.setLevel(self.saved[1])
+
+    def test_records_written_by_listener(self):
+        stream = io.StringIO()
+        listener = setup_logging(level='INFO', stream=stream, fmt='json', redact_pii=True)
+        self.assertIs(setup_logging(), listener)
+        logger = logging.getLogger('privacybot.test')
+        logger.debug("not written")
+        logger.info("Sent to %s", 'jane@example.com', extra={'campaign_id': 'c1', 'transport': 'null'})
+        stop_logging()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual(entry['message'], "Sent to ***@example.com")
+        self.assertEqual(entry['campaign_id'], 'c1')
+        self.assertEqual(entry['transport'], 'null')
+
+    def test_exception_redacted(self):
+        """Test that tracebacks are redacted in both formats."""
+        for fmt in ('json', 'text'):
+            stream = io.StringIO()
+            setup_logging(level='INFO', stream=stream, fmt=fmt, redact_pii=True)
+            try:
+                raise ValueError("Recipient refused: jane.doe@example.com +1 555 123 4567")
+            except ValueError:
+                logging.getLogger('privacybot.test').exception("Send to %s failed", 'jane.doe@example.com')
+            stop_logging()
+
+            output = stream.getvalue()
+            self.assertNotIn('jane.doe', output)
+            self.assertNotIn('555 123', output)
+            if fmt == 'json':
+                entry = json.loads(output)
+                self.assertEqual(entry['message'], "Send to ***@example.com failed")
+                self.assertIn("ValueError: Recipient refused: ***@example.com <phone>", entry['exception'])
+            else:
+                self.assertIn("ValueError: Recipient refused: ***@example.com <phone>", output)
+
+    def test_pii_logging_opt_in(self):
+        stream = io.StringIO()
+        setup_logging(level='INFO', stream=stream, fmt='text', redact_pii=False)
+        logging.getLogger('privacybot.test').warning("Reply from jane@example.com")
+        stop_logging()
+        self.assertIn("jane@example.com", stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for memory_watchdog module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import memory_watchdog
+import admin
+from admin import admin_authorized
+from memory_watchdog import MemoryWatchdog, get_memory_watchdog
+
+
+def leak(store, count):
+    for i in range(count):
+        store.append(bytearray(1024))
+
+
+class TestMemoryWatchdog(unittest.TestCase):
+    """Test cases for the opt-in memory watchdog."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.watchdog = MemoryWatchdog(interval=3600, growth_mb=1, output_dir=self.tmpdir)
+        self.watchdog.start(background=False)
+        self.leaked = []
+
+    def tearDown(self):
+        self.watchdog.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_reports_growing_sites(self):
+        leak(self.leaked, 200)
+        check = self.watchdog.check()
+        self.assertGreater(check['heap_growth'], 200 * 1024)
+        top = check['top'][0]
+        self.assertIn('test_memory_watchdog.py', top['site'])
+        self.assertGreaterEqual(top['size_diff'], 200 * 1024)
+        self.assertEqual(self.watchdog.alerts, [])
+
+        stats = self.watchdog.stats()
+        self.assertEqual(stats['checks'], [check])
+        self.assertGreater(stats['tracemalloc_bytes'], 0)
+        if memory_watchdog.rss_bytes() is not None:
+            self.assertGreater(stats['rss_bytes'], 0)
+
+    @patch.object(memory_watchdog, 'rss_bytes', lambda: None)
+    def test_alert_dumps_snapshot(self):
+        """Test that growth past the threshold logs the top sites and dumps the snapshot once."""
+        self.watchdog.baseline['rss_bytes'] = None
+        leak(self.leaked, 1500)
+        with self.assertLogs('memory_watchdog', 'WARNING') as logs:
+            self.watchdog.check()
+        self.assertIn('test_memory_watchdog.py', logs.output[0])
+        # The next alert needs another growth_mb on top
+        self.watchdog.check()
+        [alert] = self.watchdog.alerts
+        snapshot = tracemalloc.Snapshot.load(alert['snapshot'])
+        self.assertGreater(sum(stat.size for stat in snapshot.statistics('filename')), 1500 * 1024)
+
+    def test_stop_ends_tracing(self):
+        self.watchdog.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+        with self.assertRaises(RuntimeError):
+            self.watchdog.check()
+
+    def test_opt_in(self):
+        saved = (memory_watchdog._ENABLED, admin._ADMIN_TOKEN, memory_watchdog._watchdog)
+        try:
+            memory_watchdog._ENABLED, memory_watchdog._watchdog = False, None
+            self.assertIsNone(get_memory_watchdog())
+            memory_watchdog._ENABLED = True
+            self.assertIs(get_memory_watchdog(), get_memory_watchdog())
+
+            admin._ADMIN_TOKEN = ''
+            self.assertFalse(admin_authorized('anything'))
+            admin._ADMIN_TOKEN = 's3cret'
+            self.assertFalse(admin_authorized('wrong'))
+            self.assertFalse(admin_authorized(None))
+            self.assertTrue(admin_authorized('s3cret'))
+        finally:
+            memory_watchdog._ENABLED, admin._ADMIN_TOKEN, memory_watchdog._watchdog = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Unit tests for message_builder module.
+"""
+
+import unittest
+import io
+import os
+import sys
+from email import encoders
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from attachments import Attachment
+from email_templates import GMAIL_CONFIRMATION_TEMPLATE, REQUEST_TEMPLATE, request_fragments
+from message_builder import MessageBuilder, envelope_addresses, make_boundary
+
+
+def mime_message(headers, html, boundary, attachments=()):
+    """Build the message the way corefunctions used to, with a fixed boundary."""
+    message = MIMEMultipart()
+    for name, value in headers:
+        message[name] = value
+    message.attach(MIMEText(html, 'html'))
+    for attachment in attachments:
+        part = MIMEBase(*attachment.content_type.split('/'))
+        part.set_payload(attachment.data)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', 'attachment', filename=attachment.filename)
+        message.attach(part)
+    message.set_boundary(boundary)
+    return message
+
+
+def smtp_bytes(message):
+    """Serialize a message the way smtplib.send_message does."""
+    fp = io.BytesIO()
+    BytesGenerator(fp).flatten(message, linesep='\r\n')
+    return fp.getvalue()
+
+
+class TestMessageBuilder(unittest.TestCase):
+    """Test that MessageBuilder output matches the email.mime path byte for byte."""
+
+    headers = [('from', 'me@protonmail.com'), ('to', 'privacy@acme.com'),
+               ('subject', 'CCPA Data Deletion Request - acme'),
+               ('reply-to', 'me@protonmail.com')]
+
+    def setUp(self):
+        self.boundary = make_boundary()
+        self.html = REQUEST_TEMPLATE.format(code="<li>First Name: Jane</li><li>Last Name: Doe</li>", brands='')
+
+    def assertMatches(self, headers, html, attachments=()):
+        expected = mime_message(headers, html, self.boundary, attachments)
+        self.assertEqual(MessageBuilder().build(headers, html, self.boundary, attachments),
+                         expected.as_bytes())
+        self.assertEqual(MessageBuilder('\r\n', mangle_from=True).build(headers, html, self.boundary, attachments),
+                         smtp_bytes(expected))
+
+    def test_ascii_request(self):
+        """Test a plain ASCII broker request."""
+        self.assertMatches(self.headers, self.html)
+
+    def test_non_ascii_body(self):
+        """Test that a UTF-8 body is base64 encoded like MIMEText does."""
+        self.assertMatches(self.headers[1:], GMAIL_CONFIRMATION_TEMPLATE)
+        self.assertMatches(self.headers, self.html.replace('Jane', 'Zoë'))
+
+    def test_folded_and_encoded_headers(self):
+        """Test long and non-ASCII header values."""
+        headers = [('to', 'privacy@acme.com'),
+                   ('subject', 'CCPA Data Deletion Request - ' + 'a very long broker name ' * 4),
+                   ('reply-to', 'zoë@example.com')]
+        self.assertMatches(headers, self.html)
+
+    def test_empty_from_header(self):
+        """Test the unset from_email case."""
+        self.assertMatches([('from', '')] + self.headers[1:], self.html)
+
+    def test_from_line_mangling(self):
+        """Test that send_message's '>From ' escaping is reproduced."""
+        self.assertMatches(self.headers, "From here\nsome text\nFrom there")
+
+    def test_attachments(self):
+        """Test that shared attachment parts match MIMEBase parts for both line endings."""
+        photo = Attachment(b'\xff\xd8\xff' + bytes(range(256)) * 40, 'image/jpeg', 'photo_id.jpg')
+        self.assertMatches(self.headers, self.html, [photo])
+        self.assertMatches(self.headers, self.html.replace('Jane', 'Zoë'),
+                           [photo, Attachment(b'GIF89a', 'image/gif', 'extra.gif')])
+
+    def test_prebuilt_fragments(self):
+        """Test that pre-encoded fragments produce the same message as the whole string."""
+        builder = MessageBuilder('\r\n')
+        prefix, suffix = request_fragments()
+        fragments = [builder.fragment(prefix), '<li>First Name: Jane</li><li>Last Name: Doe</li>',
+                     builder.fragment(suffix)]
+        self.assertEqual(builder.build(self.headers, fragments, self.boundary),
+                         builder.build(self.headers, self.html, self.boundary))
+
+    def test_random_boundary(self):
+        """Test that the generated boundary is declared and used."""
+        message = MessageBuilder().build(self.headers, self.html)
+        boundary = message.split(b'boundary="')[1].split(b'"')[0]
+        self.assertIn(b'\n--' + boundary + b'--\n', message)
+
+    def test_envelope_addresses(self):
+        """Test envelope derivation from header values."""
+        self.assertEqual(envelope_addresses('Me <me@x.com>', 'a@b.com'), ('me@x.com', ['a@b.com']))
+        self.assertEqual(envelope_addresses('', 'a@b.com'), ('', ['a@b.com']))
+
+
+if __name__ == '__main__':
+    unittest.main()
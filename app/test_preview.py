@@ -0,0 +1,104 @@
+"""
+Unit tests for preview module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import preview
+from preview import CampaignPreview, body_id
+from email_templates import PII_ATTRIBUTES, render_request
+from registry_snapshot import load_registry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+USER = {'firstname': 'Jane', 'lastname': 'Doe', 'email': 'jane@example.com', 'usrchoice': 'all_services'}
+
+
+def broker(contact, category='data broker', top_choice='NO', **required):
+    submap = {'category': category, 'top_choice': top_choice, 'privacy_dept_contact_email': contact}
+    for attribute in PII_ATTRIBUTES:
+        submap[attribute] = required.get(attribute, False)
+    submap['gov_photo_id'] = required.get('gov_photo_id', False)
+    return submap
+
+
+class TestPreview(unittest.TestCase):
+    """Test cases for previewing a campaign's requests."""
+
+    def setUp(self):
+        self.services = {
+            'solo': broker('privacy@solo.com', firstname=True, dob=True),
+            'famA': broker('privacy@family.com', firstname=True),
+            'people': broker('privacy@people.com', category='people search', firstname=True, dob=True),
+            'famB': broker('privacy@family.com', top_choice='YES', lastname=True, gov_photo_id=True),
+            'nocontact': broker('', firstname=True),
+        }
+
+    def test_page_matches_sent_requests(self):
+        """Test that requests come in sending order with the bodies the campaign would send."""
+        result = CampaignPreview(USER, self.services).page()
+        self.assertEqual((result['total'], result['pages'], result['skipped']), (3, 1, ['nocontact']))
+        self.assertEqual([r['service'] for r in result['requests']], ['famA / famB', 'people', 'solo'])
+
+        family = result['requests'][0]
+        self.assertEqual(family['recipient'], 'privacy@family.com')
+        self.assertEqual(family['subject'], 'CCPA Data Deletion Request - famA / famB')
+        self.assertEqual((family['fields'], family['missing']), (['firstname', 'lastname'], ['gov_photo_id']))
+        self.assertEqual(result['bodies'][family['body_id']],
+                         render_request(USER, dict(self.services['famA'], lastname=True, gov_photo_id=True),
+                                        ['famA', 'famB']))
+
+        solo = result['requests'][2]
+        self.assertEqual((solo['fields'], solo['missing']), (['firstname'], ['dob']))
+        self.assertEqual(result['bodies'][solo['body_id']], render_request(USER, self.services['solo']))
+
+    def test_identical_bodies_shared(self):
+        """Test that brokers receiving the same details reference one body."""
+        result = CampaignPreview(USER, self.services).page()
+        people, solo = result['requests'][1:]
+        self.assertEqual(people['body_id'], solo['body_id'])
+        self.assertEqual(len(result['bodies']), 2)
+        self.assertEqual(body_id(result['bodies'][solo['body_id']]), solo['body_id'])
+
+    def test_filters_and_pages(self):
+        campaign = CampaignPreview(dict(USER, dob='1990-01-01', gov_photo_id='data:image/jpeg;base64,/9j/'),
+                                   self.services)
+        self.assertEqual([r['service'] for r in campaign.page(category='people search')['requests']], ['people'])
+        self.assertEqual([r['service'] for r in campaign.page(category='top_choice')['requests']], ['famA / famB'])
+        self.assertEqual([r['service'] for r in campaign.page(search='FAMB')['requests']], ['famA / famB'])
+        self.assertEqual([r['service'] for r in campaign.page(field='dob')['requests']], ['people', 'solo'])
+        self.assertEqual(campaign.page(field='gov_photo_id')['requests'][0]['attachments'], ['gov_photo_id'])
+
+        second = campaign.page(page=2, per_page=2)
+        self.assertEqual((second['total'], second['pages'], [r['service'] for r in second['requests']]),
+                         (3, 2, ['solo']))
+        self.assertEqual(campaign.page(page=5)['requests'], [])
+        for bad in ({'page': 0}, {'per_page': preview.MAX_PAGE_SIZE + 1}, {'field': 'ssn'}, {'page': 'x'}):
+            with self.assertRaises(ValueError):
+                campaign.page(**bad)
+
+    def test_only_requested_page_rendered(self):
+        # The snapshot is compiled next to the CSV, so load a copy outside the source tree
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        csv_file = os.path.join(tmpdir, 'test_services.csv')
+        shutil.copy(os.path.join(HERE, 'test_services.csv'), csv_file)
+        all_services = load_registry(csv_file)[0]
+        campaign = CampaignPreview(USER, all_services)
+        rendered = []
+        original = campaign.body
+        campaign.body = lambda group, submap: rendered.append(group.label) or original(group, submap)
+        result = campaign.page(per_page=1)
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(result['total'], len(campaign))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Unit tests for the bulk campaign command-line runner.
+"""
+
+import unittest
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import registry_versions
+from privacybot import ResumePoint, read_profiles, run_profile, run_stream
+
+
+def fake_campaign(line_no, text):
+    """Stand-in for run_profile: fails profiles without an email."""
+    profile = json.loads(text)
+    if 'email' not in profile:
+        return {'line': line_no, 'status': 'error', 'error': 'no email'}
+    return {'line': line_no, 'status': 'ok', 'campaign_id': f"c{line_no}", 'pid': os.getpid()}
+
+
+class TestPrivacyBotCLI(unittest.TestCase):
+    """Test cases for streaming profiles through the process pool."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_profiles_counts_non_blank_lines(self):
+        stream = io.StringIO('{"email": "a@example.com"}\n\n{"email": "b@example.com"}\n  \n{"id": 3}\n')
+        self.assertEqual([n for n, _ in read_profiles(stream)], [1, 2, 3])
+
+    def test_resume_point_from_results(self):
+        path = os.path.join(self.tmpdir, 'results.jsonl')
+        with open(path, 'w') as f:
+            for line_no in (2, 1, 3, 5):
+                f.write(json.dumps({'line': line_no, 'status': 'ok'}) + '\n')
+            f.write('{"line": 4, "sta')  # interrupted mid-write
+        point = ResumePoint.from_results(path)
+        self.assertEqual(point.watermark, 3)
+        self.assertEqual(point.above, {5})
+        with open(path) as f:
+            self.assertTrue(f.read().endswith('\n'))
+
+        stream = io.StringIO(''.join(json.dumps({'email': f"u{i}@example.com"}) + '\n' for i in range(1, 8)))
+        self.assertEqual([n for n, _ in read_profiles(stream, point)], [4, 6, 7])
+
+    def test_run_stream_writes_one_line_per_profile(self):
+        profiles = [json.dumps({'email': f"u{i}@example.com"}) if i % 4 else json.dumps({'id': i})
+                    for i in range(1, 13)]
+        output = io.StringIO()
+        counts = run_stream(read_profiles(iter(p + '\n' for p in profiles)), output,
+                            workers=2, runner=fake_campaign)
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(sorted(r['line'] for r in results), list(range(1, 13)))
+        self.assertEqual(counts, {'ok': 9, 'skipped': 0, 'error': 3})
+        self.assertNotIn(os.getpid(), {r.get('pid') for r in results})
+
+    def test_invalid_profile(self):
+        result = run_profile(7, 'not json')
+        self.assertEqual(result['line'], 7)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(run_profile(8, '{"usrchoice": "top_choice"}')['status'], 'error')
+
+    def test_delta_skips_users_without_changes(self):
+        # The snapshot is compiled next to the CSV, so load a copy outside the source tree
+        csv_file = os.path.join(self.tmpdir, 'test_services.csv')
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_services.csv'), csv_file)
+        store = registry_versions.RegistryVersions(os.path.join(self.tmpdir, 'versions.db'))
+        saved, registry_versions._versions = registry_versions._versions, store
+        try:
+            profile = json.dumps({'email': 'user@example.com', 'usrchoice': 'all_services'})
+            result = run_profile(1, profile, csv_file, delta=True)
+            self.assertEqual((result['status'], result['reason']), ('skipped', 'no previous run'))
+
+            store.record_run('user@example.com', result['registry_version'])
+            result = run_profile(2, profile, csv_file, delta=True)
+            self.assertEqual((result['status'], result['reason']), ('skipped', 'no changed brokers'))
+        finally:
+            registry_versions._versions = saved
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
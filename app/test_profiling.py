@@ -0,0 +1,75 @@
+"""
+Unit tests for profiling module.
+"""
+
+import unittest
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import admin
+import profiling
+from profiling import RequestProfile, request_profiler
+from request_context import annotate_campaign
+
+
+def busy_worker(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+
+class TestRequestProfiler(unittest.TestCase):
+    """Test cases for the opt-in request profiler."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (profiling._PROFILE_ALL, admin._ADMIN_TOKEN)
+
+    def tearDown(self):
+        profiling._PROFILE_ALL, admin._ADMIN_TOKEN = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_off_by_default(self):
+        profiling._PROFILE_ALL, admin._ADMIN_TOKEN = False, ''
+        self.assertIs(request_profiler(None), profiling._NOT_PROFILING)
+        self.assertIs(request_profiler('anything'), profiling._NOT_PROFILING)
+        # Annotating outside a profiled request is a no-op
+        annotate_campaign('abc')
+
+    def test_admin_header(self):
+        profiling._PROFILE_ALL, admin._ADMIN_TOKEN = False, 's3cret'
+        self.assertIs(request_profiler('wrong'), profiling._NOT_PROFILING)
+        self.assertIsInstance(request_profiler('s3cret'), RequestProfile)
+        profiling._PROFILE_ALL = True
+        self.assertIsInstance(request_profiler(None), RequestProfile)
+
+    def test_writes_pstats_and_collapsed_stacks(self):
+        with RequestProfile(self.tmpdir, sample_interval=0.001) as session:
+            annotate_campaign('campaign42')
+            worker = threading.Thread(target=busy_worker, args=(0.1,), name='send-worker')
+            worker.start()
+            busy_worker(0.1)
+            worker.join()
+
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['campaign42.collapsed', 'campaign42.pstats'])
+        stats = pstats.Stats(session.paths[0])
+        self.assertTrue(any(func[2] == 'busy_worker' for func in stats.stats))
+        with open(session.paths[1]) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(line.startswith('send-worker;') and 'busy_worker' in line for line in lines))
+        self.assertTrue(any(line.startswith('MainThread;') and 'busy_worker' in line for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
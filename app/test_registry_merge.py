@@ -0,0 +1,186 @@
+"""
+Unit tests for registry_merge module.
+"""
+
+import unittest
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from registry import csv_to_map
+from registry_merge import canonical_name, contact_domain, main, merge_sources
+from registry_snapshot import load_registry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+UPSTREAM = os.path.join(HERE, 'test_services.csv')
+
+
+class TestRegistryMerge(unittest.TestCase):
+    """Test cases for merging broker lists."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(UPSTREAM, newline='') as f:
+            self.header = next(csv.reader(f))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def write_csv(self, name, rows, header=None):
+        header = header or self.header
+        with open(self.path(name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow([row.get(column, '') for column in header])
+        return self.path(name)
+
+    def write_json(self, name, records, lines=False):
+        with open(self.path(name), 'w') as f:
+            if lines:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+            else:
+                json.dump({'services': records}, f)
+        return self.path(name)
+
+    def test_canonical_keys(self):
+        self.assertEqual({canonical_name(name) for name in ('acxiom', 'Acxiom, LLC', 'Acxiom.com', 'ACXIOM Inc.')},
+                         {'acxiom'})
+        self.assertEqual(canonical_name('Been Verified Co.'), 'beenverified')
+        self.assertEqual(contact_domain(' Privacy@WWW.Example.com '), 'example.com')
+        self.assertEqual(contact_domain('not an address'), '')
+
+    def test_precedence_and_conflicts(self):
+        """Test that the higher precedence source wins, fills gaps from lower ones, and reports conflicts."""
+        ours = self.write_csv('ours.csv', [
+            {'service_name_cleaned': 'db1', 'category': 'data broker', 'top_choice': 'YES',
+             'privacy_dept_contact_email': 'optout@db1.com', 'firstname': 'TRUE', 'dob': 'FALSE'},
+            {'service_name_cleaned': 'newbroker', 'category': 'people search',
+             'privacy_dept_contact_email': 'privacy@newbroker.com', 'firstname': 'TRUE'},
+        ])
+        community = self.write_json('community.json', [
+            {'name': 'DB1, Inc.', 'category': 'data broker', 'contact_email': 'optout@db1.com', 'dob': True,
+             'notes': 'from the community list'},
+            {'name': 'Newbroker.com', 'category': 'people search', 'email': True},
+            {'name': '', 'category': 'data broker'},
+        ])
+        merged = merge_sources([ours, UPSTREAM, community])
+
+        db1 = merged.lookup('db1')
+        self.assertIs(db1, merged.lookup('DB1 Inc'))
+        self.assertEqual((db1['top_choice'], db1['privacy_dept_contact_email'], db1['dob']),
+                         ('YES', 'optout@db1.com', 'FALSE'))
+        # Empty in ours, filled from the community list
+        self.assertEqual(db1['notes'], 'from the community list')
+        self.assertEqual(merged.lookup('newbroker')['email'], 'TRUE')
+
+        report = merged.report()
+        self.assertEqual(report['sources'], {'ours.csv': 2, 'test_services.csv': 5, 'community.json': 3})
+        self.assertEqual(report['brokers'], 6)
+        self.assertEqual(len(report['invalid']), 1)
+        self.assertEqual({(d['service'], d['source']) for d in report['duplicates']},
+                         {('db1', 'test_services.csv'), ('db1', 'community.json'), ('newbroker', 'community.json')})
+        contact = [c for c in report['conflicts'] if c['column'] == 'privacy_dept_contact_email']
+        self.assertEqual(contact, [{'service': 'db1', 'column': 'privacy_dept_contact_email',
+                                    'kept': 'optout@db1.com', 'kept_source': 'ours.csv',
+                                    'other': 'random@this.email.does.not.exist', 'other_source': 'test_services.csv'}])
+        self.assertIn({'service': 'db1', 'column': 'dob', 'kept': 'FALSE', 'kept_source': 'ours.csv',
+                       'other': 'TRUE', 'other_source': 'community.json'}, report['conflicts'])
+
+        # Union: a detail any source requires is required
+        union = merge_sources([ours, UPSTREAM, community], flag_policy='union')
+        self.assertEqual(union.lookup('db1')['dob'], 'TRUE')
+        self.assertEqual(union.lookup('db1')['top_choice'], 'YES')
+        with self.assertRaises(ValueError):
+            merge_sources([ours], flag_policy='intersection')
+
+    def test_flag_spellings(self):
+        """Test that yes/no, 1/0 and x flags are read as TRUE/FALSE and anything else is reported."""
+        ours = self.write_csv('ours.csv', [
+            {'service_name_cleaned': 'db1', 'firstname': 'Yes', 'dob': 'no', 'age': '0', 'email': 'maybe'}])
+        community = self.write_json('community.jsonl', [
+            {'name': 'db1', 'dob': 'x', 'age': 1, 'phone_num': 'Y', 'cc_last4': 'sometimes'}], lines=True)
+        merged = merge_sources([ours, community])
+        db1 = merged.lookup('db1')
+        self.assertEqual([db1[flag] for flag in ('firstname', 'dob', 'age', 'phone_num', 'email', 'cc_last4')],
+                         ['TRUE', 'FALSE', 'FALSE', 'TRUE', '', ''])
+        self.assertEqual({c['column']: (c['kept'], c['other']) for c in merged.report()['conflicts']},
+                         {'dob': ('FALSE', 'TRUE'), 'age': ('FALSE', 'TRUE')})
+        self.assertEqual([(i['source'], i['line'], i['reason']) for i in merged.report()['invalid']],
+                         [('ours.csv', 2, "email is not a flag: 'maybe'"),
+                          ('community.jsonl', 1, "cc_last4 is not a flag: 'sometimes'")])
+
+        union = merge_sources([ours, community], flag_policy='union').lookup('db1')
+        self.assertEqual((union['dob'], union['age']), ('TRUE', 'TRUE'))
+        # Reported values are left out, so a flag no source gave is written as FALSE
+        output = merged.write_csv(self.path('merged.csv'))
+        self.assertEqual(csv_to_map(output)[0]['db1']['email'], False)
+
+    def test_duplicates_within_source_and_domain_index(self):
+        additions = self.write_json('additions.jsonl', [
+            {'service_name_cleaned': 'famA', 'privacy_dept_contact_email': 'privacy@family.com', 'firstname': True},
+            {'service_name_cleaned': 'famB', 'privacy_dept_contact_email': 'Privacy@Family.com'},
+            {'service_name_cleaned': 'fama', 'privacy_dept_contact_email': 'privacy@fam-a.com', 'firstname': False},
+        ], lines=True)
+        merged = merge_sources([additions])
+        # The last row wins within a source, and the domain index follows the contact change
+        self.assertEqual(merged.lookup('famA')['privacy_dept_contact_email'], 'privacy@fam-a.com')
+        self.assertEqual(merged.lookup('famA')['firstname'], 'FALSE')
+        self.assertEqual(merged.report()['conflicts'], [])
+        self.assertEqual([row['service_name_cleaned'] for row in merged.at_domain('someone@family.com')], ['famB'])
+        self.assertEqual([row['service_name_cleaned'] for row in merged.at_domain('fam-a.com')], ['famA'])
+
+    def test_written_registry_loads(self):
+        """Test that the merged CSV is a registry csv_to_map and the snapshot compiler read."""
+        community = self.write_json('community.json', [
+            {'name': 'Extra Broker LLC', 'category': 'people search', 'contact_email': 'privacy@extra.com',
+             'firstname': True}])
+        output = self.path('merged.csv')
+        report = self.path('report.json')
+        self.assertEqual(main([UPSTREAM, community, '--output', output, '--report', report, '--snapshot']), 0)
+
+        all_services, top_choice, people_search = csv_to_map(output)
+        expected = csv_to_map(UPSTREAM)[0]
+        self.assertEqual(list(all_services), list(expected) + ['Extra Broker LLC'])
+        self.assertEqual(all_services['db1'], expected['db1'])
+        extra = all_services['Extra Broker LLC']
+        self.assertEqual((extra['firstname'], extra['dob'], extra['privacy_dept_contact_email']),
+                         (True, False, 'privacy@extra.com'))
+        self.assertIn('Extra Broker LLC', people_search)
+        self.assertEqual(len(load_registry(output, compile_if_stale=False)[0]), len(all_services))
+        with open(report) as f:
+            self.assertEqual(json.load(f)['brokers'], len(all_services))
+
+    def test_large_merge(self):
+        """Test that 100k rows across sources merge in one quick pass."""
+        flags = ['firstname', 'lastname', 'email', 'dob']
+        rows = [dict({'service_name_cleaned': f'broker{i}', 'category': 'data broker', 'top_choice': 'NO',
+                      'privacy_dept_contact_email': f'privacy@broker{i % 5000}.com'},
+                     **{flag: 'TRUE' if (i + n) % 3 else 'FALSE' for n, flag in enumerate(flags)})
+                 for i in range(60000)]
+        first = self.write_csv('first.csv', rows[:50000])
+        second = self.write_csv('second.csv', [dict(row, service_name_cleaned=row['service_name_cleaned'].upper() + ' Inc',
+                                                    dob='TRUE')
+                                               for row in rows[10000:]])
+        start = time.perf_counter()
+        merged = merge_sources([first, second])
+        elapsed = time.perf_counter() - start
+        self.assertEqual(sum(merged.read), 100000)
+        self.assertEqual(len(merged.rows), 60000)
+        self.assertEqual(len(merged.duplicates), 40000)
+        self.assertEqual(merged.lookup('broker59999')['dob'], 'TRUE')
+        self.assertLess(elapsed, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
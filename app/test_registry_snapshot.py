@@ -0,0 +1,86 @@
+"""
+Unit tests for registry_snapshot module.
+"""
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from registry import csv_to_map
+from registry_snapshot import (RegistrySnapshot, SnapshotError, compile_snapshot,
+                               load_registry, snapshot_path_for)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestRegistrySnapshot(unittest.TestCase):
+    """Test cases for compiling and loading registry snapshots."""
+
+    def setUp(self):
+        """Copy the CSVs into a scratch directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.csv_file = os.path.join(self.tmpdir, 'services.csv')
+        shutil.copy(os.path.join(HERE, 'services_list_06May2021.csv'), self.csv_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_snapshot_matches_csv_to_map(self):
+        """Test that snapshot maps equal the csv_to_map output."""
+        snapshot = RegistrySnapshot(compile_snapshot(self.csv_file))
+        expected = csv_to_map(self.csv_file)
+        for snap_map, csv_map in zip(snapshot.maps(), expected):
+            self.assertEqual(list(snap_map), list(csv_map))
+            self.assertEqual({k: dict(v) for k, v in snap_map.items()}, csv_map)
+
+    def test_record_values(self):
+        """Test that TRUE/FALSE cells come back as booleans."""
+        all_services, _, _ = RegistrySnapshot(compile_snapshot(self.csv_file)).maps()
+        record = all_services['180bytwo']
+        self.assertEqual(record['privacy_dept_contact_email'], 'privacy@180bytwo.com')
+        self.assertIs(record['firstname'], True)
+        self.assertIs(record['dob'], False)
+        self.assertNotIn('service_name_cleaned', record)
+
+    def test_load_registry_compiles_missing_snapshot(self):
+        """Test that load_registry writes a snapshot on first use."""
+        all_services, _, _ = load_registry(self.csv_file)
+        self.assertTrue(os.path.exists(snapshot_path_for(self.csv_file)))
+        self.assertEqual(len(all_services), 470)
+
+    def test_stale_snapshot_falls_back_to_csv(self):
+        """Test that a changed CSV is not served from the old snapshot."""
+        load_registry(self.csv_file)
+        shutil.copy(os.path.join(HERE, 'test_services.csv'), self.csv_file)
+
+        all_services, top_choice, _ = load_registry(self.csv_file, compile_if_stale=False)
+        self.assertEqual(sorted(all_services), ['db1', 'db2', 'db3', 'db4', 'db5'])
+        self.assertIsInstance(all_services, dict)
+
+        all_services, top_choice, _ = load_registry(self.csv_file)
+        self.assertEqual(sorted(top_choice), ['db2', 'db3'])
+
+    def test_touched_csv_is_still_fresh(self):
+        """Test that an mtime change alone does not invalidate the snapshot."""
+        snapshot = RegistrySnapshot(compile_snapshot(self.csv_file))
+        os.utime(self.csv_file, ns=(0, 0))
+        self.assertTrue(snapshot.is_fresh(self.csv_file))
+
+    def test_corrupt_snapshot(self):
+        """Test that a truncated snapshot is rejected."""
+        path = compile_snapshot(self.csv_file)
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+        with self.assertRaises(SnapshotError):
+            RegistrySnapshot(path)
+        all_services, _, _ = load_registry(self.csv_file)
+        self.assertEqual(len(all_services), 470)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Unit tests for registry_versions module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from registry_versions import RegistryVersions, changed_services, diff_rows
+
+HEADER = "service_name_cleaned,category,top_choice,privacy_dept_contact_email,firstname,lastname,email,dob,notes\n"
+
+
+def write_registry(path, rows):
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+
+class TestRegistryVersions(unittest.TestCase):
+    """Test cases for content-hashed registry versions and delta campaigns."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = RegistryVersions(os.path.join(self.tmpdir, 'versions.db'))
+        self.old_csv = os.path.join(self.tmpdir, 'old.csv')
+        self.new_csv = os.path.join(self.tmpdir, 'new.csv')
+        write_registry(self.old_csv, [
+            ('acme', 'people search', 'YES', 'privacy@acme.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', ''),
+            ('bravo', 'data broker', 'NO', 'privacy@bravo.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', ''),
+            ('charlie', 'data broker', 'NO', 'optout@charlie.example', 'TRUE', 'FALSE', 'TRUE', 'FALSE', ''),
+            ('delta', 'data broker', 'NO', 'privacy@delta.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', ''),
+        ])
+        write_registry(self.new_csv, [
+            ('acme', 'people search', 'YES', 'privacy@acme.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', 'note only'),
+            ('bravo', 'data broker', 'NO', 'dsar@bravo.example', 'TRUE', 'TRUE', 'TRUE', 'TRUE', ''),
+            ('charlie', 'data broker', 'NO', 'OPTOUT@charlie.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', ''),
+            ('echo', 'people search', 'NO', 'privacy@echo.example', 'TRUE', 'TRUE', 'TRUE', 'FALSE', ''),
+        ])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_versions_are_content_hashed(self):
+        old = self.store.record_version(self.old_csv)
+        copy = os.path.join(self.tmpdir, 'copy.csv')
+        shutil.copy(self.old_csv, copy)
+        self.assertEqual(self.store.record_version(copy), old)
+        new = self.store.record_version(self.new_csv)
+        self.assertNotEqual(old, new)
+        self.assertEqual([v['version'] for v in self.store.versions()], [old, new])
+        self.assertEqual(self.store.resolve(new[:10]), new)
+        self.assertEqual(sorted(self.store.rows(old)), ['acme', 'bravo', 'charlie', 'delta'])
+        with self.assertRaises(KeyError):
+            self.store.resolve('ffffffffffffffff0')
+
+    def test_diff(self):
+        old = self.store.record_version(self.old_csv)
+        new = self.store.record_version(self.new_csv)
+        self.assertEqual(self.store.diff(old, new), {
+            'added': ['echo'],
+            'removed': ['delta'],
+            'contact_changed': ['bravo'],
+            'requirements_changed': ['bravo', 'charlie'],
+        })
+        self.assertEqual(changed_services(self.store.diff(old, new)), {'bravo', 'charlie', 'echo'})
+        self.assertEqual(self.store.diff(new, new), diff_rows({}, {}))
+
+        # A broker that starts wanting the photo ID attached has changed requirements too
+        row = {'privacy_dept_contact_email': 'privacy@acme.example', 'firstname': True, 'gov_photo_id': False}
+        self.assertEqual(diff_rows({'acme': row}, {'acme': dict(row, gov_photo_id=True)})['requirements_changed'],
+                         ['acme'])
+
+    def test_delta_services(self):
+        old = self.store.record_version(self.old_csv)
+        new = self.store.record_version(self.new_csv)
+        services = self.store.rows(new)
+        self.assertIsNone(self.store.delta_services('user@example.com', services, new))
+
+        self.store.record_run('User@Example.com', old, 'all_services', 'c1')
+        delta = self.store.delta_services('user@example.com', services, new)
+        self.assertEqual(sorted(delta), ['bravo', 'charlie', 'echo'])
+        self.assertEqual(delta['bravo']['privacy_dept_contact_email'], 'dsar@bravo.example')
+
+        self.store.record_run('user@example.com', new, 'all_services', 'c2')
+        self.assertEqual(self.store.delta_services('user@example.com', services, new), {})
+        self.assertEqual(self.store.last_run('user@example.com')['campaign_id'], 'c2')
+
+    def test_failed_brokers_stay_pending(self):
+        """Test that brokers a run could not send to are retried by later delta campaigns."""
+        old = self.store.record_version(self.old_csv)
+        new = self.store.record_version(self.new_csv)
+        old_services, services = self.store.rows(old), self.store.rows(new)
+
+        self.store.record_run('user@example.com', old, 'all_services', 'c1',
+                              attempted=old_services, failed=['acme', 'delta'])
+        self.assertEqual(self.store.pending('USER@example.com'), {'acme', 'delta'})
+        # delta is no longer in the registry, so only acme is added to the changed brokers
+        self.assertEqual(sorted(self.store.delta_services('user@example.com', services, new)),
+                         ['acme', 'bravo', 'charlie', 'echo'])
+
+        self.store.record_run('user@example.com', new, 'all_services', 'c2',
+                              attempted=['acme', 'bravo'], failed=['bravo'])
+        self.assertEqual(self.store.pending('user@example.com'), {'bravo', 'delta'})
+        self.assertEqual(sorted(self.store.delta_services('user@example.com', services, new)), ['bravo'])
+        self.store.record_run('user@example.com', new, attempted=['bravo'])
+        self.assertEqual(self.store.delta_services('user@example.com', services, new), {})
+
+    def test_deferred_brokers_pending_until_sent(self):
+        """Test that brokers left for the scheduler stay pending until their request is sent."""
+        new = self.store.record_version(self.new_csv)
+        services = self.store.rows(new)
+        self.store.record_run('user@example.com', new, 'all_services', 'c1',
+                              attempted=services, failed=['acme'], deferred=['bravo', 'charlie'])
+        self.assertEqual(self.store.pending('user@example.com'), {'acme', 'bravo', 'charlie'})
+
+        # The scheduler sends bravo's request a day later
+        self.store.clear_pending('User@Example.com', ['bravo'])
+        self.assertEqual(sorted(self.store.delta_services('user@example.com', services, new)), ['acme', 'charlie'])
+
+
+if __name__ == '__main__':
+    unittest.main()
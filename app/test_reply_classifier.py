@@ -0,0 +1,152 @@
+"""
+Unit tests for reply_classifier module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from reply_classifier import (ReplyClassifier, classify_pending, default_classifier,
+                              extract_form_urls, extract_requested_fields, reply_text)
+from reply_index import ReplyIndex
+
+
+FORM_REPLY = ("Thanks for reaching out. We are unable to process requests sent by email; please fill out "
+              "our Consumer Privacy Request form at https://www.broker.com/privacy/request-form.")
+CONFIRMATION_REPLY = ("Your deletion request has been completed. We have removed your records and "
+                      "you will no longer appear on our site.")
+INFO_REPLY = ("We could not locate a record matching your details. Please provide your date of birth, "
+              "your previous home address and your phone number so we can verify your identity.")
+
+# Broker replies carry a confidentiality footer and the quoted request; about 6 KB in all
+FOOTER = ("This message and any attachments are confidential and intended solely for the addressee. "
+          "Our Privacy Policy describes the categories of personal information we collect, the sources "
+          "from which it is collected, the business purposes for which it is used and the third parties "
+          "with whom it is shared. California residents may exercise their rights under applicable law. ") * 14
+QUOTED_REQUEST = ("\n> On Monday, Jane Doe wrote:\n> To whom it may concern, I am writing to request that "
+                  "you delete all personal information you hold about me under the California Consumer "
+                  "Privacy Act.\n")
+
+
+def reply_sized(body):
+    return f"{body}\n\n{FOOTER}{QUOTED_REQUEST}"
+
+
+class TestReplyClassifier(unittest.TestCase):
+    """Test cases for the default classifier and extractors."""
+
+    def test_labels(self):
+        results = default_classifier().classify_batch([
+            ('Re: CCPA Data Deletion Request', FORM_REPLY),
+            ('Re: CCPA Data Deletion Request', CONFIRMATION_REPLY),
+            ('Re: CCPA Data Deletion Request', INFO_REPLY),
+        ])
+        self.assertEqual([r['label'] for r in results], ['form', 'confirmation', 'info_request'])
+        for result in results:
+            self.assertGreater(result['confidence'], 1 / 3)
+
+    def test_extracts_form_urls(self):
+        text = reply_text('', FORM_REPLY + " Visit https://www.broker.com/about for more.")
+        self.assertEqual(extract_form_urls(text), ['https://www.broker.com/privacy/request-form'])
+
+    def test_extracts_requested_fields(self):
+        fields = extract_requested_fields(reply_text('', INFO_REPLY))
+        self.assertEqual(fields, ['full_address', 'dob', 'phone_num'])
+
+    def test_quoted_request_ignored(self):
+        """Test that the details in our own quoted request are not read as details the broker asks for."""
+        request = "My details are:\nDate of birth: 01/01/1990\nPhone Number: 555-0100\nAddress: 1 Main St"
+        quoted = "\n".join("> " + line for line in request.split("\n"))
+        bodies = [
+            f"{CONFIRMATION_REPLY}\n\n{quoted}",
+            f"{CONFIRMATION_REPLY}\n\nOn Mon, Oct 19, 2026 at 10:00 AM Jane Doe <jane@example.com>\nwrote:\n\n{request}",
+            f"{CONFIRMATION_REPLY}\n\n-----Original Message-----\nFrom: Jane Doe\n{request}",
+            f"{CONFIRMATION_REPLY}\n\nFrom: Jane Doe <jane@example.com>\nSent: Monday\n\n{request}",
+            f"<p>{CONFIRMATION_REPLY}</p><blockquote>{request}</blockquote>",
+        ]
+        for result in default_classifier().classify_batch(('Re: request', body) for body in bodies):
+            self.assertEqual((result['label'], result['requested_fields']), ('confirmation', []))
+        self.assertEqual(extract_requested_fields(reply_text('', f"{INFO_REPLY}\n{quoted}")),
+                         ['full_address', 'dob', 'phone_num'])
+
+    def test_other_label(self):
+        """Test that replies matching none of the response types are labelled other."""
+        results = default_classifier().classify_batch([
+            ('Automatic reply', "I am out of the office until Monday with limited access to email."),
+            ('Re: request', FOOTER),
+            ('Re: request', reply_sized(FORM_REPLY)),
+        ])
+        # A weak score still counts when the reply has a cue phrase
+        self.assertEqual([r['label'] for r in results], ['other', 'other', 'form'])
+
+    def test_html_body(self):
+        result = default_classifier().classify_batch([('', f"<p><b>{CONFIRMATION_REPLY}</b></p>")])[0]
+        self.assertEqual(result['label'], 'confirmation')
+
+    def test_retrain_and_save(self):
+        model = ReplyClassifier(labels=('spam', 'ham')).fit(
+            ['win a free prize now', 'free money prize', 'meeting notes attached', 'notes from the meeting'],
+            ['spam', 'spam', 'ham', 'ham'])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'model.json')
+            model.save(path)
+            loaded = ReplyClassifier.load(path)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([r['label'] for r in loaded.classify_batch([('', 'a free prize'), ('', 'meeting')])],
+                         ['spam', 'ham'])
+
+    def test_batch_throughput(self):
+        """Test that a batch of reply-sized bodies classifies at over a thousand replies per second."""
+        bodies = [reply_sized(body) for body in (FORM_REPLY, CONFIRMATION_REPLY, INFO_REPLY)]
+        self.assertGreater(min(len(body) for body in bodies), 5000)
+        replies = [('Re: request', body) for body in bodies] * 400
+        model = default_classifier()
+        start = time.perf_counter()
+        results = model.classify_batch(replies)
+        self.assertLess(time.perf_counter() - start, 1.2)
+        self.assertEqual(results[0]['form_urls'], ['https://www.broker.com/privacy/request-form'])
+        self.assertEqual(results[2]['requested_fields'], ['full_address', 'dob', 'phone_num'])
+
+
+class TestClassifyPending(unittest.TestCase):
+    """Test cases for labelling replies stored in the reply index."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = ReplyIndex(os.path.join(self.tmpdir, 'replies.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_classify_pending(self):
+        self.index.record_sent('<req1@me.com>', 'broker1', 'privacy@broker1.com', campaign_id='c1')
+        self.index.record_sent('<req2@me.com>', 'broker2', 'privacy@broker2.com', campaign_id='c1')
+        self.index.add_reply('imap:INBOX', '1:1', request_message_id='<req1@me.com>', service='broker1',
+                             subject='Re: request', body=FORM_REPLY)
+        self.index.add_reply('imap:INBOX', '1:2', request_message_id='<req2@me.com>', service='broker2',
+                             subject='Re: request', body=INFO_REPLY)
+        self.index.add_reply('imap:INBOX', '1:3', subject='Unrelated', body=CONFIRMATION_REPLY)
+        self.index.record_sent('<req3@me.com>', 'broker3', 'privacy@broker3.com', campaign_id='c1')
+        self.index.add_reply('imap:INBOX', '1:4', request_message_id='<req3@me.com>', service='broker3',
+                             subject='Automatic reply', body="I am out of the office until Monday.")
+
+        self.assertEqual(classify_pending(self.index, batch_size=2), 4)
+        self.assertEqual(classify_pending(self.index), 0)
+        self.assertEqual(self.index.request_statuses('c1'),
+                         {'broker1': 'form_required', 'broker2': 'info_requested', 'broker3': 'replied'})
+        replies = self.index.replies()
+        self.assertEqual(replies[0]['form_urls'], ['https://www.broker.com/privacy/request-form'])
+        self.assertEqual(replies[1]['requested_fields'], ['full_address', 'dob', 'phone_num'])
+        self.assertEqual(replies[2]['category'], 'confirmation')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Unit tests for request_context module.
+"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import request_context
+from profiling import RequestProfile
+from request_context import annotate_campaign, output_name
+from tracing import CampaignTrace
+
+
+class TestRequestContext(unittest.TestCase):
+    """Test cases for the diagnostics context shared by profiling and tracing."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_annotate_names_profile_and_trace(self):
+        with RequestProfile(self.tmpdir) as profile, CampaignTrace(self.tmpdir) as trace:
+            self.assertIs(request_context.current('profile'), profile)
+            self.assertIs(request_context.current('trace'), trace)
+            annotate_campaign('campaign9')
+        self.assertIsNone(request_context.current('profile'))
+        self.assertIsNone(request_context.current('trace'))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['campaign9.collapsed', 'campaign9.pstats', 'campaign9.trace.json'])
+
+    def test_unnamed_requests_do_not_collide(self):
+        """Test that requests without a campaign ID started in the same second get their own files."""
+        self.assertNotEqual(output_name(None, 0), output_name(None, 0))
+        self.assertEqual(output_name('campaign9', 0), 'campaign9')
+        for _ in range(2):
+            with CampaignTrace(self.tmpdir):
+                pass
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
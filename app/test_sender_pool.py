@@ -0,0 +1,193 @@
+"""
+Unit tests for sender_pool and dispatcher modules.
+"""
+
+import unittest
+import os
+import sys
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dispatcher import OutgoingMessage, dispatch
+from sender_pool import SenderAccount, SenderPool
+from transports import SMTPTransport, create_transport
+
+
+class FakeTransport:
+    """Records sends instead of delivering them."""
+
+    linesep = '\r\n'
+    mangle_from = True
+    sets_from_header = True
+
+    def __init__(self, settings, delay=0, fail_for=()):
+        self.from_email = settings.get('from_email')
+        self.settings = settings
+        self.delay = delay
+        self.fail_for = fail_for
+        self.sent = []
+        self.opened = False
+        self.closed = False
+
+    def open(self):
+        self.opened = True
+
+    def send(self, from_addr, to_addrs, message):
+        if self.delay:
+            time.sleep(self.delay)
+        if to_addrs[0] in self.fail_for:
+            raise RuntimeError("rejected")
+        self.sent.append((from_addr, to_addrs, message))
+
+    def close(self):
+        self.closed = True
+
+
+def make_messages(count, to='privacy@broker.com'):
+    return [OutgoingMessage(f"broker{i}", to, f"CCPA Data Deletion Request - broker{i}",
+                            'user@example.com', '<html>hi</html>') for i in range(count)]
+
+
+class TestSenderPool(unittest.TestCase):
+    """Test cases for SenderPool accounting."""
+
+    def make_pool(self, quotas, concurrency=1, **transport_kwargs):
+        self.transports = []
+
+        def factory(settings):
+            transport = FakeTransport(settings, **transport_kwargs)
+            self.transports.append(transport)
+            return transport
+
+        return SenderPool([SenderAccount(f"acct{i}", {'from_email': f"acct{i}@example.com"},
+                                         daily_quota=q, max_concurrency=concurrency,
+                                         transport_factory=factory)
+                           for i, q in enumerate(quotas)])
+
+    def test_requires_accounts(self):
+        """Test that an empty pool is rejected."""
+        with self.assertRaises(ValueError):
+            SenderPool([])
+
+    def test_spreads_across_accounts(self):
+        """Test that messages are balanced by quota utilization."""
+        pool = self.make_pool([10, 10])
+        sent, notsent = dispatch(pool, make_messages(10))
+        self.assertEqual(len(sent), 10)
+        self.assertEqual(notsent, [])
+        self.assertEqual([a['sent'] for a in pool.usage()], [5, 5])
+
+    def test_quota_exhaustion(self):
+        """Test that messages beyond the combined quota are reported as not sent."""
+        pool = self.make_pool([2, 3])
+        sent, notsent = dispatch(pool, make_messages(7))
+        self.assertEqual(len(sent), 5)
+        self.assertEqual(len(notsent), 2)
+        self.assertEqual(pool.remaining_quota(), 0)
+        self.assertIsNone(pool.acquire())
+
+    def test_transport_reuse(self):
+        """Test that a healthy transport is reused for the next message."""
+        pool = self.make_pool([10])
+        dispatch(pool, make_messages(4))
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(len(self.transports[0].sent), 4)
+
+    def test_failed_send_closes_transport(self):
+        """Test that failures are counted and the transport is discarded."""
+        pool = self.make_pool([10], fail_for=('bad@broker.com',))
+        sent, notsent = dispatch(pool, make_messages(1, to='bad@broker.com') + make_messages(1))
+        self.assertEqual(notsent, ['broker0'])
+        self.assertEqual(sent, ['broker0'])
+        self.assertTrue(self.transports[0].closed)
+        self.assertEqual(pool.usage()[0]['failed'], 1)
+
+    def test_concurrency_limit(self):
+        """Test that no account exceeds its max_concurrency."""
+        pool = self.make_pool([100, 100], concurrency=2, delay=0.01)
+        peak = []
+        original = pool._release
+
+        def release(lease, sent):
+            peak.append(max(a.in_flight for a in pool.accounts))
+            original(lease, sent)
+
+        pool._release = release
+        sent, _ = dispatch(pool, make_messages(20))
+        self.assertEqual(len(sent), 20)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_from_header_and_envelope(self):
+        """Test that the account's from_email is used for the message and envelope."""
+        pool = self.make_pool([1])
+        dispatch(pool, make_messages(1))
+        from_addr, to_addrs, data = self.transports[0].sent[0]
+        self.assertEqual(from_addr, 'acct0@example.com')
+        self.assertEqual(to_addrs, ['privacy@broker.com'])
+        self.assertIn(b'\r\nfrom: acct0@example.com\r\n', data)
+        self.assertIn(b'\r\nreply-to: user@example.com\r\n', data)
+
+    def test_from_config(self):
+        """Test building a pool from EmailConfig sender_accounts entries."""
+        pool = SenderPool.from_config([
+            {'name': 'proton', 'provider': 'smtp', 'daily_quota': 50, 'max_concurrency': 3,
+             'smtp_settings': {'smtp_server': 'localhost', 'smtp_port': 1025}},
+            {'provider': 'gmail_api', 'token_file': 'token_b.pickle'}])
+        self.assertEqual([a.name for a in pool.accounts], ['proton', 'account-2'])
+        self.assertEqual(pool.max_concurrency(), 4)
+        self.assertIsInstance(create_transport(pool.accounts[0].settings), SMTPTransport)
+        with self.assertRaises(ValueError):
+            create_transport({'provider': 'carrier-pigeon'})
+
+    def test_reconfigure_keeps_unchanged_sessions(self):
+        """Test that a config change only reconnects the accounts whose settings changed."""
+        transports = []
+
+        def factory(settings):
+            transports.append(FakeTransport(settings))
+            return transports[-1]
+
+        configs = [{'name': 'a', 'daily_quota': 10, 'smtp_settings': {'smtp_password': 'one'}},
+                   {'name': 'b', 'daily_quota': 10, 'smtp_settings': {'smtp_password': 'two'}}]
+        pool = SenderPool.from_config(configs, transport_factory=factory)
+        dispatch(pool, make_messages(4))
+        old_a, old_b = transports
+        account_a = pool.accounts[0]
+
+        # Lease a's transport so it is in flight during the change
+        lease = pool.acquire()
+        self.assertIs(lease.transport, old_a)
+        pool.reconfigure([
+            {'name': 'a', 'daily_quota': 20, 'smtp_settings': {'smtp_password': 'one'}},
+            {'name': 'b', 'daily_quota': 10, 'smtp_settings': {'smtp_password': 'changed'}},
+            {'name': 'c', 'daily_quota': 5}])
+        self.assertIs(pool.accounts[0], account_a)
+        self.assertEqual(account_a.daily_quota, 20)
+        self.assertEqual([a.name for a in pool.accounts], ['a', 'b', 'c'])
+        self.assertTrue(old_b.closed)
+        lease.release(True)
+        self.assertFalse(old_a.closed)
+        self.assertEqual(account_a._idle_transports, [old_a])
+
+        sent_before = len(old_a.sent)
+        dispatch(pool, make_messages(6))
+        self.assertGreater(len(old_a.sent), sent_before)
+        self.assertEqual(len(transports), 4)
+        new_b = [t for t in transports[2:] if t.settings['name'] == 'b']
+        self.assertEqual(new_b[0].settings['smtp_settings']['smtp_password'], 'changed')
+        self.assertEqual(sum(a['sent'] for a in pool.usage()), 11)
+
+    def test_warm_up(self):
+        """Test that warm_up connects idle accounts once and the first send reuses the connection."""
+        pool = self.make_pool([10, 0, 10])
+        self.assertEqual(pool.warm_up(), 2)
+        self.assertTrue(all(t.opened for t in self.transports))
+        self.assertEqual(pool.warm_up(), 0)
+        dispatch(pool, make_messages(2))
+        self.assertEqual(len(self.transports), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Unit tests for static_assets module.
+"""
+
+import unittest
+import email.utils
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+from wsgiref.util import setup_testing_defaults
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from static_assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets, precompress
+
+SCRIPT = b"function hello(){return 'privacy';}\n" * 200
+
+
+def api(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'{"api": true}']
+
+
+class TestStaticAssets(unittest.TestCase):
+    """Test cases for serving the React build."""
+
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.build_dir, 'static', 'js'))
+        self.write('index.html', b'<html><script src="/static/js/main.134abbdc.chunk.js"></script></html>')
+        self.write('static/js/main.134abbdc.chunk.js', SCRIPT)
+        self.write('logo192.png', b'\x89PNG' + bytes(2000))
+        self.assets = StaticAssets(api, self.build_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.build_dir, name), 'wb') as f:
+            f.write(data)
+
+    def get(self, path, method='GET', **headers):
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': method}
+        environ.update(('HTTP_' + name.upper(), value) for name, value in headers.items())
+        setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, response_headers):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(response_headers)
+
+        response['body'] = b''.join(self.assets(environ, start_response))
+        return response
+
+    def test_cache_headers(self):
+        """Test that content-hashed files are immutable and everything else is revalidated."""
+        script = self.get('/static/js/main.134abbdc.chunk.js')
+        self.assertEqual(script['status'], 200)
+        self.assertEqual(script['body'], SCRIPT)
+        self.assertEqual(script['headers']['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(script['headers']['Content-Length'], str(len(SCRIPT)))
+        self.assertTrue(script['headers']['Content-Type'].endswith('javascript; charset=utf-8'))
+
+        index = self.get('/')
+        self.assertIn(b'main.134abbdc', index['body'])
+        self.assertEqual(index['headers']['Cache-Control'], REVALIDATE_CACHE_CONTROL)
+        self.assertEqual(self.get('/logo192.png')['headers']['Cache-Control'], REVALIDATE_CACHE_CONTROL)
+
+    def test_precompressed_variants(self):
+        """Test that the precompressed copy the client accepts is sent."""
+        self.assertEqual(precompress(self.build_dir), 1)
+        self.assertEqual(precompress(self.build_dir), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.build_dir, 'logo192.png.gz')))
+        self.assets.refresh()
+
+        compressed = self.get('/static/js/main.134abbdc.chunk.js', accept_encoding='br;q=1, gzip;q=0.8')
+        self.assertEqual(compressed['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(compressed['body']), SCRIPT)
+        self.assertLess(len(compressed['body']), len(SCRIPT))
+
+        plain = self.get('/static/js/main.134abbdc.chunk.js', accept_encoding='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', plain['headers'])
+        self.assertEqual(plain['body'], SCRIPT)
+        self.assertNotEqual(plain['headers']['ETag'], compressed['headers']['ETag'])
+
+        # A copy older than its file (a rebuild without precompressing) is ignored
+        os.utime(os.path.join(self.build_dir, 'static/js/main.134abbdc.chunk.js.gz'), (0, 0))
+        self.assets.refresh()
+        self.assertNotIn('Content-Encoding', self.get('/static/js/main.134abbdc.chunk.js',
+                                                      accept_encoding='gzip')['headers'])
+
+    def test_conditional_requests(self):
+        """Test that unchanged files are answered with 304 Not Modified."""
+        first = self.get('/')
+        etag, last_modified = first['headers']['ETag'], first['headers']['Last-Modified']
+        revalidated = self.get('/', if_none_match=f'"other", W/{etag}')
+        self.assertEqual((revalidated['status'], revalidated['body']), (304, b''))
+        self.assertEqual(revalidated['headers']['ETag'], etag)
+        self.assertEqual(self.get('/', if_modified_since=last_modified)['status'], 304)
+        # If-None-Match wins over If-Modified-Since
+        self.assertEqual(self.get('/', if_none_match='"stale"', if_modified_since=last_modified)['status'], 200)
+        earlier = email.utils.formatdate(0, usegmt=True)
+        self.assertEqual(self.get('/', if_modified_since=earlier)['status'], 200)
+
+    def test_routes(self):
+        """Test HEAD, client-side routes, and requests passed through to the API."""
+        head = self.get('/static/js/main.134abbdc.chunk.js', method='HEAD')
+        self.assertEqual((head['status'], head['body']), (200, b''))
+        self.assertEqual(head['headers']['Content-Length'], str(len(SCRIPT)))
+
+        self.assertIn(b'main.134abbdc', self.get('/inputform', accept='text/html,*/*')['body'])
+        self.assertEqual(self.get('/privacyAPI/v1/', method='POST')['body'], b'{"api": true}')
+        self.assertEqual(self.get('/privacyAPI/v1/', accept='application/json')['body'], b'{"api": true}')
+        self.assertEqual(self.get('/missing.js', accept='text/html')['body'], b'{"api": true}')
+        # A browser visiting a server route gets the route, not the UI
+        browser = 'text/html,application/xhtml+xml,*/*;q=0.8'
+        self.assertEqual(self.get('/admin/memory', accept=browser)['body'], b'{"api": true}')
+        self.assertEqual(self.get('/privacyAPI/v1/preview', accept=browser)['body'], b'{"api": true}')
+
+        # No build yet: everything goes to the API
+        missing = StaticAssets(api, os.path.join(self.build_dir, 'nonexistent'))
+        self.assertEqual(missing.assets, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Unit tests for tracing module.
+"""
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tracing
+from dispatcher import OutgoingMessage, dispatch
+from sender_pool import SenderAccount, SenderPool
+from request_context import annotate_campaign
+from tracing import CampaignTrace, campaign_trace, instant, span
+from transports import NullTransport
+
+
+class TestCampaignTrace(unittest.TestCase):
+    """Test cases for the per-campaign span timeline."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = tracing._TRACE_ALL
+
+    def tearDown(self):
+        tracing._TRACE_ALL = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_off_by_default(self):
+        tracing._TRACE_ALL = False
+        self.assertIs(campaign_trace(), tracing._NO_SPAN)
+        self.assertIs(span('render'), tracing._NO_SPAN)
+        instant('scheduler.defer')
+        annotate_campaign('abc')
+        tracing._TRACE_ALL = True
+        self.assertIsInstance(campaign_trace(), CampaignTrace)
+
+    def test_spans_from_send_workers(self):
+        pool = SenderPool([SenderAccount(f"acct{i}", {'provider': 'null'}, max_concurrency=2,
+                                         transport_factory=NullTransport) for i in range(2)])
+        messages = [OutgoingMessage(f"broker{i}", f"privacy@broker{i}.example", "CCPA Data Deletion Request",
+                                    'user@example.com', 'body') for i in range(6)]
+        with CampaignTrace(self.tmpdir) as trace:
+            annotate_campaign('campaign7')
+            with span('render', broker='broker0'):
+                pass
+            dispatch(pool, messages)
+            instant('scheduler.defer', messages=0)
+        self.assertIsNone(tracing.current_trace())
+
+        path = os.path.join(self.tmpdir, 'campaign7.trace.json')
+        self.assertEqual(trace.path, path)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(data['otherData']['campaign_id'], 'campaign7')
+        events = data['traceEvents']
+        names = [e['name'] for e in events if e['ph'] == 'X']
+        self.assertEqual(names.count('send'), 6)
+        self.assertEqual(names.count('pool.acquire'), 6)
+        self.assertEqual(names.count('build'), 6)
+        self.assertIn('request', names)
+        self.assertEqual([e['name'] for e in events if e['ph'] == 'i'], ['scheduler.defer'])
+
+        # Worker spans sit on their own threads, each named by a metadata event
+        request = next(e for e in events if e['name'] == 'request')
+        worker_tids = {e['tid'] for e in events if e['name'] == 'send'}
+        self.assertNotIn(request['tid'], worker_tids)
+        named = {e['tid'] for e in events if e['name'] == 'thread_name'}
+        self.assertTrue(worker_tids <= named)
+        for e in events:
+            if e['ph'] == 'X' and e['name'] == 'send':
+                self.assertGreaterEqual(e['ts'], request['ts'])
+                self.assertLessEqual(e['ts'] + e['dur'], request['ts'] + request['dur'] + 1)
+
+    def test_span_records_error(self):
+        trace = CampaignTrace(self.tmpdir)
+        with self.assertRaises(ValueError):
+            with trace.span('smtp.auth'):
+                raise ValueError("bad login")
+        self.assertEqual(trace.events[0]['args'], {'error': 'ValueError'})
+
+
+if __name__ == '__main__':
+    unittest.main()
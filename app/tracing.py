@@ -0,0 +1,190 @@
+"""
+Opt-in span tracing of single campaigns, exported as Chrome trace events.
+
+With PRIVACYBOT_TRACE=1 every privacyAPI request records a timeline of named
+spans (registry load, rendering each request, acquiring a sender slot, SMTP
+connect/STARTTLS/AUTH/DATA, Gmail send/modify, reconnects and deferrals) on
+each thread that works on it. When the request ends the timeline is written to
+PRIVACYBOT_TRACE_DIR (default: traces/) as <campaign>.trace.json, which can be
+opened in Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+Spans attach to the trace active on the current thread (see
+request_context.py). Worker threads join a request's trace with attach();
+with tracing off, span() returns a shared no-op context manager.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+import request_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACE_DIR = 'traces'
+
+_TRACE_ALL = os.environ.get('PRIVACYBOT_TRACE', '').lower() in ('1', 'true', 'yes')
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    """Records one complete ('X') event when it exits."""
+
+    __slots__ = ('trace', 'name', 'args', 'start')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.add_event('X', self.name, self.start, end - self.start, self.args)
+        return False
+
+
+class CampaignTrace:
+    """Context manager collecting the span timeline of one request."""
+
+    def __init__(self, output_dir=None):
+        """
+        Args:
+            output_dir: Directory for the trace file (default: PRIVACYBOT_TRACE_DIR)
+        """
+        self.output_dir = output_dir or os.environ.get('PRIVACYBOT_TRACE_DIR', DEFAULT_TRACE_DIR)
+        self.campaign_id = None
+        self.events = []
+        self.path = None
+        self.started = time.time()
+        self._pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def add_event(self, phase, name, start, duration=None, args=None):
+        """
+        Append one trace event.
+
+        Args:
+            phase: Chrome trace phase ('X' complete span, 'i' instant)
+            name: Event name
+            start: time.perf_counter() at the start of the event
+            duration: Seconds, for complete spans
+            args: Dict shown with the event in the viewer
+        """
+        thread = threading.current_thread()
+        event = {'name': name, 'ph': phase, 'pid': self._pid, 'tid': thread.ident,
+                 'ts': round((start - self._origin) * 1e6, 1)}
+        if duration is not None:
+            event['dur'] = round(duration * 1e6, 1)
+        if phase == 'i':
+            event['s'] = 't'
+        if args:
+            event['args'] = args
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    def span(self, name, **args):
+        """Return a context manager recording a span on the current thread."""
+        return _Span(self, name, args)
+
+    def __enter__(self):
+        self._previous = request_context.activate('trace', self)
+        self._span = self.span('request')
+        self._span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.__exit__(exc_type, exc, tb)
+        request_context.activate('trace', self._previous)
+        try:
+            self.write()
+        except OSError as e:
+            logger.warning(f"Could not write campaign trace: {e}")
+        return False
+
+    def to_dict(self):
+        """Return the trace in Chrome trace-event JSON object format."""
+        with self._lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': ident,
+                         'args': {'name': name}} for ident, name in self._threads.items()]
+            events = list(self.events)
+        metadata.append({'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'tid': 0,
+                         'args': {'name': f"privacybot {self.campaign_id or ''}".strip()}})
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                'otherData': {'campaign_id': self.campaign_id}}
+
+    def write(self):
+        """Write <campaign>.trace.json; returns its path."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = request_context.output_name(self.campaign_id, self.started)
+        self.path = os.path.join(self.output_dir, name + '.trace.json')
+        with open(self.path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        logger.info(f"Campaign trace written to {self.path}")
+        return self.path
+
+
+def campaign_trace():
+    """
+    Return the context manager to run a request under.
+
+    Returns:
+        CampaignTrace if PRIVACYBOT_TRACE is set, else a no-op context
+    """
+    if _TRACE_ALL:
+        return CampaignTrace()
+    return _NO_SPAN
+
+
+def current_trace():
+    """Return the trace active on this thread, or None."""
+    return request_context.current('trace')
+
+
+@contextlib.contextmanager
+def attach(trace):
+    """
+    Make trace the active trace on this thread (e.g. a send worker) for the block.
+
+    Args:
+        trace: CampaignTrace from current_trace() on the submitting thread, or None
+    """
+    previous = request_context.activate('trace', trace)
+    try:
+        yield trace
+    finally:
+        request_context.activate('trace', previous)
+
+
+def span(name, **args):
+    """
+    Record a span on the active trace (no-op if none).
+
+    Args:
+        name: Span name, e.g. 'smtp.auth'
+        **args: Details shown with the span (broker, account, ...)
+    """
+    trace = request_context.current('trace')
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, args)
+
+
+def instant(name, **args):
+    """Record a point-in-time event on the active trace (no-op if none)."""
+    trace = request_context.current('trace')
+    if trace is not None:
+        trace.add_event('i', name, time.perf_counter(), args=args)
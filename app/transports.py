@@ -0,0 +1,224 @@
+"""
+Mail transports used by the sender account pool.
+
+A transport delivers already-serialized messages for one sender account and
+keeps its connection (SMTP session or Gmail service object) open between
+messages. Transports are not thread-safe; the pool hands each one to a single
+worker at a time.
+"""
+
+import base64
+import logging
+import random
+import smtplib
+import time
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPTransport:
+    """Delivers messages over a reused SMTP session (Proton Mail Bridge and others)."""
+
+    # Serialize the way smtplib.send_message does
+    linesep = '\r\n'
+    mangle_from = True
+    sets_from_header = True
+
+    def __init__(self, smtp_settings):
+        """
+        Initialize the transport.
+
+        Args:
+            smtp_settings: Dict with smtp_server, smtp_port, smtp_use_tls,
+                smtp_username, smtp_password and from_email
+        """
+        self.smtp_server = smtp_settings.get('smtp_server', 'localhost')
+        self.smtp_port = smtp_settings.get('smtp_port', 1025)
+        self.smtp_use_tls = smtp_settings.get('smtp_use_tls', False)
+        self.smtp_username = smtp_settings.get('smtp_username', '')
+        self.smtp_password = smtp_settings.get('smtp_password', '')
+        # None means "use the requesting user's address", like sendEmailSMTP
+        self.from_email = smtp_settings.get('from_email')
+        self._server = None
+
+    def _connect(self):
+        with span('smtp.connect', server=f"{self.smtp_server}:{self.smtp_port}"):
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        try:
+            if self.smtp_use_tls:
+                with span('smtp.starttls'):
+                    server.starttls()
+            if self.smtp_username and self.smtp_password:
+                with span('smtp.auth'):
+                    server.login(self.smtp_username, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def open(self):
+        """Open the SMTP session now instead of on the first send."""
+        if self._server is None:
+            self._server = self._connect()
+
+    def send(self, from_addr, to_addrs, message):
+        """
+        Send one serialized message, reconnecting once if the session dropped.
+
+        Args:
+            from_addr: Envelope sender
+            to_addrs: List of envelope recipients
+            message: Message bytes
+        """
+        self.open()
+        try:
+            with span('smtp.data', size=len(message)):
+                self._server.sendmail(from_addr, to_addrs, message)
+        except smtplib.SMTPServerDisconnected:
+            logger.info(f"SMTP session to {self.smtp_server}:{self.smtp_port} dropped, reconnecting")
+            with span('smtp.retry'):
+                self._server = self._connect()
+                with span('smtp.data', size=len(message)):
+                    self._server.sendmail(from_addr, to_addrs, message)
+
+    def close(self):
+        """Close the SMTP session, if open."""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+
+class GmailTransport:
+    """Delivers messages through the Gmail API with one account's OAuth token."""
+
+    # Serialize the way Message.as_bytes() does; Gmail fills in the From header
+    linesep = '\n'
+    mangle_from = False
+    sets_from_header = False
+    from_email = None
+
+    SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+
+    def __init__(self, client_secret_file='client_secret.json', token_file=None):
+        """
+        Initialize the transport.
+
+        Args:
+            client_secret_file: OAuth client secret file
+            token_file: Pickled token file for this account (default: the
+                shared token_gmail_v1.pickle)
+        """
+        self.client_secret_file = client_secret_file
+        self.token_file = token_file
+        self._service = None
+        self._label_id = None
+
+    def _connect(self):
+        from Google import Create_Service
+        from corefunctions import createLabel
+        with span('gmail.connect'):
+            self._service = Create_Service(self.client_secret_file, 'gmail', 'v1', self.SCOPES,
+                                           pickle_file=self.token_file)
+            self._label_id = createLabel(self._service)
+
+    def open(self):
+        """Build the Gmail service and look up the label now instead of on the first send."""
+        if self._service is None:
+            self._connect()
+
+    def send(self, from_addr, to_addrs, message):
+        """
+        Send one serialized message and tag it with the PrivacyBot label.
+
+        Returns:
+            dict: The Gmail API send response
+        """
+        self.open()
+        raw_string = base64.urlsafe_b64encode(message).decode()
+        messages = self._service.users().messages()
+        with span('gmail.send', size=len(message)):
+            sent = messages.send(userId='me', body={'raw': raw_string}).execute()
+        with span('gmail.modify'):
+            messages.modify(userId='me', id=sent['id'], body={"addLabelIds": [self._label_id]}).execute()
+        return sent
+
+    def close(self):
+        """Drop the cached service object."""
+        self._service = None
+
+
+class NullTransport:
+    """Accepts and discards every message (dry runs and load tests)."""
+
+    linesep = '\r\n'
+    mangle_from = True
+    sets_from_header = True
+    from_email = None
+
+    def __init__(self, settings=None):
+        self.sent = 0
+
+    def open(self):
+        pass
+
+    def send(self, from_addr, to_addrs, message):
+        """Discard one message."""
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+class LatencyTransport(NullTransport):
+    """Discards messages after a simulated delivery delay, failing some at random."""
+
+    def __init__(self, settings=None):
+        """
+        Initialize the transport.
+
+        Args:
+            settings: Dict with latency_ms (mean delay), jitter_ms (uniform
+                +/- spread) and error_rate (fraction of sends that raise)
+        """
+        super().__init__(settings)
+        settings = settings or {}
+        self.latency = settings.get('latency_ms', 50) / 1000.0
+        self.jitter = settings.get('jitter_ms', 0) / 1000.0
+        self.error_rate = settings.get('error_rate', 0.0)
+
+    def send(self, from_addr, to_addrs, message):
+        """Wait the simulated delay, then discard or fail the message."""
+        with span('latency.send'):
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            raise smtplib.SMTPServerDisconnected("Simulated delivery failure")
+        self.sent += 1
+
+
+def create_transport(account):
+    """
+    Create the transport for a sender account config.
+
+    Args:
+        account: Dict with 'provider' ('smtp', 'gmail_api', or 'null' /
+            'latency' for dry runs) and its settings
+
+    Returns:
+        SMTPTransport, GmailTransport, NullTransport or LatencyTransport
+    """
+    provider = account.get('provider', 'smtp')
+    if provider == 'smtp':
+        return SMTPTransport(account.get('smtp_settings', {}))
+    if provider == 'gmail_api':
+        return GmailTransport(account.get('client_secret_file', 'client_secret.json'),
+                              account.get('token_file'))
+    if provider == 'null':
+        return NullTransport(account)
+    if provider == 'latency':
+        return LatencyTransport(account)
+    raise ValueError(f"Unknown email provider for sender account: {provider}")